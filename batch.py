@@ -0,0 +1,390 @@
+"""Offline batch mode: answer a JSONL file or a folder of PDFs without Telegram.
+
+    python batch.py course_catalog.jsonl --output answers.jsonl
+    python batch.py syllabi/ --output answers.jsonl --concurrency 8 --preset wise
+
+    python fake_llm.py --port 8089 &
+    python batch.py prompts.jsonl --api-url http://127.0.0.1:8089/v1/chat/completions
+
+JSONL records are {"id": ..., "prompt": "..."} or {"id": ..., "pdf": "path"},
+optionally with a "caption" and a "preset" or "settings" object; a
+directory is scanned for *.pdf files. Every item goes through the same
+system prompt, deadline parsing and generation budget as in the bot.
+Results are appended to the output as soon as each item is done, and items
+already answered there are skipped, so an interrupted run resumes where it
+stopped (failed items are retried). LLM options are read from config.ini.
+
+The OpenRouter key comes from ``deepseek_api_key`` in config.ini or the
+OPENROUTER_API_KEY environment variable; a local server (as above) needs
+none, any other URL without a key is refused before the run starts.
+"""
+import argparse
+import asyncio
+import configparser
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import LRUCache, TieredCache
+from deadlines import DeadlineStreamParser
+from functions import send_logs, configure_logging, default_settings, PERSONALITY_PRESETS, CHARS_PER_TOKEN
+from llm_client import DeepSeekClient, Reasoning, is_local_url
+from pdf_extractor import extract_text_from_pdf
+from prompts import PromptTemplate, generation_options
+from resilience import ResilientClient, CircuitBreaker, CircuitOpenError
+from summarize import DocumentSummarizer
+
+DEFAULT_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+DEFAULT_MODEL = "deepseek/deepseek-r1:free"
+PROGRESS_INTERVAL = 10.0  # seconds between progress lines in the log
+
+
+def extract_pdf_file(path, max_pages):
+    """Worker: text of the PDF at ``path``, "" if it has none"""
+    with open(path, 'rb') as f:
+        return extract_text_from_pdf(f.read(), max_pages)
+
+
+def read_items(source):
+    """Yield (item id, record) from a JSONL file or the PDFs under a directory"""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(".pdf"):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, source), {"pdf": path}
+        return
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                send_logs(f"{source}:{line_number}: invalid JSON, skipped ({str(e)})", 'warning')
+                continue
+            if not isinstance(record, dict) or not (record.get("prompt") or record.get("pdf")):
+                send_logs(f"{source}:{line_number}: no prompt or pdf, skipped", 'warning')
+                continue
+            if record.get("pdf") and not os.path.isabs(record["pdf"]):
+                # Relative to the JSONL file, not to where the batch was started
+                record["pdf"] = os.path.join(base, record["pdf"])
+            yield str(record.get("id", f"line-{line_number}")), record
+
+
+def load_checkpoint(path):
+    """Ids answered by earlier runs into the output file"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # the last line of a run that was killed mid-write
+            if "answer" in result:
+                done.add(result["id"])
+    return done
+
+
+class BatchRunner:
+    """Bounded extract -> prompt -> generate pipeline for batch items.
+
+    PDFs are extracted on a process pool, ``extract_workers`` at a time,
+    while up to ``concurrency`` generations stream. The queues between the
+    stages hold at most ``concurrency`` items, so memory stays flat however
+    large the input is.
+    """
+
+    def __init__(self, llm, template, summarizer, settings, concurrency=4, extract_workers=2,
+                 answer_max_tokens=2000, reasoning_effort="auto", pdf_token_budget=120000, max_pages=500):
+        self.llm = llm
+        self.template = template
+        self.summarizer = summarizer
+        self.settings = settings
+        self.concurrency = concurrency
+        self.extract_workers = extract_workers
+        self.answer_max_tokens = answer_max_tokens
+        self.reasoning_effort = reasoning_effort
+        self.pdf_token_budget = pdf_token_budget
+        self.max_pages = max_pages
+        self._pool = None
+        self.started = None
+        self.skipped = 0
+        self.completed = 0
+        self.failed = 0
+        self.tokens = 0
+        self.reasoning_tokens = 0
+
+    def _executor(self):
+        if self._pool is None:
+            # fork keeps workers from re-importing the __main__ module
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            self._pool = ProcessPoolExecutor(max_workers=self.extract_workers, mp_context=context)
+        return self._pool
+
+    def _settings(self, record):
+        if record.get("preset"):
+            preset = PERSONALITY_PRESETS.get(record["preset"])
+            if preset is None:
+                raise ValueError(f"Unknown preset: {record['preset']}")
+            return dict(preset["settings"])
+        settings = dict(self.settings)
+        settings.update(record.get("settings") or {})
+        return settings
+
+    async def _extract(self, record):
+        """User message for a record: the prompt itself, or the PDF text with its caption"""
+        if not record.get("pdf"):
+            return record["prompt"]
+        loop = asyncio.get_running_loop()
+        text = await loop.run_in_executor(self._executor(), extract_pdf_file, record["pdf"], self.max_pages)
+        if not text.strip():
+            raise ValueError("no text could be extracted from the PDF")
+        text = text[:self.pdf_token_budget * CHARS_PER_TOKEN]
+        # Long documents are condensed chunk by chunk first, like in the bot
+        text = await self.summarizer.condense(text)
+        caption = record.get("caption")
+        return f"Caption: {caption}\n\nPDF Content:\n{text}" if caption else text
+
+    async def _generate(self, content, settings):
+        system_prompt, _ = self.template.render(settings)
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": content}
+        ]
+        options = generation_options(settings, self.answer_max_tokens, self.reasoning_effort)
+        deadline_parser = DeadlineStreamParser()
+        parts = []
+        tokens = 0
+        reasoning_tokens = 0
+        async for delta in self.llm.stream_chat(messages, reasoning_deltas=True, **options):
+            tokens += 1
+            if isinstance(delta, Reasoning):
+                reasoning_tokens += 1
+                continue
+            parts.append(deadline_parser.feed(delta))
+        parts.append(deadline_parser.flush())
+        answer = "".join(parts).strip()
+        if not answer:
+            raise ValueError(f"no answer within {options['max_tokens']} tokens")
+        if settings["caps_lock"] == "ON":
+            answer = answer.upper()
+        self.tokens += tokens
+        self.reasoning_tokens += reasoning_tokens
+        return answer, deadline_parser.deadlines(), tokens, reasoning_tokens
+
+    async def _extract_worker(self, items, prepared, results):
+        while True:
+            item = await items.get()
+            if item is None:
+                return
+            item_id, record = item
+            try:
+                settings = self._settings(record)
+                content = await self._extract(record)
+            except Exception as e:
+                await results.put({"id": item_id, "error": str(e) or type(e).__name__})
+                continue
+            await prepared.put((item_id, record, settings, content))
+
+    async def _generate_worker(self, prepared, results):
+        while True:
+            item = await prepared.get()
+            if item is None:
+                return
+            item_id, record, settings, content = item
+            started = time.monotonic()
+            attempts = 0
+            while True:
+                try:
+                    answer, deadlines, tokens, reasoning_tokens = await self._generate(content, settings)
+                except CircuitOpenError:
+                    # The backend keeps failing: wait for the breaker instead of failing the rest of the batch
+                    attempts += 1
+                    if attempts > 3:
+                        result = {"id": item_id, "error": "the AI service is unavailable"}
+                        break
+                    await asyncio.sleep(self.llm.breaker.reset_timeout)
+                    continue
+                except Exception as e:
+                    result = {"id": item_id, "error": str(e) or type(e).__name__}
+                    break
+                result = {
+                    "id": item_id,
+                    "source": "pdf" if record.get("pdf") else "prompt",
+                    "preset": self.template.preset_name(settings),
+                    "answer": answer,
+                    "deadlines": deadlines,
+                    "tokens": tokens,
+                    "reasoning_tokens": reasoning_tokens,
+                    "seconds": round(time.monotonic() - started, 3),
+                }
+                break
+            await results.put(result)
+
+    async def _write(self, output, results):
+        # Earlier results stay, a line cut off by a killed run is ended first
+        cut_off = False
+        if os.path.exists(output) and os.path.getsize(output):
+            with open(output, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                cut_off = f.read(1) != b"\n"
+        with open(output, 'a', encoding='utf-8') as f:
+            if cut_off:
+                f.write("\n")
+            while True:
+                result = await results.get()
+                if result is None:
+                    return
+                if "error" in result:
+                    self.failed += 1
+                    send_logs(f"Batch item {result['id']} failed: {result['error']}", 'warning')
+                else:
+                    self.completed += 1
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                f.flush()
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            stats = self.stats()
+            send_logs(f"Batch progress: {stats['completed']} done, {stats['failed']} failed, "
+                      f"{stats['items_per_second']} items/s, {stats['tokens_per_second']} tokens/s", 'info')
+
+    async def run(self, items, output, done=()):
+        """Process ``items`` ((id, record) pairs), appending results to ``output``"""
+        self.started = time.monotonic()
+        queued = asyncio.Queue(self.concurrency)
+        prepared = asyncio.Queue(self.concurrency)
+        results = asyncio.Queue()
+        writer = asyncio.ensure_future(self._write(output, results))
+        extractors = [asyncio.ensure_future(self._extract_worker(queued, prepared, results))
+                      for _ in range(self.extract_workers)]
+        generators = [asyncio.ensure_future(self._generate_worker(prepared, results))
+                      for _ in range(self.concurrency)]
+        reporter = asyncio.ensure_future(self._report())
+        tasks = [writer, *extractors, *generators, reporter]
+        try:
+            for item_id, record in items:
+                if item_id in done:
+                    self.skipped += 1
+                    continue
+                await queued.put((item_id, record))
+            # Each stage is told to stop once the one before it has drained
+            for _ in extractors:
+                await queued.put(None)
+            await asyncio.gather(*extractors)
+            for _ in generators:
+                await prepared.put(None)
+            await asyncio.gather(*generators)
+            await results.put(None)
+            await writer
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.stats()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started if self.started is not None else 0.0
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "tokens": self.tokens,
+            "reasoning_tokens": self.reasoning_tokens,
+            "seconds": round(elapsed, 2),
+            "items_per_second": round(self.completed / elapsed, 3) if elapsed else 0.0,
+            "tokens_per_second": round(self.tokens / elapsed, 1) if elapsed else 0.0,
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+async def main(args):
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    api_url = args.api_url or config.get('default', 'deepseek_api_url', fallback=DEFAULT_API_URL)
+    api_key = config.get('default', 'deepseek_api_key', fallback='') or os.environ.get("OPENROUTER_API_KEY", "")
+    if not api_key and not is_local_url(api_url):
+        raise SystemExit(f"No API key for {api_url}: set deepseek_api_key in {args.config} "
+                         f"or the OPENROUTER_API_KEY environment variable")
+    configure_logging(
+        path=args.log,
+        level=config.get('default', 'log_level', fallback='INFO'),
+        json_lines=config.getboolean('default', 'log_json', fallback=False)
+    )
+
+    deepseek = DeepSeekClient(
+        api_url, api_key, args.model,
+        max_connections=args.concurrency,
+        connect_timeout=config.getfloat('default', 'llm_connect_timeout', fallback=5.0),
+        read_timeout=config.getfloat('default', 'llm_read_timeout', fallback=60.0),
+        http2=config.getboolean('default', 'llm_http2', fallback=True)
+    )
+    llm = ResilientClient(
+        deepseek,
+        retries=config.getint('default', 'llm_retries', fallback=2),
+        backoff_max=config.getfloat('default', 'llm_backoff_max', fallback=8.0),
+        breaker=CircuitBreaker(
+            failure_threshold=config.getint('default', 'llm_breaker_failures', fallback=5),
+            reset_timeout=config.getfloat('default', 'llm_breaker_reset', fallback=30.0)
+        ),
+        first_token_timeout=config.getfloat('default', 'llm_first_token_timeout', fallback=120.0),
+        stall_timeout=config.getfloat('default', 'llm_stall_timeout', fallback=30.0)
+    )
+    template = PromptTemplate(config.get('default', 'system_prompt_path', fallback='system_prompt.txt'))
+    summarizer = DocumentSummarizer(
+        llm, TieredCache(LRUCache(max_chars=64 * 1024 * 1024)),
+        max_concurrency=config.getint('default', 'pdf_summary_concurrency', fallback=4)
+    )
+    settings = dict(PERSONALITY_PRESETS[args.preset]["settings"]) if args.preset else dict(default_settings)
+    runner = BatchRunner(
+        llm, template, summarizer, settings,
+        concurrency=args.concurrency,
+        extract_workers=args.extract_workers,
+        answer_max_tokens=config.getint('default', 'answer_max_tokens', fallback=2000),
+        reasoning_effort=config.get('default', 'reasoning_effort', fallback='auto'),
+        max_pages=config.getint('default', 'pdf_max_pages', fallback=500)
+    )
+
+    done = set() if args.restart else load_checkpoint(args.output)
+    if done:
+        send_logs(f"Resuming: {len(done)} items already in {args.output}", 'info')
+    try:
+        stats = await runner.run(read_items(args.input), args.output, done)
+    finally:
+        runner.shutdown()
+        send_logs(f"Batch stats: {runner.stats()}", 'info')
+        await llm.close()
+    print(json.dumps(stats))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate answers for a JSONL file or a directory of PDFs")
+    parser.add_argument("input", help="JSONL file of prompts/PDF paths, or a directory of PDFs")
+    parser.add_argument("--output", default="batch_results.jsonl", help="results are appended here")
+    parser.add_argument("--config", default="config.ini")
+    parser.add_argument("--api-url", default=None, help="chat completions URL, overrides deepseek_api_url")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--preset", default=None, choices=sorted(PERSONALITY_PRESETS),
+                        help="personality for records without their own")
+    parser.add_argument("--concurrency", type=int, default=4, help="generations streamed at once")
+    parser.add_argument("--extract-workers", type=int, default=2, help="PDFs extracted at once")
+    parser.add_argument("--restart", action="store_true", help="ignore results already in the output")
+    parser.add_argument("--log", default="batch.log")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
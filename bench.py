@@ -0,0 +1,349 @@
+"""Load test for the bot handlers against a fake Telegram client and the fake LLM server.
+
+Every simulated user applies a preset, adjusts a setting, sends a text
+message and (for a share of users) a PDF, all through the real handlers in
+script.py. Startup time (import and create_app in a fresh interpreter) and
+the results per concurrency level are written to a JSON file.
+
+    python bench.py --users 1 10 100 1000 --output bench_results.json
+"""
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+from fake_llm import FakeLLMServer
+from functions import PERSONALITY_PRESETS
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+PRESET_IDS = [preset_id for preset_id in PERSONALITY_PRESETS if preset_id != "default"]
+
+
+def make_pdf(pages):
+    """Minimal valid PDF with one text block per page (list of line lists)"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in below
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for lines in pages:
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        stream = ("BT /F1 11 Tf 72 740 Td 14 TL " + " ".join(f"({line}) '" for line in escaped) + " ET").encode('latin-1', 'replace')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def current_rss():
+    """Resident set size in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 4)
+
+
+class FakeMessage:
+    __slots__ = ("chat_id", "id", "message")
+
+    def __init__(self, chat_id, message_id, text):
+        self.chat_id = chat_id
+        self.id = message_id
+        self.message = text
+
+
+class FakeTelegram:
+    """Stands in for TelegramClient: records sends and edits with a fixed API latency"""
+
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.sent = 0
+        self.edits = 0
+        self.first_edit_at = {}  # user_id -> monotonic time of the first edit since reset
+        self.handlers = []
+        self._ids = itertools.count(1)
+
+    def add_event_handler(self, callback, event_builder):
+        self.handlers.append((callback, event_builder))
+
+    async def send_message(self, entity, message, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+        return FakeMessage(entity, next(self._ids), message)
+
+    async def edit_message(self, message, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.edits += 1
+        self.first_edit_at.setdefault(message.chat_id, time.monotonic())
+        message.message = text
+        return message
+
+    async def iter_download(self, document, chunk_size=128 * 1024):
+        for start in range(0, len(document.data), chunk_size):
+            await asyncio.sleep(0)
+            yield document.data[start:start + chunk_size]
+
+
+class FakeMessageEvent:
+    def __init__(self, user_id, text="", document=None, caption=""):
+        self.sender_id = user_id
+        self.text = text
+        self.document = document
+        self.message = SimpleNamespace(message=caption)
+
+
+class FakeCallbackEvent:
+    def __init__(self, telegram, user_id, data):
+        self.telegram = telegram
+        self.sender_id = user_id
+        self.data = data.encode()
+
+    async def edit(self, text, buttons=None):
+        await asyncio.sleep(self.telegram.latency)
+        self.telegram.edits += 1
+
+
+class LLMServerThread:
+    """Runs FakeLLMServer on its own event loop so it does not compete with the bot"""
+
+    def __init__(self, **server_options):
+        self.server = FakeLLMServer(**server_options)
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result()
+        return self.server.url
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+def write_config(workdir, llm_url, args):
+    options = {
+        "api_id": "1",
+        "api_hash": "bench",
+        "BOT_TOKEN": "0:bench",
+        "deepseek_api_url": llm_url + "/v1/chat/completions",
+        "ollama_enabled": "false",
+        "metrics_port": "0",
+        "log_path": os.path.join(workdir, "bench.log"),
+        "log_level": args.log_level,
+        "system_prompt_path": os.path.join(REPO_DIR, "system_prompt.txt"),
+        "llm_max_concurrent": str(args.llm_concurrency),
+        "llm_max_connections": str(args.llm_concurrency),
+        "telegram_edits_per_second": str(args.edits_per_second),
+    }
+    with open(os.path.join(workdir, "config.ini"), "w") as f:
+        f.write("[default]\n" + "".join(f"{key} = {value}\n" for key, value in options.items()))
+
+
+def load_bot(workdir, telegram):
+    """Build the bot from ``workdir`` (for config.ini and sessions/) around the fake client"""
+    os.makedirs(os.path.join(workdir, "sessions"), exist_ok=True)
+    os.chdir(workdir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    bot = importlib.import_module("script")
+    bot.create_app(telegram_client=telegram)
+    return bot
+
+
+STARTUP_SNIPPET = """
+import time
+started = time.perf_counter()
+import script
+imported = time.perf_counter()
+script.create_app()
+print(imported - started, time.perf_counter() - started)
+"""
+
+
+def measure_startup(workdir, runs):
+    """Time a fresh interpreter importing script.py and building the app (no network)"""
+    os.makedirs(os.path.join(workdir, "sessions"), exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    imports, ready, process = [], [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", STARTUP_SNIPPET], cwd=workdir, env=env,
+                                capture_output=True, text=True, check=True).stdout.split()
+        process.append(time.perf_counter() - started)
+        imports.append(float(output[-2]))
+        ready.append(float(output[-1]))
+    return {
+        "runs": runs,
+        "import_p50_s": percentile(imports, 0.5),
+        "time_to_ready_p50_s": percentile(ready, 0.5),
+        "process_p50_s": percentile(process, 0.5),
+    }
+
+
+async def close_bot(bot):
+    await bot.llm.close()
+    await bot.edit_coalescer.close()
+    bot.pdf_extractor.shutdown()
+    bot.cache.close()
+    bot.deadline_store.close()
+    if bot.document_index is not None:
+        bot.document_index.close()
+    await bot.reminder_scheduler.close()
+    await bot.settings_store.close()
+    if bot.conversation_memory is not None:
+        await bot.conversation_memory.close()
+
+
+async def run_level(bot, telegram, users, args, level):
+    """One concurrency level: every user runs its session ``args.rounds`` times"""
+    latencies = {"callback": [], "text": [], "pdf": []}
+    first_preview = []
+    pdf_users = set(random.Random(level).sample(range(users), round(users * args.pdf_ratio)))
+
+    async def timed(kind, user_id, handler, event):
+        telegram.first_edit_at.pop(user_id, None)
+        started = time.monotonic()
+        await handler(event)
+        latencies[kind].append(time.monotonic() - started)
+        if kind != "callback" and user_id in telegram.first_edit_at:
+            first_preview.append(telegram.first_edit_at[user_id] - started)
+
+    async def session(index):
+        user_id = level * 1000000 + index
+        for round_number in range(args.rounds):
+            preset = PRESET_IDS[(index + round_number) % len(PRESET_IDS)]
+            await timed("callback", user_id, bot.on_preset_button, FakeCallbackEvent(telegram, user_id, f"preset:{preset}"))
+            await timed("callback", user_id, bot.on_adjust, FakeCallbackEvent(telegram, user_id, "adjust:brevity:0.3"))
+            text = f"User {user_id} round {round_number}: explain why recursion matters for the exam on trees."
+            await timed("text", user_id, bot.process_content, FakeMessageEvent(user_id, text=text))
+            if index in pdf_users:
+                pages = [[f"Lecture notes for user {user_id} round {round_number}, page {page + 1}.",
+                          "Binary trees, traversal orders and recursion depth."] for page in range(args.pdf_pages)]
+                document = SimpleNamespace(
+                    id=user_id * 100 + round_number, mime_type="application/pdf",
+                    attributes=[SimpleNamespace(file_name="notes.pdf")], data=make_pdf(pages)
+                )
+                await timed("pdf", user_id, bot.handle_document, FakeMessageEvent(user_id, document=document))
+
+    peak_rss = current_rss()
+    sampling = True
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while sampling:
+            peak_rss = max(peak_rss, current_rss())
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.ensure_future(sample_rss())
+    started = time.monotonic()
+    await asyncio.gather(*(session(index) for index in range(users)))
+    duration = time.monotonic() - started
+    sampling = False
+    await sampler
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "users": users,
+        "messages": len(all_latencies),
+        "duration_s": round(duration, 3),
+        "messages_per_sec": round(len(all_latencies) / duration, 2) if duration else None,
+        "latency_p50_s": percentile(all_latencies, 0.5),
+        "latency_p99_s": percentile(all_latencies, 0.99),
+        "latency_by_kind": {
+            kind: {"count": len(values), "p50_s": percentile(values, 0.5), "p99_s": percentile(values, 0.99)}
+            for kind, values in latencies.items()
+        },
+        "first_preview_p50_s": percentile(first_preview, 0.5),
+        "first_preview_p99_s": percentile(first_preview, 0.99),
+        "peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+    }
+
+
+async def run(args):
+    llm_thread = LLMServerThread(tokens_per_second=args.tokens_per_second, first_token_delay=args.first_token_delay)
+    llm_url = llm_thread.start()
+    output = os.path.abspath(args.output)
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    cwd = os.getcwd()
+    write_config(workdir, llm_url, args)
+    startup = None
+    if args.startup_runs:
+        startup = measure_startup(workdir, args.startup_runs)
+        print(f"Startup: import {startup['import_p50_s']}s, ready {startup['time_to_ready_p50_s']}s, "
+              f"whole process {startup['process_p50_s']}s (p50 of {args.startup_runs})")
+    telegram = FakeTelegram(latency=args.telegram_latency)
+    bot = load_bot(workdir, telegram)
+    results = []
+    try:
+        for users in args.users:
+            result = await run_level(bot, telegram, users, args, len(results) + 1)
+            results.append(result)
+            print(f"{users:>5} users: {result['messages_per_sec']} msg/s, p50 {result['latency_p50_s']}s, "
+                  f"p99 {result['latency_p99_s']}s, first preview p50 {result['first_preview_p50_s']}s, "
+                  f"peak RSS {result['peak_rss_mb']} MB")
+    finally:
+        await close_bot(bot)
+        llm_thread.stop()
+        os.chdir(cwd)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "startup": startup,
+        "results": results,
+        "telegram": {"sent": telegram.sent, "edits": telegram.edits},
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the bot handlers with fake Telegram and LLM backends")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--rounds", type=int, default=1, help="sessions per user at each level")
+    parser.add_argument("--pdf-ratio", type=float, default=0.1, help="share of users that also send a PDF")
+    parser.add_argument("--pdf-pages", type=int, default=5)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--edits-per-second", type=float, default=20.0)
+    parser.add_argument("--llm-concurrency", type=int, default=64)
+    parser.add_argument("--startup-runs", type=int, default=5, help="fresh-process startup measurements, 0 to skip")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", default="bench_results.json")
+    asyncio.run(run(parser.parse_args()))
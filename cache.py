@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import metrics
+from functions import send_logs
+
+LOOKUPS = metrics.counter("cache_lookups_total", "Cache lookups per namespace, tier and result",
+                          ["namespace", "tier", "result"])
+
+
+def content_hash(*parts):
+    """Stable sha256 over the given parts (strings, numbers, dicts, tuples)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, str):
+            part = json.dumps(part, sort_keys=True, ensure_ascii=False)
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def normalize_prompt(text):
+    """Collapse whitespace and case so trivially different prompts share a key"""
+    return " ".join(text.split()).casefold()
+
+
+class LRUCache:
+    """In-memory LRU tier bounded by the total length of the cached strings.
+
+    With a ``ttl`` entries expire like the disk tier's, so the memory tier
+    never serves an answer the disk tier has already dropped.
+    """
+
+    def __init__(self, max_chars=16 * 1024 * 1024, ttl=None):
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self.size = 0
+        self._data = OrderedDict()  # key -> (value, expires_at or None)
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            self.size -= len(value)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, expires_at=None):
+        """Cache ``value`` until ``expires_at`` (epoch seconds), by default ``ttl`` from now"""
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.size -= len(old[0])
+        if len(value) > self.max_chars:
+            return
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        self._data[key] = (value, expires_at)
+        self.size += len(value)
+        while self.size > self.max_chars:
+            _, (evicted, _) = self._data.popitem(last=False)
+            self.size -= len(evicted)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """On-disk tier with per-entry TTL and least-recently-used size eviction"""
+
+    EVICT_EVERY = 50  # writes between size checks
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache(accessed_at)")
+        self._db.commit()
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key):
+        """(value, expires_at) of a live entry, None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return row
+
+    def set(self, key, value):
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + self.ttl, now)
+            )
+            self._db.commit()
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total > self.max_bytes:
+            # Drop least recently used rows until we are back under the limit
+            rows = self._db.execute("SELECT key, size FROM cache ORDER BY accessed_at").fetchall()
+            victims = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                victims.append((key,))
+                total -= size
+            self._db.executemany("DELETE FROM cache WHERE key = ?", victims)
+            send_logs("Cache evicted %s entries from %s", 'info', len(victims), self.path)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class TieredCache:
+    """LRU memory tier in front of an optional SQLite tier.
+
+    Keys are namespaced as ``"<namespace>:<id>"``; hit/miss counters are
+    kept per namespace and tier (and exported as cache_lookups_total) so
+    each use can be sized separately.
+    """
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.memory_hits = defaultdict(int)
+        self.disk_hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    async def get(self, key):
+        namespace = key.split(":", 1)[0]
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits[namespace] += 1
+            LOOKUPS.labels(namespace, "memory", "hit").inc()
+            return value
+        LOOKUPS.labels(namespace, "memory", "miss").inc()
+        if self.disk is not None:
+            try:
+                entry = await asyncio.to_thread(self.disk.get_entry, key)
+            except Exception as e:
+                send_logs("Cache read error: %s", 'warning', e)
+                entry = None
+            if entry is not None:
+                self.disk_hits[namespace] += 1
+                LOOKUPS.labels(namespace, "disk", "hit").inc()
+                # Keep the disk tier's expiry, a promotion must not extend it
+                self.memory.set(key, entry[0], expires_at=entry[1])
+                return entry[0]
+            LOOKUPS.labels(namespace, "disk", "miss").inc()
+        self.misses[namespace] += 1
+        return None
+
+    async def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value)
+            except Exception as e:
+                send_logs("Cache write error: %s", 'warning', e)
+
+    def stats(self):
+        """Hit/miss counters per namespace plus memory tier usage"""
+        namespaces = set(self.memory_hits) | set(self.disk_hits) | set(self.misses)
+        stats = {"memory_entries": len(self.memory), "memory_chars": self.memory.size}
+        for namespace in sorted(namespaces):
+            hits = self.memory_hits[namespace] + self.disk_hits[namespace]
+            lookups = hits + self.misses[namespace]
+            stats[namespace] = {
+                "memory_hits": self.memory_hits[namespace],
+                "disk_hits": self.disk_hits[namespace],
+                "misses": self.misses[namespace],
+                "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+            }
+        return stats
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
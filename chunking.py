@@ -0,0 +1,138 @@
+import re
+
+# Telegram counts message length in UTF-16 code units, not Python characters
+_DELIMITER = re.compile(r"```|`|\*\*|__|~~")
+_FENCE_LANGUAGE = re.compile(r"[\w+-]*\n")
+_CLOSERS_RESERVE = 16  # room for the delimiters closed at the end of a chunk
+
+
+def utf16_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _fit(text, units):
+    """Number of leading characters of ``text`` that fit in ``units`` UTF-16 code units"""
+    if len(text) <= units and utf16_len(text) <= units:
+        return len(text)
+    # A surrogate pair cut in half is dropped by the decoder
+    return len(text.encode('utf-16-le')[:units * 2].decode('utf-16-le', errors='ignore'))
+
+
+def _open_entities(text):
+    """Markdown entities left open at the end of ``text``, as (delimiter, opener) in opening order"""
+    opened = []
+    for match in _DELIMITER.finditer(text):
+        delimiter = match.group()
+        if opened and opened[-1][0] in ("```", "`"):
+            # Nothing is parsed inside code, only its own delimiter closes it
+            if delimiter == opened[-1][0]:
+                opened.pop()
+            continue
+        for index, (open_delimiter, _) in enumerate(opened):
+            if open_delimiter == delimiter:
+                del opened[index]
+                break
+        else:
+            opener = delimiter
+            if delimiter == "```":
+                language = _FENCE_LANGUAGE.match(text, match.end())
+                opener = "```" + (language.group() if language else "")
+            opened.append((delimiter, opener))
+    return opened
+
+
+def _inside_link(text, position):
+    # "[text" opened before the position and not closed by "](url)" yet
+    return text.rfind("[", 0, position) > max(text.rfind("]", 0, position), text.rfind(")", 0, position))
+
+
+def _split_point(text, units):
+    """(end of the head, start of the rest) for a cut at most ``units`` long"""
+    cut = _fit(text, units)
+    lowest = cut // 2  # never leave a tiny chunk behind for a nicer boundary
+    for separator in ("\n\n", "\n", " "):
+        position = text.rfind(separator, lowest, cut)
+        while position > 0 and _inside_link(text, position):
+            position = text.rfind(separator, lowest, position)
+        if position > 0:
+            return position, position + len(separator)
+    # One long word: cut it, but not between the two halves of a ** delimiter
+    while cut > 1 and text[cut - 1] in "*_~`" and text[cut] == text[cut - 1]:
+        cut -= 1
+    return cut, cut
+
+
+class ChunkedStreamBuffer:
+    """Cuts streamed text into Telegram-sized messages as soon as each one fills.
+
+    ``feed`` returns the chunks that became final. Chunks end at a paragraph,
+    line or word boundary, never split a UTF-16 surrogate pair, and Markdown
+    entities still open at the cut are closed and reopened in the next chunk.
+    Only the unfinished chunk is kept, so copying stays linear in the text.
+    """
+
+    def __init__(self, limit=4000):
+        self.limit = limit
+        self._parts = []
+        self._units = 0      # UTF-16 length of the unfinished chunk
+        self._reopened = ""  # delimiters reopened at the start of the unfinished chunk
+        self.consumed = 0    # characters of the fed text that are in finished chunks
+        self.chunks = 0
+
+    def feed(self, text):
+        if not text:
+            return []
+        self._parts.append(text)
+        self._units += utf16_len(text)
+        finished = []
+        while self._units > self.limit:
+            finished.append(self._cut())
+        return finished
+
+    def _cut(self):
+        text = "".join(self._parts)
+        end, start = _split_point(text, self.limit - _CLOSERS_RESERVE)
+        head = text[:end]
+        opened = _open_entities(head)
+        closers = "".join("\n```" if delimiter == "```" else delimiter for delimiter, _ in reversed(opened))
+        reopened = "".join(opener for _, opener in opened)
+
+        self.consumed += start - len(self._reopened)
+        self.chunks += 1
+        self._reopened = reopened
+        rest = reopened + text[start:]
+        self._parts = [rest]
+        self._units = utf16_len(rest)
+        return head + closers
+
+    def tail(self):
+        """The unfinished chunk, for live previews"""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def replace_tail(self, text):
+        """Swap the unfinished chunk for ``text`` (the final version of the rest of the answer)"""
+        self._parts = [self._reopened + text]
+        self._units = utf16_len(self._parts[0])
+
+    def flush(self):
+        """Every chunk still unfinished, once the stream has ended"""
+        finished = []
+        while self._units > self.limit:
+            finished.append(self._cut())
+        last = self.tail()
+        if last[len(self._reopened):].strip():
+            finished.append(last)
+            self.chunks += 1
+        self.consumed += len(last) - len(self._reopened)
+        self._parts = []
+        self._units = 0
+        self._reopened = ""
+        return finished
+
+
+def split_message(text, limit=4000):
+    """Split a complete answer the same way ChunkedStreamBuffer splits a stream"""
+    buffer = ChunkedStreamBuffer(limit)
+    return buffer.feed(text) + buffer.flush()
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import re
+import time
+from collections import OrderedDict, deque
+
+from functions import send_logs, estimate_tokens, CHARS_PER_TOKEN
+from prompts import summary_options
+
+# Messages that build on the chat so far instead of asking something new
+FOLLOW_UP = re.compile(
+    r"\byou (?:said|mentioned|wrote|told|meant)\b"
+    r"|\byour (?:last|previous|earlier|first) (?:answer|reply|message|point)\b"
+    r"|\b(?:that|this|the) (?:answer|reply|explanation|example|point)\b"
+    r"|\b(?:above|again|continue|go on|more detail|more about|what about|how about)\b"
+    r"|\b(?:shorter|simpler|longer|elaborate|rephrase|another example)\b"
+    r"|^\s*(?:and|but|so|why|how come|really|ok|okay|what if)\b"
+    r"|mai sus|din nou|continuă|continua|выше|снова|ещё|еще|продолжи",
+    re.IGNORECASE
+)
+_WORD = re.compile(r"\w+")
+
+
+def refers_to_conversation(text):
+    """True if a message only makes sense with the chat so far ("shorter", "why?", "you said...")"""
+    # A few words on their own ("example?", "in Romanian") continue the last exchange
+    return FOLLOW_UP.search(text) is not None or len(_WORD.findall(text)) <= 3
+
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a chat between a student and an assistant. "
+    "Merge the previous summary and the new turns into one short summary of what the assistant "
+    "should remember: topics, tasks, deadlines, documents and the student's preferences. "
+    "Be factual and concise, no commentary, no personality."
+)
+
+
+class Conversation:
+    """Recent turns of one user as a ring buffer, plus a summary of older ones"""
+
+    __slots__ = ("turns", "summary", "tokens", "rolled")
+
+    def __init__(self, turns=(), summary="", rolled=()):
+        self.turns = deque(turns)  # [role, text]
+        self.summary = summary
+        self.tokens = sum(estimate_tokens(text) for _, text in self.turns)
+        self.rolled = list(rolled)  # turns pushed out of the window, kept until a summary includes them
+
+    def to_bytes(self):
+        return json.dumps({"s": self.summary, "t": list(self.turns), "r": self.rolled}, ensure_ascii=False,
+                          separators=(",", ":")).encode('utf-8')
+
+    @classmethod
+    def from_bytes(cls, data):
+        state = json.loads(data)
+        return cls((tuple(turn) for turn in state["t"]), state["s"],
+                   (tuple(turn) for turn in state.get("r", ())))
+
+
+class ConversationMemory:
+    """Per-user chat history with a constant-size prompt footprint.
+
+    The newest turns are kept verbatim within ``token_budget`` (and at most
+    ``max_turns``); turns that fall out of the window are folded into a
+    running summary by a background LLM call, so neither the prompt nor
+    the stored history grows with the length of the chat. History is saved
+    through a settings backend (settings_store.create_backend), whose TTL
+    expires idle conversations.
+
+    Like SettingsStore, cached conversations are reloaded after ``cache_ttl``
+    seconds, so a process that serves a user again after another one did
+    (or after /newchat cleared the backend) does not write old history back.
+    """
+
+    def __init__(self, backend, llm, token_budget=1500, max_turns=20, summary_tokens=300, max_cached=10000,
+                 cache_ttl=30.0):
+        self.backend = backend
+        self.llm = llm
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.summary_tokens = summary_tokens
+        self.max_cached = max_cached
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()  # user_id -> (Conversation, time cached)
+        self._summarizing = {}       # user_id -> background summary task
+        self.summaries = 0
+        self.summary_failures = 0
+
+    async def _get(self, user_id):
+        cached = self._cache.get(user_id)
+        # A summary being written holds this copy and saves it when done, keep using it
+        if cached is not None and (self.cache_ttl is None or user_id in self._summarizing
+                                   or time.monotonic() - cached[1] < self.cache_ttl):
+            self._cache.move_to_end(user_id)
+            return cached[0]
+        try:
+            data = await self.backend.load(user_id)
+            conversation = Conversation.from_bytes(data) if data else Conversation()
+        except Exception as e:
+            send_logs("Conversation load error for user %s: %s", 'warning', user_id, e)
+            if cached is not None:
+                return cached[0]
+            conversation = Conversation()
+        # Another coroutine may have filled the cache while we were waiting
+        current = self._cache.get(user_id)
+        if current is not None and current is not cached:
+            return current[0]
+        self._cache[user_id] = (conversation, time.monotonic())
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)  # a summary still running saves its copy when done
+        return conversation
+
+    async def _save(self, user_id, conversation):
+        try:
+            await self.backend.save(user_id, conversation.to_bytes())
+        except Exception as e:
+            send_logs("Conversation save error for user %s: %s", 'error', user_id, e)
+
+    async def context(self, user_id):
+        """Chat messages to put between the system prompt and the new user message"""
+        conversation = await self._get(user_id)
+        messages = []
+        if conversation.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{conversation.summary}"})
+        messages.extend({"role": role, "content": text} for role, text in conversation.turns)
+        return messages
+
+    async def record(self, user_id, user_text, assistant_text):
+        """Append one exchange; turns pushed out of the window are summarized in the background"""
+        conversation = await self._get(user_id)
+        # A single long answer may not take over the whole window
+        max_chars = self.token_budget // 3 * CHARS_PER_TOKEN
+        for role, text in (("user", user_text), ("assistant", assistant_text)):
+            text = text if len(text) <= max_chars else text[:max_chars] + " [...]"
+            conversation.turns.append((role, text))
+            conversation.tokens += estimate_tokens(text)
+        while conversation.turns and (conversation.tokens > self.token_budget or len(conversation.turns) > self.max_turns):
+            role, text = conversation.turns.popleft()
+            conversation.tokens -= estimate_tokens(text)
+            conversation.rolled.append((role, text))
+        # While summaries keep failing, only the newest rolled turns are kept for the next try
+        rolled_tokens = sum(estimate_tokens(text) for _, text in conversation.rolled)
+        while rolled_tokens > self.token_budget and len(conversation.rolled) > 2:
+            _, text = conversation.rolled.pop(0)
+            rolled_tokens -= estimate_tokens(text)
+        await self._save(user_id, conversation)
+        if conversation.rolled and user_id not in self._summarizing:
+            task = self._summarizing[user_id] = asyncio.ensure_future(self._roll_up(user_id, conversation))
+            # Only forget this task: after a clear, a newer one may be registered already
+            task.add_done_callback(lambda t: self._summarizing.get(user_id) is t and self._summarizing.pop(user_id))
+
+    async def _roll_up(self, user_id, conversation):
+        # Turns rolled while a summary is being written are picked up by the next round.
+        # They stay in ``rolled`` (and in storage) until a summary covers them, so a
+        # failed summary is retried after the next exchange instead of losing them.
+        while conversation.rolled:
+            rolled = list(conversation.rolled)
+            turns = "\n".join(f"{role}: {text}" for role, text in rolled)
+            messages = [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"Previous summary:\n{conversation.summary or '(none)'}\n\nNew turns:\n{turns}"}
+            ]
+            try:
+                parts = []
+                async for content in self.llm.stream_chat(messages, **summary_options(self.summary_tokens)):
+                    parts.append(content)
+                summary = "".join(parts).strip()
+            except Exception as e:
+                self.summary_failures += 1
+                send_logs("Conversation summary failed for user %s: %s", 'warning', user_id, e)
+                return
+            if not summary:
+                self.summary_failures += 1
+                send_logs("Conversation summary for user %s came back empty", 'warning', user_id)
+                return
+            conversation.summary = summary
+            # Drop exactly the summarized turns, others may have been rolled meanwhile
+            for turn in rolled:
+                if conversation.rolled and conversation.rolled[0] == turn:
+                    conversation.rolled.pop(0)
+            self.summaries += 1
+            await self._save(user_id, conversation)
+
+    async def clear(self, user_id):
+        self._cache.pop(user_id, None)
+        task = self._summarizing.pop(user_id, None)
+        if task is not None:
+            task.cancel()
+        try:
+            await self.backend.delete(user_id)
+        except Exception as e:
+            send_logs("Conversation delete error for user %s: %s", 'warning', user_id, e)
+
+    def stats(self):
+        return {
+            "cached": len(self._cache),
+            "summarizing": len(self._summarizing),
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures,
+        }
+
+    async def close(self):
+        tasks = list(self._summarizing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.backend.close()
@@ -0,0 +1,184 @@
+import asyncio
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from functions import send_logs
+
+JSON_MARKER = "###JSON###"
+END_MARKER = "###END###"  # the system prompt closes the block with it, used as a stop sequence
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```\s*$")
+
+
+class DeadlineStreamParser:
+    """Splits the ``###JSON###`` deadline block off a token stream.
+
+    ``feed`` returns the text that is safe to show the user. Text that might
+    be the start of the marker is held back until the next chunk decides it,
+    and everything after the marker is collected for ``deadlines``.
+    """
+
+    def __init__(self, marker=JSON_MARKER):
+        self.marker = marker
+        self._held = ""
+        self._block = []
+        self.in_block = False
+
+    def feed(self, chunk):
+        if self.in_block:
+            self._block.append(chunk)
+            return ""
+
+        text = self._held + chunk
+        index = text.find(self.marker)
+        if index >= 0:
+            self.in_block = True
+            self._held = ""
+            self._block.append(text[index + len(self.marker):])
+            return text[:index]
+
+        # Hold back the longest suffix that is a prefix of the marker
+        keep = 0
+        for size in range(min(len(self.marker) - 1, len(text)), 0, -1):
+            if self.marker.startswith(text[-size:]):
+                keep = size
+                break
+        self._held = text[len(text) - keep:] if keep else ""
+        return text[:len(text) - keep]
+
+    def flush(self):
+        """Visible text still held back once the stream has ended"""
+        held, self._held = self._held, ""
+        return held
+
+    def block(self):
+        return "".join(self._block)
+
+    def deadlines(self):
+        """Validated deadlines from the JSON block, [] if there is none"""
+        if not self.in_block:
+            return []
+        return parse_deadline_block(self.block())
+
+
+def _clean_field(value):
+    if isinstance(value, list) and len(value) == 1:
+        value = value[0]
+    if not isinstance(value, str):
+        return None
+    value = value.strip().strip("[]").strip()
+    return value or None
+
+
+def validate_deadline(item):
+    """Return a normalized deadline dict or None if the item is not usable"""
+    if not isinstance(item, dict):
+        return None
+    name = _clean_field(item.get("object_name"))
+    due = _clean_field(item.get("deadline"))
+    context = _clean_field(item.get("context")) or ""
+    if not name or not due:
+        return None
+    try:
+        due_date = datetime.date.fromisoformat(due[:10])
+    except ValueError:
+        return None
+    return {"object_name": name, "deadline": due_date.isoformat(), "context": context}
+
+
+def parse_deadline_block(block):
+    """Parse the model's JSON block; tolerates code fences and trailing commas"""
+    block = _CODE_FENCE.sub("", block.strip())
+    start = min((i for i in (block.find("{"), block.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        return []
+    block = _TRAILING_COMMA.sub(r"\1", block[start:])
+
+    decoder = json.JSONDecoder()
+    items = []
+    position = 0
+    while position < len(block):
+        try:
+            value, end = decoder.raw_decode(block, position)
+        except json.JSONDecodeError:
+            if block[position] != "[":
+                break
+            # A list cut off by the token limit: keep the entries that are complete
+            position += 1
+            while position < len(block) and block[position] in " \t\r\n":
+                position += 1
+            continue
+        items.extend(value if isinstance(value, list) else [value])
+        # Skip whitespace and separators between consecutive objects
+        position = end
+        while position < len(block) and block[position] in " \t\r\n,":
+            position += 1
+
+    deadlines = [d for d in (validate_deadline(item) for item in items) if d]
+    if items and not deadlines:
+        send_logs("Deadline block had no valid entries: %r", 'warning', block[:200])
+    return deadlines
+
+
+class DeadlineStore:
+    """Per-user deadlines in SQLite, indexed by (user_id, due date) and by due date"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS deadlines ("
+            "id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, due_date TEXT NOT NULL, "
+            "object_name TEXT NOT NULL, context TEXT NOT NULL, created_at REAL NOT NULL, "
+            "UNIQUE (user_id, due_date, object_name))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS deadlines_due ON deadlines(due_date)")
+        self._db.commit()
+
+    def _add(self, user_id, deadlines):
+        now = time.time()
+        with self._lock:
+            cursor = self._db.executemany(
+                "INSERT OR IGNORE INTO deadlines (user_id, due_date, object_name, context, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(user_id, d["deadline"], d["object_name"], d["context"], now) for d in deadlines]
+            )
+            self._db.commit()
+            return cursor.rowcount
+
+    def _upcoming(self, user_id, from_date, limit):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT due_date, object_name, context FROM deadlines "
+                "WHERE user_id = ? AND due_date >= ? ORDER BY due_date LIMIT ?",
+                (user_id, from_date.isoformat(), limit)
+            ).fetchall()
+        return [{"deadline": due, "object_name": name, "context": context} for due, name, context in rows]
+
+    async def add(self, user_id, deadlines):
+        """Store deadlines for a user, returns how many were new"""
+        if not deadlines:
+            return 0
+        added = await asyncio.to_thread(self._add, user_id, deadlines)
+        send_logs("Stored %s new deadlines for user %s", 'info', added, user_id)
+        return added
+
+    async def upcoming(self, user_id, from_date, limit=10):
+        """Next deadlines of a user due on or after from_date"""
+        return await asyncio.to_thread(self._upcoming, user_id, from_date, limit)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,218 @@
+import asyncio
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from functions import send_logs, estimate_tokens
+
+# Messages that ask about an uploaded file rather than a new topic. Generic nouns
+# ("this text", "my notes", "the file") are left out: pasted assignments use them too
+DOCUMENT_REFERENCE = re.compile(
+    r"\b(?:the|this|that|my|your|uploaded|attached)\s+(?:document|doc|pdf|paper|lecture|article)s?\b"
+    r"|\bpdf\b"
+    r"|документ|documentul",
+    re.IGNORECASE
+)
+_WORD = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "the a an and or of to in on at for from by with about into over under is are was were be been being "
+    "this that these those it its they them their there here what which who whom whose when where why how "
+    "do does did doing done can could should would will shall may might must not no yes please tell me my "
+    "your you our we us i document documents doc pdf file paper notes text article say says said explain "
+    "summarize summary describe give show".split()
+)
+
+
+def refers_to_document(text):
+    """True if a message asks about a previously uploaded document"""
+    return DOCUMENT_REFERENCE.search(text) is not None
+
+
+def split_passages(text, passage_tokens=250):
+    """Pack paragraphs of ``text`` into passages of roughly ``passage_tokens`` tokens"""
+    passages = []
+    current = []
+    size = 0
+    max_chars = passage_tokens * 4
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        while len(paragraph) > max_chars:
+            # A page without blank lines: cut it at the last space before the limit
+            cut = paragraph.rfind(" ", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            passages.append(paragraph[:cut])
+            paragraph = paragraph[cut:].strip()
+        if not paragraph:
+            continue
+        if current and size + len(paragraph) > max_chars:
+            passages.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += len(paragraph)
+    if current:
+        passages.append("\n\n".join(current))
+    return passages
+
+
+def _words(text):
+    # Folded like the FTS5 tokenizer (remove_diacritics), so coverage agrees with MATCH
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return _WORD.findall("".join(c for c in decomposed if not unicodedata.combining(c)))
+
+
+def _query_terms(text):
+    """Content words of ``text``, at most 32"""
+    terms = []
+    for word in _words(text):
+        if len(word) > 2 and word not in _STOPWORDS and word not in terms:
+            terms.append(word)
+    return terms[:32]
+
+
+def _match_query(terms):
+    """FTS5 query matching any of ``terms``"""
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+class DocumentIndex:
+    """Per-user full-text index of uploaded documents (SQLite FTS5, BM25 ranking).
+
+    Each document is split into passages of a few hundred tokens. Follow-up
+    questions retrieve the best passages within a token budget instead of
+    resending the whole text. Only the newest ``max_documents`` documents
+    per user are kept, and documents older than ``ttl`` seconds are dropped.
+    A passage is only retrieved if it contains at least ``min_coverage`` of
+    the question's content words, so a message that merely shares a word or
+    two with a document does not pull it in.
+    """
+
+    def __init__(self, path, max_documents=5, ttl=30 * 86400, passage_tokens=250, min_coverage=0.25):
+        self.path = path
+        self.max_documents = max_documents
+        self.ttl = ttl
+        self.passage_tokens = passage_tokens
+        self.min_coverage = min_coverage
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.hits = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, name TEXT NOT NULL, "
+            "content_hash TEXT NOT NULL, created_at REAL NOT NULL, "
+            "UNIQUE (user_id, content_hash))"
+        )
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5("
+            "text, user_id UNINDEXED, document_id UNINDEXED, position UNINDEXED, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        self._db.commit()
+
+    def _delete(self, document_ids):
+        for document_id in document_ids:
+            self._db.execute("DELETE FROM passages WHERE document_id = ?", (document_id,))
+            self._db.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+
+    def _add(self, user_id, name, content_hash, text):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM documents WHERE user_id = ? AND content_hash = ?", (user_id, content_hash)
+            ).fetchone()
+            if row is not None:
+                # Already indexed: just make it the newest document again
+                self._db.execute("UPDATE documents SET created_at = ?, name = ? WHERE id = ?", (now, name, row[0]))
+                self._db.commit()
+                return 0
+            document_id = self._db.execute(
+                "INSERT INTO documents (user_id, name, content_hash, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, name, content_hash, now)
+            ).lastrowid
+            passages = split_passages(text, self.passage_tokens)
+            self._db.executemany(
+                "INSERT INTO passages (text, user_id, document_id, position) VALUES (?, ?, ?, ?)",
+                [(passage, user_id, document_id, position) for position, passage in enumerate(passages)]
+            )
+            stale = self._db.execute(
+                "SELECT id FROM documents WHERE user_id = ? AND (created_at < ? OR id NOT IN "
+                "(SELECT id FROM documents WHERE user_id = ? ORDER BY created_at DESC LIMIT ?))",
+                (user_id, now - self.ttl, user_id, self.max_documents)
+            ).fetchall()
+            self._delete(document_id for document_id, in stale)
+            self._db.commit()
+            return len(passages)
+
+    def _search(self, user_id, query, token_budget, limit):
+        with self._lock:
+            documents = dict(self._db.execute(
+                "SELECT id, name FROM documents WHERE user_id = ? AND created_at >= ?",
+                (user_id, time.time() - self.ttl)
+            ).fetchall())
+            if not documents:
+                return []
+            terms = _query_terms(query)
+            if terms:
+                # A question whose content words the passages do not (mostly) contain
+                # is not about the documents: retrieve nothing
+                rows = self._db.execute(
+                    "SELECT document_id, position, text FROM passages "
+                    "WHERE passages MATCH ? AND user_id = ? ORDER BY bm25(passages) LIMIT ?",
+                    (_match_query(terms), user_id, limit * 4)
+                ).fetchall()
+                needed = max(1, math.ceil(len(terms) * self.min_coverage))
+                rows = [row for row in rows
+                        if row[0] in documents and len(set(terms).intersection(_words(row[2]))) >= needed][:limit]
+            else:
+                # Nothing specific asked ("summarize the document"): start of the newest one
+                newest = self._db.execute(
+                    "SELECT id FROM documents WHERE user_id = ? ORDER BY created_at DESC LIMIT 1", (user_id,)
+                ).fetchone()[0]
+                rows = self._db.execute(
+                    "SELECT document_id, position, text FROM passages WHERE document_id = ? "
+                    "ORDER BY position LIMIT ?", (newest, limit)
+                ).fetchall()
+
+        picked = []
+        tokens = 0
+        for document_id, position, text in rows:
+            passage_tokens = estimate_tokens(text)
+            if tokens + passage_tokens > token_budget:
+                continue
+            picked.append((document_id, position, text))
+            tokens += passage_tokens
+        # Present passages in reading order, not score order
+        picked.sort()
+        return [(documents[document_id], position, text) for document_id, position, text in picked]
+
+    async def add(self, user_id, name, content_hash, text):
+        """Index a document for a user, returns the number of new passages"""
+        added = await asyncio.to_thread(self._add, user_id, name, content_hash, text)
+        if added:
+            send_logs("Indexed %s for user %s: %s passages", 'info', name, user_id, added)
+        return added
+
+    async def search(self, user_id, query, token_budget=3000, limit=20):
+        """Best passages for ``query`` within ``token_budget``, as (document name, position, text)"""
+        passages = await asyncio.to_thread(self._search, user_id, query, token_budget, limit)
+        self.searches += 1
+        if passages:
+            self.hits += 1
+        return passages
+
+    def stats(self):
+        return {"searches": self.searches, "hits": self.hits}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,248 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from telethon.errors import FloodWaitError, MessageNotModifiedError
+
+import metrics
+from functions import send_logs
+
+TELEGRAM_SECONDS = metrics.histogram("telegram_request_seconds", "Telegram API call latency", ["method"])
+FLOOD_WAITS = metrics.counter("telegram_flood_waits_total", "FloodWait errors returned by Telegram", ["method"])
+
+
+class EditCoalescer:
+    """Central rate limiter for Telegram message edits.
+
+    Live previews are submitted with ``submit`` and only the latest text per
+    message is kept. A background task sends them round-robin under a global
+    edits-per-second budget, up to ``max_concurrent_edits`` at once and one
+    at a time per message, skips edits whose text did not change and backs
+    off for every message on FloodWait. Final edits go through ``edit_now``,
+    which jumps the preview queue but still respects the budget.
+    """
+
+    def __init__(self, client, edits_per_second=20.0, min_interval=2.0, max_interval=15.0, max_concurrent_edits=8):
+        self.client = client
+        self.edits_per_second = edits_per_second
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_concurrent_edits = max_concurrent_edits
+
+        self._pending = OrderedDict()   # key -> (message, text)
+        self._live = set()              # keys still accepting previews
+        self._inflight = {}             # key -> Event set when its preview edit returns
+        self._last_text = {}            # key -> text last shown
+        self._next_allowed = {}         # key -> monotonic time of the next preview edit
+        self._paused_until = 0.0
+        self._backoff = 1.0
+        self._tokens = edits_per_second
+        self._refilled_at = time.monotonic()
+        self._wakeup = None
+        self._slots = None
+        self._sending = set()           # preview edits on the wire
+        self._task = None
+
+        # Metrics
+        self.edits_sent = 0
+        self.coalesced = 0
+        self.skipped_unchanged = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+
+    @staticmethod
+    def _key(message):
+        return (message.chat_id, message.id)
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrent_edits)
+            self._task = asyncio.ensure_future(self._run())
+
+    def submit(self, message, text):
+        """Queue a preview edit, replacing any preview still waiting for this message"""
+        self._ensure_running()
+        key = self._key(message)
+        if key in self._pending:
+            self.coalesced += 1
+        self._live.add(key)
+        self._pending[key] = (message, text)
+        self._wakeup.set()
+
+    async def edit_now(self, message, text):
+        """Edit a message as soon as the budget allows and stop its previews"""
+        key = self._key(message)
+        self._live.discard(key)
+        self._pending.pop(key, None)
+        # Never let a preview that is already on the wire land after the final text
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            await inflight.wait()
+        try:
+            while True:
+                await self._wait_pause()
+                await self._take_token()
+                try:
+                    await self._edit(message, text)
+                    self.edits_sent += 1
+                    return
+                except FloodWaitError as e:
+                    self._on_flood_wait(e)
+                except MessageNotModifiedError:
+                    return
+        finally:
+            self.forget(message)
+
+    async def _edit(self, message, text):
+        started = time.monotonic()
+        try:
+            await self.client.edit_message(message, text)
+        finally:
+            TELEGRAM_SECONDS.labels("edit_message").observe(time.monotonic() - started)
+
+    def forget(self, message):
+        key = self._key(message)
+        self._live.discard(key)
+        self._pending.pop(key, None)
+        self._last_text.pop(key, None)
+        self._next_allowed.pop(key, None)
+
+    def _interval(self):
+        # Spread the budget over every message currently streaming
+        active = max(len(self._next_allowed), len(self._pending))
+        interval = max(self.min_interval, active / self.edits_per_second) * self._backoff
+        return min(interval, self.max_interval)
+
+    def _on_flood_wait(self, error):
+        self.flood_waits += 1
+        self.flood_wait_seconds += error.seconds
+        FLOOD_WAITS.labels("edit_message").inc()
+        self._paused_until = max(self._paused_until, time.monotonic() + error.seconds)
+        self._backoff = min(self._backoff * 2, self.max_interval / self.min_interval)
+        send_logs("FloodWait on message edit, pausing edits for %ss (backoff x%.1f)", 'warning', error.seconds, self._backoff)
+
+    async def _wait_pause(self):
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.edits_per_second, self._tokens + (now - self._refilled_at) * self.edits_per_second)
+            self._refilled_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.edits_per_second)
+
+    def _next_ready(self, now):
+        """First pending message (oldest first) whose interval has elapsed, else the earliest wait"""
+        earliest = None
+        for key in self._pending:
+            if key in self._inflight:
+                continue  # one edit per message at a time, keeps them in order
+            ready_at = self._next_allowed.get(key, 0.0)
+            if ready_at <= now:
+                return key, 0.0
+            earliest = ready_at if earliest is None else min(earliest, ready_at)
+        return None, None if earliest is None else earliest - now
+
+    def _sweep(self, idle=600.0):
+        """Drop state of messages that were never finalized with edit_now"""
+        cutoff = time.monotonic() - idle
+        for key in [key for key, ready_at in self._next_allowed.items() if ready_at < cutoff]:
+            self._next_allowed.pop(key, None)
+            self._last_text.pop(key, None)
+            self._live.discard(key)
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._sweep()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            await self._wait_pause()
+            key, delay = self._next_ready(time.monotonic())
+            if key is None:
+                # Nothing ready yet, or every pending message is still being edited
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            message, text = self._pending.pop(key)
+            if text == self._last_text.get(key):
+                self.skipped_unchanged += 1
+                continue
+
+            await self._slots.acquire()
+            try:
+                await self._take_token()
+            except BaseException:
+                self._slots.release()
+                raise
+            if key not in self._live:
+                self._slots.release()
+                continue  # finalized while we waited for the budget
+
+            # Sent in the background: a slow chat must not hold up the edits of the others
+            self._inflight[key] = asyncio.Event()
+            task = asyncio.ensure_future(self._send_preview(key, message, text))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send_preview(self, key, message, text):
+        try:
+            await self._edit(message, text)
+            self.edits_sent += 1
+            self._last_text[key] = text
+            self._backoff = max(1.0, self._backoff * 0.9)
+        except FloodWaitError as e:
+            self._on_flood_wait(e)
+            # Retry with whatever is newest once the pause is over
+            self._pending.setdefault(key, (message, text))
+        except MessageNotModifiedError:
+            self._last_text[key] = text
+        except Exception as e:
+            send_logs("Live update error: %s", 'warning', e)
+        finally:
+            self._inflight.pop(key).set()
+            self._slots.release()
+            self._wakeup.set()
+
+        if key in self._live:
+            self._next_allowed[key] = time.monotonic() + self._interval()
+        else:
+            self.forget(message)
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "inflight": len(self._inflight),
+            "active_messages": len(self._next_allowed),
+            "edits_sent": self.edits_sent,
+            "coalesced": self.coalesced,
+            "skipped_unchanged": self.skipped_unchanged,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+            "backoff": round(self._backoff, 2),
+            "interval": round(self._interval(), 2),
+        }
+
+    async def close(self):
+        for task in list(self._sending):
+            task.cancel()
+        await asyncio.gather(*self._sending, return_exceptions=True)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,177 @@
+"""Local fake LLM server for development, load tests and routing checks.
+
+Speaks both the OpenAI-compatible ``/v1/chat/completions`` (SSE) and the
+Ollama ``/api/chat`` (NDJSON) protocols with a configurable token rate,
+first-token latency, reasoning ("thinking") tokens and error injection.
+
+    python fake_llm.py --port 8089 --tokens-per-second 50 --first-token-delay 0.3
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from functions import send_logs
+
+DEFAULT_ANSWER = (
+    "This matters because understanding it now saves you hours later. "
+    "It builds the foundation the next topics rely on, and it is exactly the kind "
+    "of thing that shows up when you least expect it."
+)
+
+
+class FakeLLMServer:
+    """Minimal HTTP/1.1 keep-alive server that streams a canned answer word by word"""
+
+    def __init__(self, host="127.0.0.1", port=0, answer=DEFAULT_ANSWER, tokens_per_second=50.0,
+                 first_token_delay=0.2, fail_status=None, fail_every=0, reasoning_tokens=0):
+        self.host = host
+        self.port = port
+        self.answer = answer
+        self.tokens_per_second = tokens_per_second
+        self.first_token_delay = first_token_delay
+        self.fail_status = fail_status  # e.g. 429 or 503
+        self.fail_every = fail_every    # fail every Nth request, 0 = always when fail_status is set
+        self.reasoning_tokens = reasoning_tokens  # streamed before the answer unless reasoning is disabled
+        self.requests = 0
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        send_logs(f"Fake LLM server listening on {self.url}", 'info')
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def tokens(self):
+        words = self.answer.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, body = request
+                await self._respond(writer, method, path, body)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode('latin-1').split(" ", 2)
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value.strip())
+        body = await reader.readexactly(length) if length else b""
+        return method, path, body
+
+    async def _send_json(self, writer, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        head = f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+        for name, value in (headers or {}).items():
+            head += f"{name}: {value}\r\n"
+        writer.write(head.encode('latin-1') + b"\r\n" + data)
+        await writer.drain()
+
+    async def _send_chunk(self, writer, data):
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+        await writer.drain()
+
+    async def _respond(self, writer, method, path, body):
+        self.requests += 1
+        if self.fail_status and (not self.fail_every or self.requests % self.fail_every == 0):
+            await self._send_json(writer, self.fail_status, {"error": {"message": "injected failure"}},
+                                  {"Retry-After": "1"})
+            return
+        if method != "POST" or not (path.endswith("/chat/completions") or path.endswith("/api/chat")):
+            await self._send_json(writer, 404, {"error": {"message": "not found"}})
+            return
+
+        request = json.loads(body or b"{}")
+        model = request.get("model", "fake")
+        ollama = path.endswith("/api/chat")
+        tokens = self.tokens()
+        thinking = self.reasoning_tokens
+        if request.get("think") is False or request.get("reasoning", {}).get("enabled") is False:
+            thinking = 0
+        max_tokens = request.get("max_tokens") or request.get("options", {}).get("num_predict")
+        if max_tokens:
+            # Reasoning counts against max_tokens, like on the real APIs
+            thinking = min(thinking, max_tokens)
+            tokens = tokens[:max_tokens - thinking]
+
+        if not request.get("stream", ollama):
+            await asyncio.sleep(self.first_token_delay + len(tokens) / self.tokens_per_second)
+            text = "".join(tokens)
+            if ollama:
+                payload = {"model": model, "message": {"role": "assistant", "content": text}, "done": True}
+            else:
+                payload = {"id": "fake", "model": model,
+                           "choices": [{"index": 0, "message": {"role": "assistant", "content": text}}]}
+            await self._send_json(writer, 200, payload)
+            return
+
+        content_type = "application/x-ndjson" if ollama else "text/event-stream"
+        writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nTransfer-Encoding: chunked\r\n\r\n".encode('latin-1'))
+        await asyncio.sleep(self.first_token_delay)
+        interval = 1.0 / self.tokens_per_second
+        deltas = [("thinking" if ollama else "reasoning", " hmm")] * thinking + [("content", token) for token in tokens]
+        for field, token in deltas:
+            started = time.monotonic()
+            if ollama:
+                line = json.dumps({"model": model, "message": {"role": "assistant", field: token}, "done": False}) + "\n"
+            else:
+                line = "data: " + json.dumps({"id": "fake", "model": model, "choices": [{"index": 0, "delta": {field: token}}]}) + "\n\n"
+            await self._send_chunk(writer, line.encode('utf-8'))
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+        end = json.dumps({"model": model, "done": True}) + "\n" if ollama else "data: [DONE]\n\n"
+        await self._send_chunk(writer, end.encode('utf-8'))
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+async def _serve(args):
+    server = await FakeLLMServer(
+        args.host, args.port, tokens_per_second=args.tokens_per_second,
+        first_token_delay=args.first_token_delay, fail_status=args.fail_status, fail_every=args.fail_every,
+        reasoning_tokens=args.reasoning_tokens
+    ).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fake OpenAI/Ollama-compatible streaming LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--fail-status", type=int, default=None)
+    parser.add_argument("--fail-every", type=int, default=0)
+    parser.add_argument("--reasoning-tokens", type=int, default=0)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -1,4 +1,3 @@
-import numpy as np 
 import datetime
 import pytz
 
@@ -8,7 +7,32 @@ from collections import defaultdict
 moldova_tz = pytz.timezone('Europe/Chisinau')
 time_zone = pytz.timezone('Europe/Chisinau')
 #logs
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+from functools import lru_cache
+
+LOG_FORMAT = '%(asctime)s.%(msecs)03d | [%(levelname)s] %(message)s'
+LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
+LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    'critical': logging.CRITICAL
+}
+
+@lru_cache(maxsize=8)
+def _local_timetuple(second):
+    return datetime.datetime.fromtimestamp(second, time_zone).timetuple()
+
+def local_time_converter(seconds=None):
+    """Moldova-time struct_time for a record timestamp, cached per second"""
+    return _local_timetuple(int(seconds if seconds is not None else time.time()))
+
+logging.Formatter.converter = staticmethod(local_time_converter)
 
 class ColoredFormatter(logging.Formatter):
     COLORS = {
@@ -20,50 +44,117 @@ class ColoredFormatter(logging.Formatter):
         'RESET': '\033[0m'    # Reset color
     }
 
+    def __init__(self, fmt=None, datefmt=None):
+        super().__init__(fmt, datefmt)
+        # Colored level tags are built once instead of per record
+        self._tags = {
+            level: f"{color}[{level}]{self.COLORS['RESET']}"
+            for level, color in self.COLORS.items() if level != 'RESET'
+        }
+
     def format(self, record):
-        # Format without the levelname, which we'll add separately with color
-        formatter = logging.Formatter(
-            '%(asctime)s.%(msecs)03d | %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-        
-        # Get the log message without the level
-        log_message = formatter.format(record)
-        
-        # Add the colored level tag
-        colored_level = f"{self.COLORS.get(record.levelname, self.COLORS['RESET'])}[{record.levelname}]{self.COLORS['RESET']}"
-        
-        # Insert the colored level at the position after the timestamp
-        parts = log_message.split(' | ', 1)
-        if len(parts) == 2:
-            return f"{parts[0]} | {colored_level} {parts[1]}"
-        return log_message
-    
-# Create formatters - one with color for console, one without for file
-file_formatter = logging.Formatter(
-    '%(asctime)s.%(msecs)03d | [%(levelname)s] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-console_formatter = ColoredFormatter(
-    '%(asctime)s.%(msecs)03d | [%(levelname)s] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-
-# Create handlers
-file_handler = logging.FileHandler("learnkeybot.log")
-file_handler.setFormatter(file_formatter)
-
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(console_formatter)
-
-# Configure the root logger
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[file_handler, console_handler]
-)
-
-logging.Formatter.converter = lambda *args: \
-    datetime.datetime.now(time_zone).timetuple()
+        message = super().format(record)
+        tag = self._tags.get(record.levelname)
+        if tag is None:
+            return message
+        return message.replace(f"[{record.levelname}]", tag, 1)
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers"""
+
+    def format(self, record):
+        entry = {
+            "time": f"{self.formatTime(record, LOG_DATEFMT)}.{int(record.msecs):03d}",
+            "level": record.levelname,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+_log_listener = None
+
+def configure_logging(path="learnkeybot.log", level="INFO", json_lines=False,
+                      rotation="size", max_bytes=10 * 1024 * 1024, backup_count=5, when="midnight"):
+    """Route all logging through a queue to a background writer thread.
+
+    Callers only enqueue the record; formatting, console output and file
+    writes (with size or time based rotation) happen on the writer thread.
+    Calling it again replaces the previous pipeline.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+
+    if rotation == "time":
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=when, backupCount=backup_count, encoding="utf-8")
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    file_handler.setFormatter(JsonLinesFormatter() if json_lines else logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(ColoredFormatter(LOG_FORMAT, LOG_DATEFMT))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    _log_listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler)
+    _log_listener.start()
+
+class _ForwardHandler(logging.Handler):
+    """Hands records from pool workers to this process's loggers, and so to its writer"""
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+_pool_log_queue = None
+_pool_log_listener = None
+
+def pool_logging(context):
+    """(initializer, initargs) for a process pool whose workers log through this process.
+
+    Workers do not inherit the writer thread, so without this their records
+    would pile up in a queue nobody reads.
+    """
+    global _pool_log_queue, _pool_log_listener
+    if _pool_log_queue is None:
+        _pool_log_queue = context.Queue()
+        _pool_log_listener = logging.handlers.QueueListener(_pool_log_queue, _ForwardHandler())
+        _pool_log_listener.start()
+    return _init_pool_logging, (_pool_log_queue, logging.getLogger().level)
+
+def _init_pool_logging(log_queue, level):
+    # Runs in the worker: drop the pipeline copied or re-created there, send records to the parent
+    stop_logging()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _log_listener, _pool_log_queue, _pool_log_listener
+    if _pool_log_listener is not None:
+        _pool_log_listener.stop()
+        _pool_log_listener = None
+        _pool_log_queue = None
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+configure_logging()
+atexit.register(stop_logging)
 
 #week days
 week_days = {
@@ -227,17 +318,9 @@ def button_grid(buttons, butoane_rand):
     return grid
 
 
-def send_logs(message, type):
-    if type =='info':
-        logging.info(message)
-    elif type =='warning':
-        logging.warning(message)
-    elif type =='error':
-        logging.error(message)
-    elif type =='critical':
-        logging.critical(message)
-    else: 
-        logging.info(message)
+def send_logs(message, type, *args):
+    """Log ``message`` at level ``type``; ``args`` are %-formatted only if the level is enabled"""
+    logging.log(LOG_LEVELS.get(type, logging.INFO), message, *args)
         
 def get_user_id(event):
     """Extract user ID from event"""
@@ -247,9 +330,9 @@ def format_display_name(setting):
     """Format setting name for display"""
     return setting.replace('_', ' ').title()
 
-user_settings = {}
+# Rough token estimate used for prompt budgets (no tokenizer dependency)
+CHARS_PER_TOKEN = 4
 
-def get_user_settings(user_id):
-    if user_id not in user_settings:
-        user_settings[user_id] = default_settings.copy()
-    return user_settings[user_id]
+def estimate_tokens(text):
+    """Estimate the number of LLM tokens in text"""
+    return len(text) // CHARS_PER_TOKEN + 1
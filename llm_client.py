@@ -0,0 +1,255 @@
+import asyncio
+import importlib.util
+import ipaddress
+import json
+import time
+from urllib.parse import urlsplit
+
+import metrics
+from functions import send_logs
+
+# h2 enables HTTP/2 in httpx; only check that it is installed, httpx imports it
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+STREAM_DONE = object()  # returned by _parse_line when the stream is finished
+
+POOL_REQUESTS = metrics.counter("llm_pool_requests_total", "Requests sent through the LLM connection pool", ["client"])
+POOL_CONNECTIONS_OPENED = metrics.counter("llm_pool_connections_opened_total", "New TCP connections to the LLM server",
+                                          ["client"])
+POOL_OPEN_CONNECTIONS = metrics.gauge("llm_pool_open_connections", "Connections currently held by the LLM pool", ["client"])
+POOL_SLOTS_IN_USE = metrics.gauge("llm_pool_slots_in_use", "LLM requests currently holding a pool slot", ["client"])
+POOL_WAIT_SECONDS = metrics.histogram("llm_pool_wait_seconds", "Time a request waited for a free pool slot", ["client"])
+
+
+class Reasoning(str):
+    """A reasoning ("thinking") delta, as opposed to answer text.
+
+    Only yielded when ``stream_chat`` is called with ``reasoning_deltas=True``,
+    so callers that join everything they receive only ever see the answer.
+    """
+
+    __slots__ = ()
+
+
+def is_local_url(url):
+    """True for a server on this machine or the local network, which needs no API key"""
+    host = urlsplit(url).hostname or ""
+    if host == "localhost":
+        return True
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return address.is_loopback or address.is_private
+
+
+class DeepSeekClient:
+    """Async client for the OpenRouter chat-completions endpoint.
+
+    Works with any OpenAI-compatible server. All calls share one keep-alive
+    connection pool for the whole process.
+    """
+
+    name = "openrouter"
+
+    def __init__(self, api_url, api_key, model, max_connections=10, keepalive_expiry=30.0,
+                 connect_timeout=5.0, read_timeout=60.0, http2=True, cost=1.0):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model = model
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.cost = cost  # relative cost used by the "cost" routing policy
+        self._http = None
+        self._slots = None
+
+        # Pool stats
+        self.requests_total = 0
+        self.connections_opened = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def _session(self):
+        # Created lazily so the pool binds to the running event loop, and httpx
+        # is only imported once the first request is made
+        if self._http is None:
+            import httpx
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=self.keepalive_expiry
+            )
+            timeout = httpx.Timeout(self.read_timeout, connect=self.connect_timeout, pool=None)
+            self._http = httpx.AsyncClient(limits=limits, timeout=timeout, http2=self.http2)
+            self._slots = asyncio.Semaphore(self.max_connections)
+            send_logs("%s connection pool created: max %s connections, HTTP/2 %s", 'info',
+                      self.name, self.max_connections, 'on' if self.http2 else 'off')
+        return self._http
+
+    async def _trace(self, event_name, info):
+        # httpcore reports every fresh TCP connection, everything else is a reuse
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+            POOL_CONNECTIONS_OPENED.labels(self.name).inc()
+
+    async def _acquire_slot(self):
+        started = time.monotonic()
+        await self._slots.acquire()
+        waited = time.monotonic() - started
+        self.requests_total += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        POOL_REQUESTS.labels(self.name).inc()
+        POOL_WAIT_SECONDS.labels(self.name).observe(waited)
+        POOL_SLOTS_IN_USE.labels(self.name).inc()
+
+    def _release_slot(self):
+        self._slots.release()
+        POOL_SLOTS_IN_USE.labels(self.name).dec()
+        POOL_OPEN_CONNECTIONS.labels(self.name).set(self.open_connections())
+
+    def _payload(self, messages, stream, options):
+        payload = {"model": self.model, "messages": messages}
+        if stream:
+            payload["stream"] = True
+        payload.update(options)
+        return payload
+
+    def _parse_line(self, line):
+        """Content (or Reasoning) delta from one SSE line, None to skip it, STREAM_DONE at the end"""
+        if not line or not line.startswith('data: '):
+            return None
+        data = line[6:]  # Remove 'data: ' prefix
+        if data == '[DONE]':
+            return STREAM_DONE
+        try:
+            json_data = json.loads(data)
+        except json.JSONDecodeError:
+            return None
+        delta = json_data.get('choices', [{}])[0].get('delta', {})
+        content = delta.get('content')
+        if content:
+            return content
+        # OpenRouter sends "reasoning", DeepSeek's own API "reasoning_content"
+        reasoning = delta.get('reasoning') or delta.get('reasoning_content')
+        return Reasoning(reasoning) if reasoning else None
+
+    async def stream_chat(self, messages, reasoning_deltas=False, **options):
+        """Yield content deltas from a streaming chat completion.
+
+        With ``reasoning_deltas`` the model's reasoning is yielded too, as
+        Reasoning strings, which also keeps a long think from looking like a
+        stalled stream.
+        """
+        payload = self._payload(messages, True, options)
+
+        session = self._session()
+        await self._acquire_slot()
+        try:
+            async with session.stream("POST", self.api_url, headers=self._headers(), json=payload,
+                                      extensions={"trace": self._trace}) as response:
+                response.raise_for_status()
+                done = False
+                async for line in response.aiter_lines():
+                    if done:
+                        continue  # drain to the end so the connection goes back to the pool
+                    content = self._parse_line(line)
+                    if content is STREAM_DONE:
+                        done = True
+                    elif content and (reasoning_deltas or not isinstance(content, Reasoning)):
+                        yield content
+        finally:
+            self._release_slot()
+
+    async def complete(self, messages, timeout=None, **options):
+        """Run a non-streaming chat completion, returns the raw response"""
+        payload = self._payload(messages, False, options)
+
+        session = self._session()
+        await self._acquire_slot()
+        try:
+            return await session.post(self.api_url, headers=self._headers(), json=payload,
+                                      timeout=timeout if timeout is not None else session.timeout,
+                                      extensions={"trace": self._trace})
+        finally:
+            self._release_slot()
+
+    def open_connections(self):
+        pool = getattr(getattr(self._http, "_transport", None), "_pool", None)
+        if pool is None:
+            return 0
+        return len(pool.connections)
+
+    def pool_stats(self):
+        """Connection pool stats: open connections, reuse ratio and slot wait times"""
+        reused = max(self.requests_total - self.connections_opened, 0)
+        return {
+            "open_connections": self.open_connections(),
+            "max_connections": self.max_connections,
+            "http2": self.http2,
+            "requests_total": self.requests_total,
+            "connections_opened": self.connections_opened,
+            "reuse_ratio": round(reused / self.requests_total, 3) if self.requests_total else 0.0,
+            "wait_time_avg": round(self.wait_time_total / self.requests_total, 4) if self.requests_total else 0.0,
+            "wait_time_max": round(self.wait_time_max, 4),
+        }
+
+    async def close(self):
+        if self._http is not None:
+            send_logs("%s pool stats: %s", 'info', self.name, self.pool_stats())
+            await self._http.aclose()
+            self._http = None
+            POOL_OPEN_CONNECTIONS.labels(self.name).set(0)
+        send_logs("%s client closed", 'info', self.name)
+
+
+class OllamaClient(DeepSeekClient):
+    """Client for a local Ollama server's native /api/chat endpoint (NDJSON stream)"""
+
+    name = "ollama"
+
+    def __init__(self, base_url, model, **kwargs):
+        kwargs.setdefault("http2", False)
+        kwargs.setdefault("cost", 0.0)
+        super().__init__(base_url.rstrip("/") + "/api/chat", None, model, **kwargs)
+
+    def _payload(self, messages, stream, options):
+        # Map the OpenAI-style options onto Ollama's "options" object
+        ollama_options = {}
+        if "max_tokens" in options:
+            ollama_options["num_predict"] = options["max_tokens"]
+        for key in ("stop", "temperature", "top_p"):
+            if key in options:
+                ollama_options[key] = options[key]
+        payload = {"model": self.model, "messages": messages, "stream": stream}
+        if "reasoning" in options:
+            # Thinking models only take on/off, not an effort level
+            payload["think"] = options["reasoning"].get("enabled", True)
+        if ollama_options:
+            payload["options"] = ollama_options
+        return payload
+
+    def _parse_line(self, line):
+        if not line:
+            return None
+        try:
+            json_data = json.loads(line)
+        except json.JSONDecodeError:
+            return None
+        if json_data.get("done"):
+            return STREAM_DONE
+        message = json_data.get("message", {})
+        content = message.get("content")
+        if content:
+            return content
+        thinking = message.get("thinking")
+        return Reasoning(thinking) if thinking else None
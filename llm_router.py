@@ -0,0 +1,144 @@
+import time
+
+from functions import send_logs, estimate_tokens
+from resilience import is_backend_error, retry_after, status_code
+
+ROUTING_POLICIES = ("primary", "latency", "cost")
+
+
+class BackendState:
+    """Health and latency bookkeeping for one backend"""
+
+    __slots__ = ("client", "requests", "errors", "fallbacks", "ttft_ewma", "cooldown_until")
+
+    def __init__(self, client):
+        self.client = client
+        self.requests = 0
+        self.errors = 0
+        self.fallbacks = 0
+        self.ttft_ewma = None
+        self.cooldown_until = 0.0
+
+
+class LLMRouter:
+    """Routes chat completions across LLM backends behind one streaming interface.
+
+    ``backends`` are clients with ``stream_chat``/``complete`` (see
+    llm_client), listed in priority order. Policies:
+
+    - primary: configured order
+    - latency: lowest observed time-to-first-token first
+    - cost: cheapest backend first, latency breaks ties
+
+    Prompts up to ``short_prompt_tokens`` go to the ``local`` backend first.
+    A backend that fails before sending a token (connection error, 429 or
+    5xx, open circuit breaker, no first token in time) is put on cooldown
+    (429 honours Retry-After) and the next one is tried. Other 4xx errors
+    are raised as they are.
+    """
+
+    def __init__(self, backends, policy="primary", local=None, short_prompt_tokens=0,
+                 error_cooldown=15.0, ewma_alpha=0.2):
+        if policy not in ROUTING_POLICIES:
+            raise ValueError(f"Unknown routing policy: {policy}")
+        self.states = [BackendState(client) for client in backends]
+        self.policy = policy
+        self.local = local
+        self.short_prompt_tokens = short_prompt_tokens
+        self.error_cooldown = error_cooldown
+        self.ewma_alpha = ewma_alpha
+
+    @property
+    def primary(self):
+        return self.states[0].client
+
+    def _order(self, messages):
+        now = time.monotonic()
+        states = list(self.states)
+        if self.policy == "latency":
+            states.sort(key=lambda s: s.ttft_ewma if s.ttft_ewma is not None else 0.0)
+        elif self.policy == "cost":
+            states.sort(key=lambda s: (s.client.cost, s.ttft_ewma if s.ttft_ewma is not None else 0.0))
+
+        prompt = messages[-1]["content"] if messages else ""
+        if self.local is not None and self.short_prompt_tokens and estimate_tokens(prompt) <= self.short_prompt_tokens:
+            states.sort(key=lambda s: s.client is not self.local)
+
+        # Healthy backends first; if everything is cooling down, try the one that recovers first
+        healthy = [s for s in states if s.cooldown_until <= now]
+        cooling = sorted((s for s in states if s.cooldown_until > now), key=lambda s: s.cooldown_until)
+        return healthy + cooling
+
+    def _cooldown_for(self, error):
+        if status_code(error) == 429:
+            delay = retry_after(error)
+            return max(delay, 1.0) if delay is not None else self.error_cooldown * 2
+        return self.error_cooldown
+
+    def _record_failure(self, state, error):
+        state.errors += 1
+        cooldown = self._cooldown_for(error)
+        state.cooldown_until = time.monotonic() + cooldown
+        send_logs("LLM backend %s failed (%s), cooling down %.0fs", 'warning',
+                  state.client.name, str(error) or type(error).__name__, cooldown)
+
+    def _record_ttft(self, state, ttft):
+        if state.ttft_ewma is None:
+            state.ttft_ewma = ttft
+        else:
+            state.ttft_ewma += self.ewma_alpha * (ttft - state.ttft_ewma)
+
+    async def stream_chat(self, messages, route=None, **options):
+        """Yield content deltas from the first backend that answers.
+
+        If ``route`` is a dict it receives the ``backend`` and ``model`` that
+        produced the answer once the first token arrives.
+        """
+        last_error = None
+        for position, state in enumerate(self._order(messages)):
+            if position:
+                state.fallbacks += 1
+            state.requests += 1
+            started = time.monotonic()
+            yielded = False
+            try:
+                async for content in state.client.stream_chat(messages, **options):
+                    if not yielded:
+                        yielded = True
+                        self._record_ttft(state, time.monotonic() - started)
+                        if route is not None:
+                            route["backend"] = state.client.name
+                            route["model"] = state.client.model
+                    yield content
+                return
+            except Exception as e:
+                if not is_backend_error(e):
+                    raise
+                self._record_failure(state, e)
+                if yielded:
+                    # Part of the answer is already out, switching backends would garble it
+                    raise
+                last_error = e
+        raise last_error or RuntimeError("No LLM backend configured")
+
+    async def complete(self, messages, timeout=None, **options):
+        """Non-streaming completion on the primary backend"""
+        return await self.primary.complete(messages, timeout=timeout, **options)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            state.client.name: {
+                "model": state.client.model,
+                "requests": state.requests,
+                "errors": state.errors,
+                "fallbacks": state.fallbacks,
+                "ttft_ewma": round(state.ttft_ewma, 3) if state.ttft_ewma is not None else None,
+                "cooling_down": state.cooldown_until > now,
+            }
+            for state in self.states
+        }
+
+    async def close(self):
+        for state in self.states:
+            await state.client.close()
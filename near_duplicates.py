@@ -0,0 +1,169 @@
+import hashlib
+import re
+from array import array
+from collections import OrderedDict
+
+import metrics
+
+_TIME_PREFIX = re.compile(r"^\s*current time:[^\n]*\n+", re.IGNORECASE)
+_GREETING = re.compile(
+    r"^\s*(?:hi|hello|hey|dear\s+\w+|good\s+(?:morning|afternoon|evening)|привет|здравствуйте|"
+    r"salut|bun[aă](?:\s+ziua)?)\b[\s,.!:-]*",
+    re.IGNORECASE
+)
+_THANKS = re.compile(r"[\s,.!]*(?:thanks|thank you|thx|спасибо|mersi|mul[tț]umesc)[\s,.!]*$", re.IGNORECASE)
+_WORD = re.compile(r"\w+")
+_VALUE_MASK = (1 << 58) - 1
+
+LOOKUPS = metrics.counter("near_duplicate_lookups_total", "Near-duplicate prompt lookups", ["result"])
+SIMILARITY = metrics.histogram("near_duplicate_similarity", "Estimated similarity of the best candidate found",
+                               buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 1.0))
+THRESHOLD = metrics.gauge("near_duplicate_threshold", "Similarity above which a stored answer is reused")
+ENTRIES = metrics.gauge("near_duplicate_entries", "Prompts in the near-duplicate index")
+
+
+def normalize(text):
+    """Words of a prompt without the time prefix, greetings, thanks, case and punctuation"""
+    text = _TIME_PREFIX.sub("", text)
+    text = _GREETING.sub("", text)
+    text = _THANKS.sub("", text)
+    return _WORD.findall(text.casefold())
+
+
+class NearDuplicateIndex:
+    """Finds earlier prompts that are almost the same text, to reuse their answers.
+
+    Prompts are reduced to word 3-gram shingles and a MinHash signature
+    (one-permutation hashing, so a single hash per shingle). Signatures are
+    bucketed by LSH bands; candidates sharing a band are confirmed by their
+    estimated Jaccard similarity. Numbers must match exactly ("task 3" is
+    not "task 4"). Each entry only points to the answer's cache key, and the
+    oldest entries are evicted past ``max_entries``.
+
+    ``scope`` keeps unrelated answers apart: pass the personality prompt
+    hash (and anything else the answer depends on), only entries with the
+    same scope can match.
+    """
+
+    def __init__(self, threshold=0.85, max_entries=10000, bands=32, rows=4, min_words=20):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.bands = bands
+        self.rows = rows
+        self.slots = bands * rows
+        self.min_words = min_words
+        self._entries = OrderedDict()  # entry id -> (scope, signature, answer key)
+        self._buckets = {}             # (scope, numbers, band, band values) -> set of entry ids
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        THRESHOLD.set(threshold)
+
+    def signature(self, text):
+        """(numbers, MinHash values) of a prompt, None if it is too short to compare safely"""
+        words = normalize(text)
+        if len(words) < self.min_words:
+            return None
+        numbers = " ".join(sorted({word for word in words if any(c.isdigit() for c in word)}))
+        slots = self.slots
+        mins = [None] * slots
+        for index in range(len(words) - 2):
+            shingle = " ".join(words[index:index + 3]).encode('utf-8')
+            value = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'little')
+            # The low bits pick the slot, the rest is the value kept per slot
+            slot = value % slots
+            value = (value // slots) & _VALUE_MASK
+            if mins[slot] is None or value < mins[slot]:
+                mins[slot] = value
+        # Densify: an empty slot borrows from the next filled one, offset by the distance
+        filled = [slot for slot in range(slots) if mins[slot] is not None]
+        signature = array('Q', bytes(8 * slots))
+        for slot in range(slots):
+            if mins[slot] is not None:
+                signature[slot] = mins[slot]
+                continue
+            distance = next((d for d in range(1, slots) if mins[(slot + d) % slots] is not None), 0)
+            signature[slot] = (mins[(slot + distance) % slots] + distance * (_VALUE_MASK + 1)) & ((1 << 64) - 1)
+        return (numbers, signature) if filled else None
+
+    def _band_keys(self, scope, signature):
+        numbers, values = signature
+        rows = self.rows
+        return [(scope, numbers, band, values[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+
+    @staticmethod
+    def similarity(first, second):
+        """Estimated Jaccard similarity of two signatures"""
+        if first[0] != second[0]:
+            return 0.0
+        return sum(1 for a, b in zip(first[1], second[1]) if a == b) / len(first[1])
+
+    def find(self, signature, scope):
+        """Answer key of the most similar earlier prompt above the threshold, else None.
+
+        A found key is not counted yet: report it with ``hit()`` once its
+        answer was fetched, or ``stale()`` if it was no longer cached.
+        """
+        if signature is None:
+            return None
+        candidates = set()
+        for key in self._band_keys(scope, signature):
+            candidates.update(self._buckets.get(key, ()))
+        best, best_similarity = None, 0.0
+        for entry_id in candidates:
+            _, other, answer_key = self._entries[entry_id]
+            similarity = self.similarity(signature, other)
+            if similarity > best_similarity:
+                best, best_similarity = entry_id, similarity
+        if best is not None:
+            SIMILARITY.observe(best_similarity)
+        if best is None or best_similarity < self.threshold:
+            self.misses += 1
+            LOOKUPS.labels("miss").inc()
+            return None
+        self._entries.move_to_end(best)
+        return self._entries[best][2]
+
+    def hit(self):
+        """Count a found answer key whose answer was reused"""
+        self.hits += 1
+        LOOKUPS.labels("hit").inc()
+
+    def stale(self):
+        """Count a found answer key whose answer was no longer cached"""
+        self.misses += 1
+        LOOKUPS.labels("stale").inc()
+
+    def add(self, signature, scope, answer_key):
+        if signature is None:
+            return
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (scope, signature, answer_key)
+        for key in self._band_keys(scope, signature):
+            self._buckets.setdefault(key, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._evict()
+        ENTRIES.set(len(self._entries))
+
+    def _evict(self):
+        entry_id, (scope, signature, _) = self._entries.popitem(last=False)
+        self.evictions += 1
+        for key in self._band_keys(scope, signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "threshold": self.threshold,
+        }
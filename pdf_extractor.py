@@ -0,0 +1,339 @@
+import asyncio
+import contextlib
+import hashlib
+import io
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from functions import send_logs, estimate_tokens, pool_logging, CHARS_PER_TOKEN
+
+PAGES_PER_TASK = 16
+
+PAGE_SECONDS = metrics.histogram("pdf_page_extraction_seconds", "Worker time to extract one PDF page",
+                                 buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+DOCUMENT_SECONDS = metrics.histogram("pdf_document_extraction_seconds", "Wall-clock time to extract a whole PDF")
+
+
+class ExtractionTimeout(BaseException):
+    """Raised inside a worker when the document's time budget runs out.
+
+    Derives from BaseException so PyPDF2's own ``except Exception`` blocks
+    cannot swallow it.
+    """
+
+
+def _on_alarm(signum, frame):
+    raise ExtractionTimeout()
+
+
+def _open_reader(pdf_source):
+    import PyPDF2  # imported on first use (in the worker), it is slow to load
+    if isinstance(pdf_source, (bytes, bytearray)):
+        return PyPDF2.PdfReader(io.BytesIO(pdf_source))
+    return PyPDF2.PdfReader(pdf_source)
+
+
+def count_pages(pdf_source):
+    """Worker: number of pages in the PDF"""
+    return len(_open_reader(pdf_source).pages)
+
+
+def extract_page_range(pdf_source, start, end, deadline):
+    """Worker: extract pages [start, end) as a list of (page_num, text, error, seconds).
+
+    Stops at the wall-clock ``deadline`` (a time.time() value); pages that
+    were not reached are reported with an error instead of text.
+    """
+    results = []
+    use_alarm = hasattr(signal, 'setitimer')
+    try:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise ExtractionTimeout()
+        if use_alarm:
+            signal.signal(signal.SIGALRM, _on_alarm)
+            signal.setitimer(signal.ITIMER_REAL, remaining)
+
+        reader = _open_reader(pdf_source)
+        for page_num in range(start, end):
+            page_started = time.perf_counter()
+            try:
+                page_text, error = reader.pages[page_num].extract_text() or "", None
+            except Exception as e:
+                page_text, error = "", str(e)
+            results.append((page_num, page_text, error, time.perf_counter() - page_started))
+    except ExtractionTimeout:
+        results.extend((page_num, "", "time budget exceeded", None)
+                       for page_num in range(start + len(results), end))
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return results
+
+
+def extract_text_from_pdf(pdf_data, max_pages=None):
+    """Extract text from PDF data in the current process"""
+    try:
+        send_logs("Starting PDF text extraction. Data size: %s bytes", 'info', len(pdf_data))
+
+        pdf_reader = _open_reader(pdf_data)
+        num_pages = len(pdf_reader.pages)
+        if max_pages is not None:
+            num_pages = min(num_pages, max_pages)
+
+        send_logs("PDF info: %s pages", 'info', num_pages)
+
+        text_parts = []
+        for page_num in range(num_pages):
+            try:
+                page_text = pdf_reader.pages[page_num].extract_text() or ""
+                if page_text.strip():  # Only add non-empty pages
+                    text_parts.append(page_text)
+            except Exception as e:
+                send_logs("Error extracting text from page %s: %s", 'error', page_num+1, e)
+                continue
+            send_logs("Extracted page %d: %d chars", 'debug', page_num + 1, len(page_text))
+
+        text = "\n\n".join(text_parts)
+
+        if not text.strip():
+            send_logs("Extracted text is empty, PDF might be image-based or protected", 'warning')
+            return ""
+
+        send_logs("Completed PDF extraction. Total text length: %s", 'info', len(text))
+        return text
+
+    except Exception as e:
+        send_logs("Error extracting text from PDF: %s", 'error', e)
+        return ""
+
+
+class SpooledDownload:
+    """Write-only buffer for downloads that spills to a temp file past ``max_memory`` bytes"""
+
+    def __init__(self, max_memory=2 * 1024 * 1024, directory=None):
+        self.max_memory = max_memory
+        self.directory = directory
+        self.size = 0
+        self._buffer = io.BytesIO()
+        self._file = None
+        self.path = None
+        self._sha256 = hashlib.sha256()
+
+    def _spill(self):
+        self._file = tempfile.NamedTemporaryFile(prefix="pdf_", suffix=".pdf", dir=self.directory, delete=False)
+        self._file.write(self._buffer.getbuffer())
+        self.path = self._file.name
+        self._buffer = None
+
+    def write(self, chunk):
+        if self._file is None and self.size + len(chunk) > self.max_memory:
+            self._spill()
+        target = self._file if self._file is not None else self._buffer
+        target.write(chunk)
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+
+    @classmethod
+    def from_file(cls, path):
+        """Adopt a file spooled by another process; it is deleted on close like our own"""
+        spool = cls(max_memory=0)
+        spool._buffer = None
+        spool._file = open(path, 'rb')
+        spool.path = path
+        for chunk in iter(lambda: spool._file.read(1024 * 1024), b""):
+            spool._sha256.update(chunk)
+            spool.size += len(chunk)
+        return spool
+
+    def detach(self):
+        """Flush to a file and hand it over (see from_file), returns its path"""
+        if self._file is None:
+            self._spill()
+        self._file.close()
+        self._file = None
+        return self.path
+
+    def sha256(self):
+        """Hex digest of everything written so far"""
+        return self._sha256.hexdigest()
+
+    @property
+    def on_disk(self):
+        return self._file is not None
+
+    def source(self):
+        """Path for the extraction workers, small downloads are written out on first use.
+
+        Workers open the file themselves: the document is not copied out of
+        the buffer, nor pickled into every page-range task. Downloads answered
+        from the cache by their hash never touch the disk.
+        """
+        if self._file is None:
+            self._spill()
+        self._file.flush()
+        return self.path
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self._file = None
+        self._buffer = None
+
+
+async def download_document(client, document, max_memory=2 * 1024 * 1024):
+    """Download a Telegram document chunk by chunk into a SpooledDownload"""
+    spool = SpooledDownload(max_memory)
+    try:
+        async for chunk in client.iter_download(document):
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+async def read_text(pages, token_budget):
+    """Join pages from ``iter_pages`` until roughly ``token_budget`` tokens.
+
+    Returns (text, truncated). Stops consuming the page stream as soon as the
+    budget is spent, so the remaining pages are never extracted.
+    """
+    text_parts = []
+    tokens = 0
+    truncated = False
+    async with contextlib.aclosing(pages):
+        async for page_num, page_text in pages:
+            page_tokens = estimate_tokens(page_text)
+            if tokens + page_tokens > token_budget:
+                remaining_chars = (token_budget - tokens) * CHARS_PER_TOKEN
+                if remaining_chars > 0:
+                    text_parts.append(page_text[:remaining_chars])
+                truncated = True
+                break
+            text_parts.append(page_text)
+            tokens += page_tokens
+    return "\n\n".join(text_parts), truncated
+
+
+class PdfExtractor:
+    """Extracts PDF text on a bounded process pool, fanning pages out across workers.
+
+    Documents are admitted in arrival order, at most ``max_concurrent_documents``
+    at a time, and each one is limited to ``max_pages`` pages and
+    ``time_budget`` seconds of wall-clock time.
+    """
+
+    def __init__(self, max_workers=None, max_concurrent_documents=2, max_pages=500, time_budget=60.0):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_concurrent_documents = max_concurrent_documents
+        self.max_pages = max_pages
+        self.time_budget = time_budget
+        self._pool = None
+        self._admission = None
+
+    def _executor(self):
+        if self._pool is None:
+            # The bot already runs threads (log writer, executors) that a plain fork would copy
+            # mid-flight; forkserver starts workers from a clean single-threaded process
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(next((m for m in ('forkserver', 'fork') if m in methods), None))
+            initializer, initargs = pool_logging(context)
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                             initializer=initializer, initargs=initargs)
+            self._admission = asyncio.Semaphore(self.max_concurrent_documents)
+        return self._pool
+
+    def _page_ranges(self, num_pages):
+        per_task = min(-(-num_pages // self.max_workers), PAGES_PER_TASK)
+        return [(start, min(start + per_task, num_pages)) for start in range(0, num_pages, per_task)]
+
+    async def iter_pages(self, pdf_source):
+        """Yield (page_num, text) for non-empty pages, in order, as workers finish them.
+
+        ``pdf_source`` is PDF bytes or a path to a PDF file. Closing the
+        generator early cancels the page ranges that have not started yet.
+        """
+        pool = self._executor()
+        loop = asyncio.get_running_loop()
+
+        async with self._admission:
+            started = time.time()
+            deadline = started + self.time_budget
+            send_logs("Starting PDF text extraction. Source: %s", 'info', 'file' if isinstance(pdf_source, str) else f'{len(pdf_source)} bytes')
+
+            try:
+                num_pages = await loop.run_in_executor(pool, count_pages, pdf_source)
+            except Exception as e:
+                send_logs("Error extracting text from PDF: %s", 'error', e)
+                return
+
+            if num_pages > self.max_pages:
+                send_logs("PDF has %s pages, only the first %s will be extracted", 'warning', num_pages, self.max_pages)
+                num_pages = self.max_pages
+            send_logs("PDF info: %s pages", 'info', num_pages)
+
+            tasks = [
+                loop.run_in_executor(pool, extract_page_range, pdf_source, start, end, deadline)
+                for start, end in self._page_ranges(num_pages)
+            ]
+            yielded = 0
+            skipped = 0
+            try:
+                for task in tasks:
+                    # Workers stop themselves at the deadline, this is only a backstop
+                    remaining = deadline + 5 - time.time()
+                    try:
+                        pages = await asyncio.wait_for(task, timeout=max(remaining, 0))
+                    except asyncio.TimeoutError:
+                        send_logs("PDF extraction exceeded %ss, dropping remaining pages", 'warning', self.time_budget)
+                        break
+                    except Exception as e:
+                        send_logs("Error extracting page range: %s", 'error', e)
+                        continue
+
+                    for page_num, page_text, error, seconds in pages:
+                        if seconds is not None:
+                            PAGE_SECONDS.observe(seconds)
+                        if error == "time budget exceeded":
+                            skipped += 1
+                        elif error:
+                            send_logs("Error extracting text from page %s: %s", 'error', page_num+1, error)
+                        elif page_text.strip():  # Only yield non-empty pages
+                            send_logs("Extracted page %d: %d chars in %.3fs", 'debug', page_num + 1, len(page_text), seconds)
+                            yielded += 1
+                            yield page_num, page_text
+            finally:
+                for task in tasks:
+                    task.cancel()
+                if skipped:
+                    send_logs("PDF time budget of %ss exceeded, skipped %s pages", 'warning', self.time_budget, skipped)
+                DOCUMENT_SECONDS.observe(time.time() - started)
+                send_logs("PDF extraction finished in %.2fs, %s pages with text", 'info', time.time() - started, yielded)
+
+    async def extract_text(self, pdf_source):
+        """Extract the full text of a PDF without blocking the event loop"""
+        text_parts = []
+        async with contextlib.aclosing(self.iter_pages(pdf_source)) as pages:
+            async for page_num, page_text in pages:
+                text_parts.append(page_text)
+
+        text = "\n\n".join(text_parts)
+        if not text.strip():
+            send_logs("Extracted text is empty, PDF might be image-based or protected", 'warning')
+            return ""
+        return text
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
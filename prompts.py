@@ -0,0 +1,118 @@
+import hashlib
+import string
+from collections import OrderedDict
+
+from deadlines import END_MARKER
+from functions import send_logs, PERSONALITY_PRESETS
+from settings_store import SETTING_NAMES
+
+MIN_ANSWER_TOKENS = 300  # answer budget at brevity 1.0
+DEADLINE_BLOCK_TOKENS = 250  # room left for the ###JSON### block after the answer
+# Tokens added to max_tokens for the model's reasoning at each effort level
+REASONING_TOKENS = {"off": 0, "low": 1024, "medium": 4096, "high": 8192}
+
+
+class PromptTemplate:
+    """System prompt template compiled once, rendered per personality vector.
+
+    The template uses ``str.format`` syntax (``{calmness}``, ``{{`` for a
+    literal brace). Rendered prompts are memoized by the quantized settings
+    tuple in a bounded LRU, so preset users never re-render.
+    """
+
+    def __init__(self, path, max_cached=1024):
+        self.path = path
+        self.max_cached = max_cached
+        self.hits = 0
+        self.misses = 0
+        self._rendered = OrderedDict()
+        self._presets = {self.settings_key(preset["settings"]): preset_id
+                         for preset_id, preset in PERSONALITY_PRESETS.items()}
+
+        with open(path, encoding='utf-8') as f:
+            self.text = f.read()
+        # [(literal_text, field_name, format_spec), ...]
+        self._parts = [
+            (literal, field, spec or "")
+            for literal, field, spec, _ in string.Formatter().parse(self.text)
+        ]
+        unknown = {field for _, field, _ in self._parts if field} - set(SETTING_NAMES)
+        if unknown:
+            raise ValueError(f"Unknown fields in {path}: {', '.join(sorted(unknown))}")
+        send_logs("Loaded prompt template %s (%s chars)", 'info', path, len(self.text))
+
+    @staticmethod
+    def settings_key(settings):
+        """Settings tuple quantized to the 0.1 steps the settings menu uses"""
+        return tuple(
+            value if isinstance(value, str) else round(value, 1)
+            for value in (settings[name] for name in SETTING_NAMES)
+        )
+
+    def _render(self, key):
+        values = dict(zip(SETTING_NAMES, key))
+        out = []
+        for literal, field, spec in self._parts:
+            out.append(literal)
+            if field:
+                out.append(format(values[field], spec))
+        prompt = "".join(out)
+        return prompt, hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+
+    def render(self, settings):
+        """Return (system_prompt, prompt_hash) for a personality vector"""
+        key = self.settings_key(settings)
+        cached = self._rendered.get(key)
+        if cached is not None:
+            self.hits += 1
+            self._rendered.move_to_end(key)
+            return cached
+        self.misses += 1
+        cached = self._render(key)
+        self._rendered[key] = cached
+        if len(self._rendered) > self.max_cached:
+            self._rendered.popitem(last=False)
+        return cached
+
+    def prompt_hash(self, settings):
+        """Stable hash of the rendered system prompt, for cache keys"""
+        return self.render(settings)[1]
+
+    def preset_name(self, settings):
+        """Preset id these settings match, "custom" otherwise (bounded metric label)"""
+        return self._presets.get(self.settings_key(settings), "custom")
+
+    def warm_presets(self):
+        """Render every personality preset ahead of the first message"""
+        for preset in PERSONALITY_PRESETS.values():
+            self.render(preset["settings"])
+
+    def stats(self):
+        return {"cached": len(self._rendered), "hits": self.hits, "misses": self.misses}
+
+
+def generation_options(settings, answer_max_tokens=2000, reasoning_effort="auto"):
+    """Output budget, reasoning effort and stop sequence for a personality.
+
+    Brevity scales the answer between MIN_ANSWER_TOKENS and
+    ``answer_max_tokens`` and, with ``reasoning_effort`` "auto", how long the
+    model may think first. max_tokens counts reasoning tokens too, so the
+    effort's reasoning allowance is added on top of the answer budget.
+    """
+    brevity = min(max(settings["brevity"], 0.0), 1.0)
+    visible = round(answer_max_tokens - (answer_max_tokens - MIN_ANSWER_TOKENS) * brevity) + DEADLINE_BLOCK_TOKENS
+    effort = reasoning_effort
+    if effort == "auto":
+        effort = "low" if brevity >= 0.7 else "medium" if brevity >= 0.4 else "high"
+    reasoning = {"enabled": False} if effort == "off" else {"effort": effort}
+    return {
+        "max_tokens": visible + REASONING_TOKENS[effort],
+        "reasoning": reasoning,
+        "stop": [END_MARKER],
+    }
+
+
+def summary_options(summary_tokens):
+    """Options for the internal summaries: low reasoning effort, with its allowance
+    added to ``summary_tokens`` so a reasoning model still has room for the summary"""
+    return {"max_tokens": summary_tokens + REASONING_TOKENS["low"], "reasoning": {"effort": "low"}}
@@ -0,0 +1,219 @@
+import asyncio
+import datetime
+import heapq
+import os
+import sqlite3
+import threading
+import time
+
+from telethon.errors import FloodWaitError
+
+from functions import send_logs
+from edit_throttler import TELEGRAM_SECONDS, FLOOD_WAITS
+
+# (label, seconds before the deadline)
+REMINDER_OFFSETS = [
+    ("in 7 days", 7 * 24 * 3600),
+    ("tomorrow", 24 * 3600),
+    ("in 1 hour", 3600),
+]
+DUE_TIME = datetime.time(9, 0)  # deadlines only carry a date, treat them as due at 09:00 local time
+
+
+class ReminderStore:
+    """Pending reminders in SQLite, indexed by fire time"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reminders ("
+            "id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, fire_at REAL NOT NULL, "
+            "due_date TEXT NOT NULL, object_name TEXT NOT NULL, label TEXT NOT NULL, "
+            "sent INTEGER NOT NULL DEFAULT 0, "
+            "UNIQUE (user_id, due_date, object_name, label))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS reminders_pending ON reminders(fire_at) WHERE sent = 0")
+        self._db.commit()
+
+    def add(self, rows):
+        """Insert (user_id, fire_at, due_date, object_name, label) rows, returns the new ones with ids"""
+        added = []
+        with self._lock:
+            for row in rows:
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO reminders (user_id, fire_at, due_date, object_name, label) "
+                    "VALUES (?, ?, ?, ?, ?)", row
+                )
+                if cursor.rowcount:
+                    added.append((row[1], cursor.lastrowid, row[0], row[2], row[3], row[4]))
+            self._db.commit()
+        return added
+
+    def due_before(self, start, end):
+        """Unsent reminders with start <= fire_at < end as heap entries"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT fire_at, id, user_id, due_date, object_name, label FROM reminders "
+                "WHERE sent = 0 AND fire_at >= ? AND fire_at < ?", (start, end)
+            ).fetchall()
+
+    def mark_sent(self, ids):
+        with self._lock:
+            self._db.executemany("UPDATE reminders SET sent = 1 WHERE id = ?", [(i,) for i in ids])
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ReminderScheduler:
+    """Sends deadline reminders through the Telegram client.
+
+    Two tiers: everything lives in the indexed SQLite store, and only the
+    next ``horizon`` seconds are loaded into an in-memory heap. Each tick pops
+    what is due from the heap, so the cost per tick does not depend on how
+    many reminders are pending. Sends are batched and rate limited, and
+    FloodWait pauses dispatch instead of dropping reminders.
+    """
+
+    def __init__(self, client, store, tz, tick=1.0, horizon=3600.0, late_grace=6 * 3600.0,
+                 messages_per_second=20.0, batch_size=100):
+        self.client = client
+        self.store = store
+        self.tz = tz
+        self.tick = tick
+        self.horizon = horizon
+        self.late_grace = late_grace
+        self.messages_per_second = messages_per_second
+        self.batch_size = batch_size
+        self._heap = []
+        self._queued = set()  # ids currently in the heap
+        self._loaded_until = None
+        self._task = None
+
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+
+    def fire_times(self, due_date):
+        """(label, epoch seconds) of each reminder for a YYYY-MM-DD deadline, in the bot's time zone"""
+        due = self.tz.localize(datetime.datetime.combine(datetime.date.fromisoformat(due_date), DUE_TIME))
+        due_ts = due.timestamp()
+        return [(label, due_ts - offset) for label, offset in REMINDER_OFFSETS]
+
+    async def schedule(self, user_id, deadlines):
+        """Create the reminders for freshly extracted deadlines"""
+        now = time.time()
+        rows = [
+            (user_id, fire_at, d["deadline"], d["object_name"], label)
+            for d in deadlines
+            for label, fire_at in self.fire_times(d["deadline"])
+            if fire_at > now
+        ]
+        if not rows:
+            return
+        added = await asyncio.to_thread(self.store.add, rows)
+        # Reminders inside the loaded window go straight to the heap, the rest wait in SQLite
+        for entry in added:
+            if self._loaded_until is not None and entry[0] < self._loaded_until:
+                self._push(entry)
+        send_logs("Scheduled %s reminders for user %s", 'info', len(added), user_id)
+
+    def _push(self, entry):
+        if entry[1] not in self._queued:
+            self._queued.add(entry[1])
+            heapq.heappush(self._heap, entry)
+
+    async def _refill(self, now):
+        start = self._loaded_until if self._loaded_until is not None else now - self.late_grace
+        end = now + self.horizon
+        # Move the window first so reminders scheduled during the query go to the heap;
+        # _push drops the ones the query returns as well
+        self._loaded_until = end
+        for entry in await asyncio.to_thread(self.store.due_before, start, end):
+            self._push(entry)
+
+    async def _send(self, entry):
+        fire_at, reminder_id, user_id, due_date, object_name, label = entry
+        text = f"⏰ Reminder: **{object_name}** is due {label} ({due_date})."
+        while True:
+            started = time.monotonic()
+            try:
+                await self.client.send_message(user_id, text, parse_mode="Markdown")
+                self.sent += 1
+                return True
+            except FloodWaitError as e:
+                self.flood_waits += 1
+                FLOOD_WAITS.labels("send_message").inc()
+                send_logs("FloodWait while sending reminders, pausing %ss", 'warning', e.seconds)
+                await asyncio.sleep(e.seconds)
+            except Exception as e:
+                self.failed += 1
+                send_logs("Failed to send reminder %s to user %s: %s", 'warning', reminder_id, user_id, e)
+                return False
+            finally:
+                TELEGRAM_SECONDS.labels("send_message").observe(time.monotonic() - started)
+
+    async def _dispatch(self, now):
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+            entry = heapq.heappop(self._heap)
+            self._queued.discard(entry[1])
+            batch.append(entry)
+        if not batch:
+            return
+
+        finished = 0
+        interval = 1.0 / self.messages_per_second
+        try:
+            for entry in batch:
+                started = time.monotonic()
+                await self._send(entry)
+                # Failed sends are not retried, a dead chat should not block the queue
+                finished += 1
+                # Committed one by one, so a shutdown or crash mid-batch re-sends nothing delivered
+                await asyncio.to_thread(self.store.mark_sent, [entry[1]])
+                await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+        finally:
+            # Not sent yet (a store error or shutdown): back on the heap for the next tick
+            for entry in batch[finished:]:
+                self._push(entry)
+
+    async def _run(self):
+        while True:
+            try:
+                now = time.time()
+                if self._loaded_until is None or now + self.horizon / 2 > self._loaded_until:
+                    await self._refill(now)
+                await self._dispatch(now)
+            except Exception as e:
+                send_logs("Reminder scheduler error: %s", 'error', e)
+            await asyncio.sleep(self.tick)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+            send_logs("Reminder scheduler started", 'info')
+
+    def stats(self):
+        return {"loaded": len(self._heap), "sent": self.sent, "failed": self.failed, "flood_waits": self.flood_waits}
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.store.close()
@@ -0,0 +1,336 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+from functions import send_logs
+from llm_client import Reasoning
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+_EMPTY = object()  # first read of a stream that ended without content
+
+
+class BackendUnavailable(Exception):
+    """The backend cannot serve the request right now"""
+
+
+class CircuitOpenError(BackendUnavailable):
+    """The circuit breaker is open, the request was not sent"""
+
+
+class StreamStalled(BackendUnavailable):
+    """The stream stopped sending tokens and could not be resumed"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a half-open probe"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            # Let exactly one request through to test the backend
+            self._probing = True
+            return True
+        return False
+
+    def cancel_probe(self):
+        """The probe ended without an outcome, let the next request probe instead"""
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                send_logs("Circuit breaker opened after %s failures", 'warning', self.failures)
+            self.opened_at = time.monotonic()
+
+
+# httpx is imported inside the helpers below: they only run once a request
+# has failed, by which point the client has loaded it, and keeping it out of
+# module import keeps bot startup light.
+
+def status_code(error):
+    """HTTP status of an httpx.HTTPStatusError, None for any other error"""
+    import httpx
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    return None
+
+
+def retry_after(error):
+    """Seconds from a Retry-After header, None if absent"""
+    import httpx
+    if isinstance(error, httpx.HTTPStatusError):
+        value = error.response.headers.get("Retry-After", "")
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            return None
+    return None
+
+
+def is_retryable(error):
+    import httpx
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError, StreamStalled))
+
+
+def is_stream_break(error):
+    """A stream that went quiet or lost its connection mid-answer"""
+    import httpx
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+def is_backend_error(error):
+    """Errors that mean "try another backend" rather than a bug.
+
+    Other 4xx responses are about the request itself and would fail on every backend.
+    """
+    import httpx
+    if isinstance(error, httpx.HTTPStatusError):
+        code = error.response.status_code
+        return code in RETRYABLE_STATUS or code >= 500
+    return isinstance(error, (httpx.TransportError, BackendUnavailable, asyncio.TimeoutError))
+
+
+class ResilientClient:
+    """Wraps an LLM client with retries, a circuit breaker, hedging and stall recovery.
+
+    - Requests that fail before the first token are retried with exponential
+      backoff and full jitter, never sooner than Retry-After.
+    - The circuit breaker fails fast while the backend keeps failing.
+    - With ``hedge`` on, a second identical request starts if the first token
+      is later than the observed p95; the first stream to produce wins.
+    - A stream that goes quiet for ``stall_timeout`` mid-answer is resumed by
+      asking the backend to continue the partial answer (assistant prefill).
+    """
+
+    def __init__(self, client, retries=2, backoff_base=0.5, backoff_max=8.0, breaker=None,
+                 first_token_timeout=120.0, stall_timeout=30.0, max_resumes=1,
+                 hedge=False, min_hedge_delay=2.0, ttft_window=200):
+        self.client = client
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.first_token_timeout = first_token_timeout
+        self.stall_timeout = stall_timeout
+        self.max_resumes = max_resumes
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+        self._ttfts = deque(maxlen=ttft_window)
+
+        # Metrics
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.stalls = 0
+        self.resumes = 0
+
+    @property
+    def name(self):
+        return self.client.name
+
+    @property
+    def model(self):
+        return self.client.model
+
+    @property
+    def cost(self):
+        return self.client.cost
+
+    def ttft_p95(self):
+        if not self._ttfts:
+            return None
+        ordered = sorted(self._ttfts)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def _hedge_delay(self):
+        if not self.hedge or len(self._ttfts) < 20:
+            return None
+        return max(self.min_hedge_delay, self.ttft_p95())
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        server_delay = retry_after(error)
+        return max(delay, server_delay) if server_delay is not None else delay
+
+    @staticmethod
+    async def _first(stream):
+        try:
+            return await stream.__anext__()
+        except StopAsyncIteration:
+            return _EMPTY
+
+    @staticmethod
+    async def _discard(tasks):
+        for task, stream in tasks.items():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await stream.aclose()
+        tasks.clear()
+
+    async def _open(self, messages, options):
+        """Start a stream (hedged if enabled) and wait for its first token.
+
+        Returns (stream, first_content) where first_content may be _EMPTY.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} circuit breaker is open")
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        hedge_delay = self._hedge_delay()
+        stream = self.client.stream_chat(messages, **options)
+        tasks = {asyncio.ensure_future(self._first(stream)): stream}
+        primary_task = next(iter(tasks))
+        last_error = None
+        try:
+            while True:
+                elapsed = loop.time() - started
+                timeout = self.first_token_timeout - elapsed
+                if hedge_delay is not None and len(tasks) == 1 and primary_task in tasks:
+                    timeout = min(timeout, hedge_delay - elapsed)
+                if timeout <= 0:
+                    if hedge_delay is not None and elapsed < self.first_token_timeout and primary_task in tasks and len(tasks) == 1:
+                        # First token is late: race a second request against it
+                        self.hedged += 1
+                        hedge_stream = self.client.stream_chat(messages, **options)
+                        tasks[asyncio.ensure_future(self._first(hedge_stream))] = hedge_stream
+                        hedge_delay = None
+                        continue
+                    raise asyncio.TimeoutError(f"No first token from {self.name} in {self.first_token_timeout}s")
+
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stream = tasks.pop(task)
+                    try:
+                        first = task.result()
+                    except Exception as e:
+                        last_error = e
+                        await stream.aclose()
+                        continue
+                    if task is not primary_task:
+                        self.hedge_wins += 1
+                    self._ttfts.append(loop.time() - started)
+                    await self._discard(tasks)
+                    return stream, first
+                if not tasks:
+                    raise last_error
+        except BaseException:
+            await self._discard(tasks)
+            raise
+
+    async def stream_chat(self, messages, **options):
+        """Yield content deltas, retrying and resuming as described on the class"""
+        produced = []
+        attempt = 0
+        resumes = 0
+        probe = False  # this request is the half-open probe and has no outcome yet
+        try:
+            while True:
+                request = messages
+                if produced:
+                    request = messages + [{"role": "assistant", "content": "".join(produced)}]
+                probe = self.breaker.state == "half_open"
+                try:
+                    stream, first = await self._open(request, options)
+                except CircuitOpenError:
+                    probe = False
+                    raise
+                except Exception as e:
+                    if not is_retryable(e):
+                        # A bad request or key is this request's problem, not the
+                        # backend's: other users must not see the circuit open
+                        raise
+                    self.breaker.record_failure()
+                    probe = False
+                    if attempt >= self.retries:
+                        raise
+                    delay = self._backoff(attempt, e)
+                    attempt += 1
+                    self.retried += 1
+                    send_logs("%s request failed (%s), retry %s in %.1fs", 'warning', self.name, str(e) or type(e).__name__, attempt, delay)
+                    await asyncio.sleep(delay)
+                    continue
+
+                try:
+                    if first is not _EMPTY:
+                        if not isinstance(first, Reasoning):
+                            produced.append(first)
+                        yield first
+                    while True:
+                        try:
+                            content = await asyncio.wait_for(stream.__anext__(), self.stall_timeout)
+                        except StopAsyncIteration:
+                            break
+                        # A resumed request continues the answer, the reasoning is not replayed
+                        if not isinstance(content, Reasoning):
+                            produced.append(content)
+                        yield content
+                except Exception as e:
+                    if not is_stream_break(e):
+                        raise
+                    # Stalled or dropped mid-answer: continue from what we have
+                    self.stalls += 1
+                    self.breaker.record_failure()
+                    probe = False
+                    if resumes >= self.max_resumes:
+                        raise StreamStalled(f"{self.name} stopped sending tokens after {len(produced)} chunks") from e
+                    resumes += 1
+                    self.resumes += 1
+                    send_logs("%s stream stalled after %s chunks, resuming", 'warning', self.name, len(produced))
+                    continue
+                finally:
+                    await stream.aclose()
+
+                self.breaker.record_success()
+                probe = False
+                return
+        finally:
+            # Cancelled (a superseded generation) or closed early: the breaker
+            # would otherwise wait forever for this probe's outcome
+            if probe:
+                self.breaker.cancel_probe()
+
+    async def complete(self, messages, timeout=None, **options):
+        return await self.client.complete(messages, timeout=timeout, **options)
+
+    def stats(self):
+        p95 = self.ttft_p95()
+        return {
+            "breaker": self.breaker.state,
+            "retried": self.retried,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "stalls": self.stalls,
+            "resumes": self.resumes,
+            "ttft_p95": round(p95, 3) if p95 is not None else None,
+        }
+
+    async def close(self):
+        await self.client.close()
@@ -0,0 +1,300 @@
+import asyncio
+import time
+from collections import deque
+
+from functions import send_logs
+
+
+WRONGTYPE = b"-WRONGTYPE Operation against a key holding the wrong kind of value\r\n"
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+def encode_command(*args):
+    """Encode a command as a RESP array of bulk strings"""
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode('utf-8')
+        elif not isinstance(arg, (bytes, bytearray)):
+            arg = str(arg).encode('utf-8')
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+
+async def read_reply(reader):
+    """Read one RESP value from a stream"""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode('utf-8')
+    if kind == b"-":
+        raise RespError(body.decode('utf-8'))
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RespError(f"Unknown reply type: {line!r}")
+
+
+class RespClient:
+    """Minimal asyncio client for Redis-protocol servers (one pipelined connection)"""
+
+    def __init__(self, host="127.0.0.1", port=6379):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        if self._writer is None or self._writer.is_closing():
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def execute(self, *args):
+        async with self._lock:
+            await self._connect()
+            try:
+                self._writer.write(encode_command(*args))
+                await self._writer.drain()
+                return await read_reply(self._reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # Drop the broken connection so the next call reconnects
+                self._writer.close()
+                self._writer = None
+                raise
+
+    async def get(self, key):
+        return await self.execute("GET", key)
+
+    async def set(self, key, value, ex=None):
+        """SET, expiring after ``ex`` seconds if given"""
+        if ex:
+            return await self.execute("SET", key, value, "EX", ex)
+        return await self.execute("SET", key, value)
+
+    async def delete(self, key):
+        return await self.execute("DEL", key)
+
+    async def rpush(self, key, *values):
+        return await self.execute("RPUSH", key, *values)
+
+    async def lpop(self, key):
+        return await self.execute("LPOP", key)
+
+    async def llen(self, key):
+        return await self.execute("LLEN", key)
+
+    async def blpop(self, keys, timeout=0):
+        """(key, value) from the first non-empty list, None after ``timeout`` seconds.
+
+        Holds the connection while it waits, so use a dedicated client.
+        """
+        reply = await self.execute("BLPOP", *keys, timeout)
+        return tuple(reply) if reply else None
+
+    async def hset(self, key, field, value):
+        return await self.execute("HSET", key, field, value)
+
+    async def hgetall(self, key):
+        reply = await self.execute("HGETALL", key) or []
+        return dict(zip(reply[0::2], reply[1::2]))
+
+    async def hdel(self, key, *fields):
+        return await self.execute("HDEL", key, *fields)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class RespServer:
+    """In-process stand-in for a Redis server, for local runs and benchmarks.
+
+    Supports PING, GET, SET (with EX), DEL and EXISTS on strings, RPUSH,
+    LPOP, BLPOP and LLEN on lists and HSET, HGETALL and HDEL on hashes, all
+    in memory. Expired keys are dropped when they are next read.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.data = {}
+        self._expires = {}  # key -> monotonic time it expires
+        self._waiters = {}  # list key -> deque of futures blocked in BLPOP
+        self._server = None
+        self._writers = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        send_logs(f"RESP stand-in listening on {self.host}:{self.port}", 'info')
+        return self
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    command = await read_reply(reader)
+                    if command[0].upper() == b"BLPOP":
+                        reply = await self._blpop(command[1:-1], float(command[-1]))
+                    else:
+                        reply = self._dispatch(command)
+                    writer.write(reply)
+                    await writer.drain()
+                except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+                    # Client went away or the loop is shutting down
+                    break
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def _encode(value):
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, (list, tuple)):
+            return b"*%d\r\n" % len(value) + b"".join(RespServer._encode(item) for item in value)
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _typed(self, key, kind):
+        """Value at ``key`` if it has type ``kind`` (created when missing), None on a type clash"""
+        value = self.data.get(key)
+        if value is None:
+            value = self.data[key] = kind()
+        return value if isinstance(value, kind) else None
+
+    def _push(self, key, values):
+        # Hand values straight to clients blocked in BLPOP, oldest waiter first
+        waiters = self._waiters.get(key)
+        values = list(values)
+        while waiters and values:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result((key, values.pop(0)))
+        if values:
+            self.data.setdefault(key, deque()).extend(values)
+
+    async def _blpop(self, keys, timeout):
+        for key in keys:
+            items = self.data.get(key)
+            if isinstance(items, deque) and items:
+                value = items.popleft()
+                if not items:
+                    del self.data[key]
+                return self._encode([key, value])
+        future = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self._waiters.setdefault(key, deque()).append(future)
+        try:
+            key, value = await asyncio.wait_for(future, timeout or None)
+            return self._encode([key, value])
+        except asyncio.TimeoutError:
+            return b"*-1\r\n"
+        finally:
+            for key in keys:
+                waiters = self._waiters.get(key)
+                if waiters is not None:
+                    if future in waiters:
+                        waiters.remove(future)
+                    if not waiters:
+                        del self._waiters[key]
+
+    def _expire(self, keys):
+        now = time.monotonic()
+        for key in keys:
+            expires_at = self._expires.get(key)
+            if expires_at is not None and expires_at <= now:
+                del self._expires[key]
+                self.data.pop(key, None)
+
+    def _dispatch(self, command):
+        name = command[0].decode('utf-8').upper()
+        args = command[1:]
+        if self._expires and args:
+            self._expire(args if name in ("DEL", "EXISTS") else args[:1])
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name == "GET":
+            value = self.data.get(args[0])
+            if value is not None and not isinstance(value, bytes):
+                return WRONGTYPE
+            return self._encode(value)
+        if name == "SET":
+            self.data[args[0]] = args[1]
+            self._expires.pop(args[0], None)
+            if len(args) >= 4 and args[2].upper() == b"EX":
+                self._expires[args[0]] = time.monotonic() + int(args[3])
+            return b"+OK\r\n"
+        if name == "DEL":
+            for key in args:
+                self._expires.pop(key, None)
+            removed = sum(1 for key in args if self.data.pop(key, None) is not None)
+            return b":%d\r\n" % removed
+        if name == "EXISTS":
+            return b":%d\r\n" % sum(1 for key in args if key in self.data)
+        if name == "RPUSH":
+            items = self.data.get(args[0])
+            if items is not None and not isinstance(items, deque):
+                return WRONGTYPE
+            length = len(items or ()) + len(args) - 1
+            self._push(args[0], args[1:])
+            return b":%d\r\n" % length
+        if name in ("LPOP", "LLEN"):
+            items = self.data.get(args[0])
+            if items is not None and not isinstance(items, deque):
+                return WRONGTYPE
+            if name == "LLEN":
+                return b":%d\r\n" % len(items or ())
+            if not items:
+                return b"$-1\r\n"
+            value = items.popleft()
+            if not items:
+                del self.data[args[0]]
+            return self._encode(value)
+        if name == "HSET":
+            fields = self._typed(args[0], dict)
+            if fields is None:
+                return WRONGTYPE
+            added = 0
+            for field, value in zip(args[1::2], args[2::2]):
+                added += field not in fields
+                fields[field] = value
+            return b":%d\r\n" % added
+        if name in ("HGETALL", "HDEL"):
+            fields = self.data.get(args[0])
+            if fields is not None and not isinstance(fields, dict):
+                return WRONGTYPE
+            fields = fields or {}
+            if name == "HGETALL":
+                return self._encode([item for pair in fields.items() for item in pair])
+            removed = sum(1 for field in args[1:] if fields.pop(field, None) is not None)
+            if not fields:
+                self.data.pop(args[0], None)
+            return b":%d\r\n" % removed
+        return b"-ERR unknown command '%s'\r\n" % name.encode('utf-8')
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
@@ -0,0 +1,230 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+from collections import defaultdict, deque
+
+import metrics
+from functions import send_logs
+
+BACKGROUND_PRIORITY = 10  # StreamLimiter priority for work nobody is waiting on
+
+QUEUE_DEPTH = metrics.gauge("generation_queue_depth", "Generations waiting for a scheduler slot")
+RUNNING = metrics.gauge("generation_scheduler_running", "Generations holding a scheduler slot")
+QUEUE_WAIT_SECONDS = metrics.histogram("generation_queue_wait_seconds", "Time a generation waited for a slot")
+SUPERSEDED = metrics.counter("generation_superseded_total", "Generations cancelled by a newer message")
+STREAMS_ACTIVE = metrics.gauge("llm_streams_active", "LLM streams holding a stream limiter slot")
+STREAMS_WAITING = metrics.gauge("llm_streams_waiting", "LLM streams waiting for a stream limiter slot")
+
+
+class Superseded(Exception):
+    """The job was replaced by a newer request from the same user"""
+
+
+class _Job:
+    __slots__ = ("user_id", "factory", "future", "task", "enqueued_at")
+
+    def __init__(self, user_id, factory, future):
+        self.user_id = user_id
+        self.factory = factory
+        self.future = future
+        self.task = None
+        self.enqueued_at = time.monotonic()
+
+
+class GenerationScheduler:
+    """Fair scheduler for LLM generations.
+
+    Jobs wait in per-user queues and are started round-robin across users,
+    with at most ``per_user_limit`` running per user and ``max_concurrent``
+    running overall. Submitting with ``supersede=True`` cancels everything
+    the user still has queued or running.
+    """
+
+    def __init__(self, max_concurrent=4, per_user_limit=1):
+        self.max_concurrent = max_concurrent
+        self.per_user_limit = per_user_limit
+        self._pending = defaultdict(deque)   # user_id -> deque of queued jobs
+        self._running = defaultdict(set)     # user_id -> set of running jobs
+        self._rotation = deque()             # users with queued jobs, in turn order
+        self._running_total = 0
+
+        # Metrics
+        self.started = 0
+        self.superseded = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    async def run(self, user_id, factory, supersede=True):
+        """Run ``factory()`` (a coroutine function) when a slot is free and return its result.
+
+        Raises Superseded if a newer job from the same user replaced it.
+        """
+        if supersede:
+            self.cancel_user(user_id)
+
+        job = _Job(user_id, factory, asyncio.get_running_loop().create_future())
+        if not self._pending[user_id]:
+            self._rotation.append(user_id)
+        self._pending[user_id].append(job)
+        self._dispatch()
+        return await job.future
+
+    def cancel_user(self, user_id):
+        """Cancel every queued and running job of a user"""
+        for job in self._pending.pop(user_id, ()):
+            self._supersede(job)
+        if user_id in self._rotation:
+            self._rotation.remove(user_id)
+        for job in list(self._running.get(user_id, ())):
+            job.task.cancel()
+            self._supersede(job)
+        QUEUE_DEPTH.set(self.queue_depth())
+
+    def _supersede(self, job):
+        if not job.future.done():
+            job.future.set_exception(Superseded())
+            # Nobody may await it after a cancellation, don't log "exception never retrieved"
+            job.future.exception()
+            self.superseded += 1
+            SUPERSEDED.inc()
+            send_logs("Generation for user %s superseded by a newer message", 'info', job.user_id)
+
+    def _dispatch(self):
+        checked = 0
+        while self._rotation and self._running_total < self.max_concurrent and checked < len(self._rotation):
+            user_id = self._rotation.popleft()
+            queue = self._pending[user_id]
+            if len(self._running[user_id]) >= self.per_user_limit:
+                # User is at its limit, keep its turn for later
+                self._rotation.append(user_id)
+                checked += 1
+                continue
+            checked = 0
+            self._start(queue.popleft())
+            if queue:
+                self._rotation.append(user_id)
+            else:
+                del self._pending[user_id]
+        QUEUE_DEPTH.set(self.queue_depth())
+        RUNNING.set(self._running_total)
+
+    def _start(self, job):
+        waited = time.monotonic() - job.enqueued_at
+        self.started += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        QUEUE_WAIT_SECONDS.observe(waited)
+
+        self._running[job.user_id].add(job)
+        self._running_total += 1
+        job.task = asyncio.ensure_future(job.factory())
+        job.task.add_done_callback(lambda task: self._finish(job))
+
+    def _finish(self, job):
+        running = self._running[job.user_id]
+        running.discard(job)
+        if not running:
+            del self._running[job.user_id]
+        self._running_total -= 1
+
+        if not job.future.done():
+            if job.task.cancelled():
+                job.future.cancel()
+            elif job.task.exception() is not None:
+                job.future.set_exception(job.task.exception())
+            else:
+                job.future.set_result(job.task.result())
+        self._dispatch()
+
+    def queue_depth(self):
+        return sum(len(queue) for queue in self._pending.values())
+
+    def stats(self):
+        """Queue depth, running jobs and wait-time metrics"""
+        return {
+            "queue_depth": self.queue_depth(),
+            "queued_users": len(self._rotation),
+            "running": self._running_total,
+            "started": self.started,
+            "superseded": self.superseded,
+            "wait_time_avg": round(self.wait_time_total / self.started, 4) if self.started else 0.0,
+            "wait_time_max": round(self.wait_time_max, 4),
+        }
+
+
+class StreamLimiter:
+    """Caps the LLM streams in flight, whichever job or background task opens them.
+
+    A generation may open several streams (a long PDF's chunk summaries),
+    so the GenerationScheduler's job slots alone do not bound upstream
+    requests. Waiting streams start lowest ``priority`` first, then in order.
+    """
+
+    def __init__(self, max_streams=4):
+        self.max_streams = max_streams
+        self._active = 0
+        self._waiters = []  # heap of (priority, arrival, future)
+        self._arrivals = itertools.count()
+
+        # Metrics
+        self.waited = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=0):
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority):
+        if self._active < self.max_streams and not self._waiters:
+            self._active += 1
+            STREAMS_ACTIVE.set(self._active)
+            return
+        self.waited += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), future))
+        STREAMS_WAITING.set(len(self._waiters))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled, pass it on
+                self._release()
+            raise
+
+    def _release(self):
+        # A released slot goes straight to the next waiter, so nobody can jump the queue
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                break
+        else:
+            self._active -= 1
+        STREAMS_ACTIVE.set(self._active)
+        STREAMS_WAITING.set(len(self._waiters))
+
+    def stats(self):
+        return {"active": self._active, "waiting": len(self._waiters), "waited": self.waited}
+
+
+class LimitedLLM:
+    """An LLM client whose streams each hold a StreamLimiter slot while they run"""
+
+    def __init__(self, llm, limiter, priority=0):
+        self.llm = llm
+        self.limiter = limiter
+        self.priority = priority
+
+    async def stream_chat(self, messages, **options):
+        async with self.limiter.slot(self.priority):
+            async for content in self.llm.stream_chat(messages, **options):
+                yield content
+
+    def __getattr__(self, name):
+        # states, stats(), complete(), close() and the rest come from the wrapped client
+        return getattr(self.llm, name)
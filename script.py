@@ -3,39 +3,318 @@ from telethon.tl.custom import Button
 
 import configparser
 import datetime
-import pytz
-import requests
 import json
+import os
+import pytz
 import asyncio
-import PyPDF2
-import io
+import time
 import traceback
 
-from functions import send_logs, get_user_id, format_display_name
-from functions import default_settings, PERSONALITY_PRESETS, get_user_settings, user_settings
+from functions import send_logs, get_user_id, format_display_name, configure_logging
+from functions import default_settings, PERSONALITY_PRESETS
+from llm_client import DeepSeekClient, OllamaClient, Reasoning, is_local_url
+from llm_router import LLMRouter
+from resilience import ResilientClient, CircuitBreaker, CircuitOpenError, StreamStalled
+from summarize import DocumentSummarizer
+from pdf_extractor import PdfExtractor, SpooledDownload, download_document, read_text
+from settings_store import UserSettings, create_settings_store, create_backend
+from conversation import ConversationMemory, refers_to_conversation
+from prompts import PromptTemplate, generation_options, REASONING_TOKENS
+from scheduler import GenerationScheduler, Superseded, StreamLimiter, LimitedLLM, BACKGROUND_PRIORITY
+from edit_throttler import EditCoalescer, TELEGRAM_SECONDS
+from deadlines import DeadlineStreamParser, DeadlineStore
+from reminders import ReminderStore, ReminderScheduler
+from resp import RespServer
+from workqueue import WorkDispatcher, RemoteMessage, RemoteTelegram, RemoteEditCoalescer, RemoteReminders
+from doc_index import DocumentIndex, refers_to_document
+from near_duplicates import NearDuplicateIndex
+from chunking import ChunkedStreamBuffer, split_message
+from cache import LRUCache, SQLiteCache, TieredCache, content_hash, normalize_prompt
+import metrics
 
 # Constants
 MAX_MESSAGE_LENGTH = 4000
-UPDATE_INTERVAL = 2  # seconds
+UPDATE_INTERVAL = 2  # minimum seconds between live edits of one message
+PREVIEW_SUBMIT_INTERVAL = 0.25  # seconds between previews handed to the edit coalescer
 BINARY_SETTINGS = ["caps_lock", "emoji"]
 VALUE_ADJUSTMENTS = [("-0.2", -0.2), ("-0.1", -0.1), ("+0.1", 0.1), ("+0.2", 0.2)]
+PDF_MAX_MEMORY = 2 * 1024 * 1024  # bytes kept in memory before spilling to a temp file
+PDF_TOKEN_BUDGET = 120000  # max tokens of PDF text read from one document
+PDF_CHUNK_TOKENS = 8000  # longer PDFs are summarized in chunks of this size first
+DEEPSEEK_ERROR_PREFIX = "Error calling DeepSeek"
+DOCUMENT_CONTEXT_TOKENS = 3000  # passages of earlier PDFs sent with a follow-up question
 
-#### Access credentials
-config = configparser.ConfigParser()
-config.read('config.ini') # read config.ini file
+# Generation metrics, labelled by the model that answered and the personality preset
+GENERATION_TTFT = metrics.histogram("generation_time_to_first_token_seconds", "Time to the first streamed token", ["model", "preset"])
+GENERATION_TTFVT = metrics.histogram("generation_time_to_first_visible_token_seconds",
+                                     "Time to the first answer token, after any reasoning", ["model", "preset"])
+GENERATION_REASONING_SECONDS = metrics.histogram("generation_reasoning_seconds", "Time the model spent reasoning",
+                                                 ["model", "preset", "effort"])
+GENERATION_SECONDS = metrics.histogram("generation_duration_seconds", "Total generation latency", ["model", "preset"])
+GENERATION_TOKEN_RATE = metrics.histogram("generation_tokens_per_second", "Streamed tokens per second after the first token",
+                                          ["model", "preset"], buckets=metrics.RATE_BUCKETS)
+GENERATION_ERRORS = metrics.counter("generation_errors_total", "Generations that ended in an error", ["reason"])
+GENERATIONS_IN_FLIGHT = metrics.gauge("generations_in_flight", "Generations currently streaming")
 
-api_id = config.get('default','api_id') # get the api id
-api_hash = config.get('default','api_hash') # get the api hash
-BOT_TOKEN = config.get('default','BOT_TOKEN') # get the bot token
-DEEPSEEK_API_KEY = "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"
-DEEPSEEK_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+moldova_tz = pytz.timezone('Europe/Chisinau')
+week_day = int((datetime.datetime.now(moldova_tz)).weekday())
+model_deepseek = "deepseek/deepseek-r1:free"
 
-client = TelegramClient('sessions/session_master', api_id, api_hash).start(bot_token=BOT_TOKEN)
+HANDLERS = []  # (callback, event builder), registered on the client by create_app
 
-model_deepseek = "deepseek/deepseek-r1:free"
+def on(event_builder):
+    """Like client.on, but the client is attached later in create_app"""
+    def decorator(callback):
+        HANDLERS.append((callback, event_builder))
+        return callback
+    return decorator
 
-moldova_tz = pytz.timezone('Europe/Chisinau')
-week_day = int((datetime.datetime.now(moldova_tz)).weekday())
+def create_app(config_file='config.ini', telegram_client=None, worker=None):
+    """Build the Telegram client, backends and stores from config without connecting.
+
+    Nothing here does network I/O: the client logs in and the providers are
+    probed once __main__ starts the loop. ``telegram_client`` replaces the
+    TelegramClient (the benchmark passes a fake one). With a ``worker``
+    (workqueue.QueueWorker) every Telegram call is routed to the receiver.
+    """
+    global config, api_id, api_hash, BOT_TOKEN, DEEPSEEK_API_KEY, DEEPSEEK_API_URL, client
+    global edit_coalescer, deepseek, ollama, ollama_enabled, openrouter, llm, llm_streams, pdf_extractor, cache
+    global system_prompt_template, document_summarizer, generation_scheduler, settings_store
+    global deadline_store, metrics_server, loop_lag_monitor, reminder_scheduler, dispatcher
+    global document_index, near_duplicates, conversation_memory, answer_max_tokens, reasoning_effort
+
+    #### Access credentials
+    config = configparser.ConfigParser()
+    config.read(config_file) # read config.ini file
+
+    configure_logging(
+        path=config.get('default', 'log_path', fallback='learnkeybot.log'),
+        level=config.get('default', 'log_level', fallback='INFO'),
+        json_lines=config.getboolean('default', 'log_json', fallback=False),
+        rotation=config.get('default', 'log_rotation', fallback='size'),
+        max_bytes=config.getint('default', 'log_max_mb', fallback=10) * 1024 * 1024,
+        backup_count=config.getint('default', 'log_backup_count', fallback=5),
+        when=config.get('default', 'log_rotate_when', fallback='midnight')
+    )
+
+    api_id = config.get('default','api_id') # get the api id
+    api_hash = config.get('default','api_hash') # get the api hash
+    BOT_TOKEN = config.get('default','BOT_TOKEN') # get the bot token
+    DEEPSEEK_API_KEY = config.get('default', 'deepseek_api_key', fallback='') or os.environ.get("OPENROUTER_API_KEY", "")
+    DEEPSEEK_API_URL = config.get('default', 'deepseek_api_url', fallback="https://openrouter.ai/api/v1/chat/completions")
+    if not DEEPSEEK_API_KEY and not is_local_url(DEEPSEEK_API_URL):
+        raise SystemExit(f"No API key for {DEEPSEEK_API_URL}: set deepseek_api_key in {config_file} "
+                         f"or the OPENROUTER_API_KEY environment variable")
+
+    if worker is not None:
+        client = RemoteTelegram(worker)
+        edit_coalescer = RemoteEditCoalescer(worker)
+    else:
+        # Not connected here, __main__ logs in once everything is built
+        client = telegram_client or TelegramClient('sessions/session_master', api_id, api_hash)
+        edit_coalescer = EditCoalescer(
+            client,
+            edits_per_second=config.getfloat('default', 'telegram_edits_per_second', fallback=20.0),
+            min_interval=UPDATE_INTERVAL,
+            max_concurrent_edits=config.getint('default', 'telegram_concurrent_edits', fallback=8)
+        )
+
+    deepseek = DeepSeekClient(
+        DEEPSEEK_API_URL, DEEPSEEK_API_KEY, model_deepseek,
+        max_connections=config.getint('default', 'llm_max_connections', fallback=10),
+        keepalive_expiry=config.getfloat('default', 'llm_keepalive_expiry', fallback=30.0),
+        connect_timeout=config.getfloat('default', 'llm_connect_timeout', fallback=5.0),
+        read_timeout=config.getfloat('default', 'llm_read_timeout', fallback=60.0),
+        http2=config.getboolean('default', 'llm_http2', fallback=True)
+    )
+
+    # Local model served by the ollama container from docker-compose.yml
+    ollama = OllamaClient(
+        config.get('default', 'ollama_url', fallback='http://ollama:11434'),
+        config.get('default', 'ollama_model', fallback='deepseek-r1:1.5b'),
+        max_connections=config.getint('default', 'ollama_max_connections', fallback=2),
+        read_timeout=config.getfloat('default', 'llm_read_timeout', fallback=60.0)
+    )
+    ollama_enabled = config.getboolean('default', 'ollama_enabled', fallback=True)
+    answer_max_tokens = config.getint('default', 'answer_max_tokens', fallback=2000)
+    reasoning_effort = config.get('default', 'reasoning_effort', fallback='auto')
+    if reasoning_effort != 'auto' and reasoning_effort not in REASONING_TOKENS:
+        raise ValueError(f"Unknown reasoning_effort: {reasoning_effort}")
+    # Retries, circuit breaker, hedging and stall recovery around the OpenRouter stream
+    openrouter = ResilientClient(
+        deepseek,
+        retries=config.getint('default', 'llm_retries', fallback=2),
+        backoff_max=config.getfloat('default', 'llm_backoff_max', fallback=8.0),
+        breaker=CircuitBreaker(
+            failure_threshold=config.getint('default', 'llm_breaker_failures', fallback=5),
+            reset_timeout=config.getfloat('default', 'llm_breaker_reset', fallback=30.0)
+        ),
+        first_token_timeout=config.getfloat('default', 'llm_first_token_timeout', fallback=120.0),
+        stall_timeout=config.getfloat('default', 'llm_stall_timeout', fallback=30.0),
+        hedge=config.getboolean('default', 'llm_hedge', fallback=False)
+    )
+    router = LLMRouter(
+        [openrouter, ollama] if ollama_enabled else [openrouter],
+        policy=config.get('default', 'llm_routing', fallback='primary'),
+        local=ollama if ollama_enabled else None,
+        short_prompt_tokens=config.getint('default', 'llm_short_prompt_tokens', fallback=0)
+    )
+    # Every stream takes a slot, so llm_max_concurrent bounds upstream requests and not just jobs
+    llm_max_concurrent = config.getint('default', 'llm_max_concurrent', fallback=4)
+    llm_streams = StreamLimiter(llm_max_concurrent)
+    llm = LimitedLLM(router, llm_streams)
+
+    pdf_extractor = PdfExtractor(
+        max_workers=config.getint('default', 'pdf_workers', fallback=0) or None,
+        max_concurrent_documents=config.getint('default', 'pdf_max_concurrent_documents', fallback=2),
+        max_pages=config.getint('default', 'pdf_max_pages', fallback=500),
+        time_budget=config.getfloat('default', 'pdf_time_budget', fallback=60.0)
+    )
+
+    cache_path = config.get('default', 'cache_sqlite_path', fallback='sessions/cache.sqlite3')
+    cache_ttl = config.getfloat('default', 'cache_ttl_hours', fallback=168) * 3600
+    cache = TieredCache(
+        LRUCache(max_chars=config.getint('default', 'cache_memory_mb', fallback=64) * 1024 * 1024, ttl=cache_ttl),
+        SQLiteCache(
+            cache_path,
+            ttl=cache_ttl,
+            max_bytes=config.getint('default', 'cache_disk_mb', fallback=256) * 1024 * 1024
+        ) if cache_path else None
+    )
+
+    system_prompt_template = PromptTemplate(config.get('default', 'system_prompt_path', fallback='system_prompt.txt'))
+    system_prompt_template.warm_presets()
+
+    document_summarizer = DocumentSummarizer(
+        llm, cache,
+        chunk_tokens=PDF_CHUNK_TOKENS,
+        max_concurrency=config.getint('default', 'pdf_summary_concurrency', fallback=4)
+    )
+
+    generation_scheduler = GenerationScheduler(
+        max_concurrent=llm_max_concurrent,
+        per_user_limit=config.getint('default', 'llm_per_user_limit', fallback=1)
+    )
+
+    settings_backend = dict(
+        backend=config.get('default', 'settings_backend', fallback='sqlite'),
+        sqlite_path=config.get('default', 'settings_sqlite_path', fallback='sessions/settings.sqlite3'),
+        redis_host=config.get('default', 'redis_host', fallback='127.0.0.1'),
+        redis_port=config.getint('default', 'redis_port', fallback=6379)
+    )
+    settings_store = create_settings_store(
+        **settings_backend,
+        cache_ttl=config.getfloat('default', 'settings_cache_seconds', fallback=30)
+    )
+
+    # Recent turns per user, kept next to the settings and summarized once they fall out of the window
+    conversation_memory = ConversationMemory(
+        create_backend(**settings_backend, name="conversations",
+                       ttl=config.getfloat('default', 'conversation_ttl_hours', fallback=72) * 3600),
+        # Background summaries share the stream cap, behind the answers users are waiting for
+        LimitedLLM(router, llm_streams, priority=BACKGROUND_PRIORITY),
+        token_budget=config.getint('default', 'conversation_tokens', fallback=1500),
+        max_turns=config.getint('default', 'conversation_max_turns', fallback=20),
+        cache_ttl=config.getfloat('default', 'conversation_cache_seconds', fallback=30)
+    ) if config.getboolean('default', 'conversation_enabled', fallback=True) else None
+
+    deadline_store = DeadlineStore(config.get('default', 'deadlines_sqlite_path', fallback='sessions/deadlines.sqlite3'))
+
+    # Earlier PDFs of each user, so follow-up questions only send the relevant passages
+    document_index_path = config.get('default', 'document_index_path', fallback='sessions/documents.sqlite3')
+    document_index = DocumentIndex(
+        document_index_path,
+        max_documents=config.getint('default', 'document_index_max_documents', fallback=5),
+        ttl=config.getfloat('default', 'document_index_ttl_days', fallback=30) * 86400,
+        min_coverage=config.getfloat('default', 'document_index_min_coverage', fallback=0.25)
+    ) if document_index_path else None
+
+    # Answers reused for prompts that are almost the same text (0 disables)
+    near_duplicate_threshold = config.getfloat('default', 'near_duplicate_threshold', fallback=0.85)
+    near_duplicates = NearDuplicateIndex(
+        threshold=near_duplicate_threshold,
+        max_entries=config.getint('default', 'near_duplicate_max_entries', fallback=10000)
+    ) if near_duplicate_threshold else None
+
+    metrics_port = config.getint('default', 'metrics_port', fallback=9464)
+    metrics_server = metrics.MetricsServer(
+        host=config.get('default', 'metrics_host', fallback='127.0.0.1'),
+        port=metrics_port
+    ) if metrics_port else None
+    loop_lag_monitor = metrics.LoopLagMonitor()
+
+    if worker is not None:
+        reminder_scheduler = RemoteReminders(worker)
+    else:
+        reminder_scheduler = ReminderScheduler(
+            client,
+            ReminderStore(config.get('default', 'reminders_sqlite_path', fallback='sessions/reminders.sqlite3')),
+            moldova_tz,
+            messages_per_second=config.getfloat('default', 'reminder_messages_per_second', fallback=20.0)
+        )
+
+    # Receiver mode: text and PDF work goes to worker processes (see worker.py)
+    dispatcher = None
+    if worker is None and config.getboolean('default', 'queue_enabled', fallback=False):
+        dispatcher = WorkDispatcher(
+            client, edit_coalescer, reminder_scheduler,
+            host=config.get('default', 'queue_host', fallback='127.0.0.1'),
+            port=config.getint('default', 'queue_port', fallback=6379)
+        )
+
+    for callback, event_builder in HANDLERS:
+        client.add_event_handler(callback, event_builder)
+    return client
+
+def response_cache_key(content, settings):
+    """Cache key for a final response: normalized prompt, system prompt hash and model"""
+    return "resp:" + content_hash(
+        normalize_prompt(content),
+        system_prompt_template.prompt_hash(settings),
+        model_deepseek
+    )
+
+async def cached_answer(key):
+    """(answer, deadlines) stored under a response key, None on a miss"""
+    value = await cache.get(key)
+    if value is None:
+        return None
+    try:
+        entry = json.loads(value)
+        return entry["answer"], entry["deadlines"]
+    except (ValueError, TypeError, KeyError):
+        return None  # written before deadlines were stored with the answer
+
+def cacheable(response, reply):
+    """Only complete answers of the primary model are cached (and offered to near-duplicates)"""
+    # A fallback model's answer would otherwise be served under the primary model's key for days
+    return not response.startswith(DEEPSEEK_ERROR_PREFIX) and not reply.cut_off and reply.model == model_deepseek
+
+async def cache_answer(key, response, deadlines):
+    await cache.set(key, json.dumps({"answer": response, "deadlines": deadlines}, ensure_ascii=False))
+
+async def near_duplicate_answer(signature, scope, user_id):
+    """(answer, deadlines) of an almost identical earlier prompt, None if there is none"""
+    answer_key = near_duplicates.find(signature, scope)
+    if answer_key is None:
+        return None
+    cached = await cached_answer(answer_key)
+    if cached is None:
+        near_duplicates.stale()
+        return None
+    near_duplicates.hit()
+    send_logs("Near-duplicate prompt from user %s, reusing an earlier answer", 'info', user_id)
+    return cached
+
+async def save_deadlines(user_id, deadlines, settings):
+    """Store and schedule deadlines for this user, returns the confirmation to append to the answer"""
+    if not deadlines:
+        return ""
+    await deadline_store.add(user_id, deadlines)
+    await reminder_scheduler.schedule(user_id, deadlines)
+    saved = "\n".join(f"• {d['object_name']}: {d['deadline']}" for d in deadlines)
+    saved = f"\n\n📅 Saved deadlines:\n{saved}"
+    return saved.upper() if settings["caps_lock"] == "ON" else saved
 
 def create_adjustment_buttons(setting, current_value):
     """Create adjustment buttons for numeric settings"""
@@ -75,10 +354,10 @@ def create_settings_grid():
     return buttons
 
 # /start
-@client.on(events.NewMessage(pattern="/start")) 
+@on(events.NewMessage(pattern="/start")) 
 async def start(event):
     user_id = get_user_id(event)
-    get_user_settings(user_id)  # Initialize user settings
+    await settings_store.get(user_id)  # Initialize user settings
     
     text = ("AI Explanation Bot 🤖 ready (powered by DeepSeek R1)\n\n"
             "Send me content to analyze, and I'll explain why it's important "
@@ -93,7 +372,7 @@ async def start(event):
     await client.send_message(user_id, text, buttons=buttons, parse_mode="Markdown")
 
 # /settings
-@client.on(events.NewMessage(pattern='(?i)/settings'))
+@on(events.NewMessage(pattern='(?i)/settings'))
 async def settings_command(event):
     user_id = get_user_id(event)
     buttons = create_settings_grid()
@@ -106,10 +385,10 @@ async def settings_command(event):
     )
 
 # /settings menu handler
-@client.on(events.CallbackQuery(pattern=r"setting:(.+)"))
+@on(events.CallbackQuery(pattern=r"setting:(.+)"))
 async def on_setting_button(event):
     user_id = get_user_id(event)
-    user_prefs = get_user_settings(user_id)
+    user_prefs = await settings_store.get(user_id)
     
     setting = event.data.decode().split(":", 1)[1]
     current_value = user_prefs[setting]
@@ -134,16 +413,17 @@ async def on_setting_button(event):
     )
 
 # /settings adjustment handler
-@client.on(events.CallbackQuery(pattern=r"adjust:(.+):(.+)"))
+@on(events.CallbackQuery(pattern=r"adjust:(.+):(.+)"))
 async def on_adjust(event):
     user_id = get_user_id(event)
-    user_prefs = get_user_settings(user_id)
+    user_prefs = await settings_store.get(user_id)
     
     data = event.data.decode().split(":", 2)
     setting, new_value = data[1], float(data[2])
     
     # Update setting
     user_prefs[setting] = new_value
+    await settings_store.save(user_id, user_prefs)
     display_name = format_display_name(setting)
     
     # Recreate buttons
@@ -156,16 +436,17 @@ async def on_adjust(event):
     )
 
 # /settings toggle handler
-@client.on(events.CallbackQuery(pattern=r"toggle:(.+):(.+)"))
+@on(events.CallbackQuery(pattern=r"toggle:(.+):(.+)"))
 async def on_toggle(event):
     user_id = get_user_id(event)
-    user_prefs = get_user_settings(user_id)
+    user_prefs = await settings_store.get(user_id)
     
     data = event.data.decode().split(":", 2)
     setting, new_state = data[1], data[2]
     
     # Update setting
     user_prefs[setting] = new_state
+    await settings_store.save(user_id, user_prefs)
     display_name = format_display_name(setting)
     
     # Create toggle button
@@ -181,120 +462,273 @@ async def on_toggle(event):
     )
 
 # /settings back button handler
-@client.on(events.CallbackQuery(pattern=r"back_to_settings"))
+@on(events.CallbackQuery(pattern=r"back_to_settings"))
 async def on_back_to_settings(event):
     buttons = create_settings_grid()
     await event.edit("Select a setting to adjust:", buttons=buttons)
 
-@client.on(events.NewMessage(func=lambda e: e.document))
+@on(events.NewMessage(func=lambda e: e.document))
 async def handle_document(event):
     user_id = get_user_id(event)
-    user_prefs = get_user_settings(user_id)
+    user_prefs = await settings_store.get(user_id)
     
     document = event.document
     mime_type = document.mime_type
     file_name = getattr(document.attributes[0], 'file_name', "unnamed_file") if document.attributes else "unnamed_file"
 
-    send_logs(f"Received document from user {user_id}. MIME type: {mime_type}, File name: {file_name}", 'info')
+    send_logs("Received document from user %s. MIME type: %s, File name: %s", 'info', user_id, mime_type, file_name)
     
     if mime_type != "application/pdf":
-        send_logs(f"Received non-PDF document: {mime_type} from user {user_id}", 'info')
+        send_logs("Received non-PDF document: %s from user %s", 'info', mime_type, user_id)
         await client.send_message(user_id, "I can only process PDF files. Please send a PDF document.")
         return
     
     # Process PDF
     processing_msg = await client.send_message(user_id, "Processing your PDF... Please wait.", parse_mode="Markdown")
+    caption = event.message.message if event.message.message else ""
     
+    if dispatcher is not None and dispatcher.has_workers():
+        path = None
+        # Text already extracted from this document (shared cache): the worker needs no file
+        if await cache.get(f"pdf:doc:{document.id}") is None:
+            try:
+                # Workers share this machine's disk, they pick the file up from its path
+                spool = await download_document(client, document, max_memory=0)
+            except Exception as e:
+                send_logs("Error downloading PDF for user %s: %s", 'error', user_id, e)
+                await edit_coalescer.edit_now(processing_msg, f"Error processing PDF: {str(e)}")
+                return
+            path = spool.detach()
+        await dispatcher.submit(user_id, processing_msg, {
+            "kind": "document", "document_id": document.id, "file_name": file_name,
+            "caption": caption, "path": path, "settings": user_prefs.to_bytes().hex()
+        })
+        return
+    
+    await analyze_pdf(user_id, user_prefs, document.id, file_name, caption, processing_msg,
+                      lambda: download_document(client, document, max_memory=PDF_MAX_MEMORY))
+
+async def analyze_pdf(user_id, user_prefs, document_id, file_name, caption, processing_msg, open_spool):
+    """PDF work once the upload is accepted: cached extraction, generation and the reply.
+
+    ``open_spool`` returns the document as a SpooledDownload and is only
+    called when the text is not cached yet.
+    """
+    spool = None
     try:
-        send_logs(f"Downloading PDF file: {file_name}", 'info')
-        file_data = await client.download_media(document, bytes)
-        send_logs(f"Downloaded PDF file: {len(file_data)} bytes", 'info')
+        # Forwarded copies of the same file keep their Telegram document id
+        doc_key = f"pdf:doc:{document_id}"
+        text = await cache.get(doc_key)
         
-        text = extract_text_from_pdf(file_data)
+        if text is None:
+            send_logs("Downloading PDF file: %s", 'info', file_name)
+            spool = await open_spool()
+            send_logs("Downloaded PDF file: %s bytes (%s)", 'info', spool.size, 'temp file' if spool.on_disk else 'memory')
+            
+            # Re-uploads of the same file get a new id but the same content hash
+            hash_key = f"pdf:sha256:{spool.sha256()}"
+            text = await cache.get(hash_key)
+            
+            if text is None:
+                # Pages are extracted lazily and only until the prompt budget is spent
+                text, truncated = await read_text(pdf_extractor.iter_pages(spool.source()), PDF_TOKEN_BUDGET)
+                if truncated:
+                    send_logs("PDF text truncated to ~%s tokens for user %s", 'info', PDF_TOKEN_BUDGET, user_id)
+                if text.strip():
+                    await cache.set(hash_key, text)
+            if text.strip():
+                await cache.set(doc_key, text)
+        else:
+            send_logs("PDF text cache hit for %s", 'info', file_name)
         
-        if not text:
-            send_logs(f"Failed to extract text from PDF for user {user_id}", 'warning')
-            await processing_msg.edit("Could not extract text from the PDF. The file might be scanned images or protected.")
+        if not text.strip():
+            send_logs("Failed to extract text from PDF for user %s", 'warning', user_id)
+            await edit_coalescer.edit_now(processing_msg, "Could not extract text from the PDF. The file might be scanned images or protected.")
             return
         
+        if document_index is not None:
+            try:
+                await document_index.add(user_id, file_name, content_hash(text), text)
+            except Exception as e:
+                send_logs("Could not index PDF for user %s: %s", 'warning', user_id, e)
+        
         # Prepare content with optional caption
-        caption = event.message.message if event.message.message else ""
         content = f"Caption: {caption}\n\nPDF Content:\n{text}" if caption else text
         
-        send_logs(f"Extracted {len(text)} characters from PDF", 'info')
-        await processing_msg.edit("PDF processed. Analyzing content... Please wait.")
+        send_logs("Extracted %s characters from PDF", 'info', len(text))
         
-        # Call DeepSeek with the PDF text
-        send_logs(f"Sending PDF content to DeepSeek for analysis", 'info')
-        response = await query_deepseek(content, user_prefs, processing_msg, client, user_id)
+        response_key = response_cache_key(content, user_prefs)
+        cached = await cached_answer(response_key)
+        reply = LiveReply(user_id, processing_msg)
+        signature = None
+        scope = system_prompt_template.prompt_hash(user_prefs)
+        if cached is None and near_duplicates is not None:
+            # Long texts: keep the shingle hashing off the event loop
+            signature = await asyncio.to_thread(near_duplicates.signature, content)
+            cached = await near_duplicate_answer(signature, scope, user_id)
+            if cached is not None:
+                await cache_answer(response_key, *cached)
+        if cached is None:
+            await edit_coalescer.edit_now(processing_msg, "PDF processed. Analyzing content... Please wait.")
+            
+            # Call DeepSeek with the PDF text
+            send_logs("Sending PDF content to DeepSeek for analysis", 'info')
+            response = await generate(
+                user_id, reply,
+                lambda: analyze_document(text, caption, user_prefs, reply, user_id)
+            )
+            if response is None:
+                return
+            deadlines = reply.deadlines
+            if cacheable(response, reply):
+                await cache_answer(response_key, response, deadlines)
+                if signature is not None:
+                    near_duplicates.add(signature, scope, response_key)
+        else:
+            response, deadlines = cached
+            send_logs("Response cache hit for PDF from user %s", 'info', user_id)
+        response += await save_deadlines(user_id, deadlines, user_prefs)
         
-        # Send final response in chunks
-        await send_chunked_message(client, user_id, response, processing_msg)
-        send_logs(f"Sent PDF analysis response to user {user_id}", 'info')
+        # Whatever was not posted while streaming
+        await reply.finish(response)
+        send_logs("Sent PDF analysis response to user %s", 'info', user_id)
+        if conversation_memory is not None and not response.startswith(DEEPSEEK_ERROR_PREFIX):
+            await conversation_memory.record(user_id, f"[Sent the PDF {file_name}] {caption}".rstrip(), response)
         
     except Exception as e:
         error_trace = traceback.format_exc()
-        send_logs(f"Error processing PDF for user {user_id}: {str(e)}\n{error_trace}", 'error')
-        await processing_msg.edit(f"Error processing PDF: {str(e)}")
-
-# Function to extract text from PDF
-def extract_text_from_pdf(pdf_data):
-    """Extract text from PDF data with optimized error handling"""
-    try:
-        send_logs(f"Starting PDF text extraction. Data size: {len(pdf_data)} bytes", 'info')
-        
-        pdf_file = io.BytesIO(pdf_data)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        num_pages = len(pdf_reader.pages)
-        
-        send_logs(f"PDF info: {num_pages} pages", 'info')
-        
-        # Use list comprehension for better performance
-        text_parts = []
-        for page_num, page in enumerate(pdf_reader.pages):
-            try:
-                send_logs(f"Processing page {page_num+1}/{num_pages}", 'info')
-                page_text = page.extract_text()
-                if page_text.strip():  # Only add non-empty pages
-                    text_parts.append(page_text)
-                send_logs(f"Extracted {len(page_text)} characters from page {page_num+1}", 'info')
-            except Exception as e:
-                send_logs(f"Error extracting text from page {page_num+1}: {str(e)}", 'error')
-                continue
-        
-        text = "\n\n".join(text_parts)
-        
-        if not text.strip():
-            send_logs("Extracted text is empty, PDF might be image-based or protected", 'warning')
-            return ""
-            
-        send_logs(f"Completed PDF extraction. Total text length: {len(text)}", 'info')
-        return text
-        
-    except Exception as e:
-        send_logs(f"Error extracting text from PDF: {str(e)}", 'error')
-        return ""
+        send_logs("Error processing PDF for user %s: %s\n%s", 'error', user_id, e, error_trace)
+        await edit_coalescer.edit_now(processing_msg, f"Error processing PDF: {str(e)}")
+    finally:
+        if spool is not None:
+            spool.close()
 
 # Handle other messages
-@client.on(events.NewMessage(func=lambda e: e.text and not e.text.startswith('/')))
+@on(events.NewMessage(func=lambda e: e.text and not e.text.startswith('/')))
 async def process_content(event):
     user_id = get_user_id(event)
-    user_prefs = get_user_settings(user_id)
+    user_prefs = await settings_store.get(user_id)
     
     # Send initial "Analyzing..." message that we'll update
     current_time = datetime.datetime.now(moldova_tz).strftime("%Y-%m-%d %H:%M:%S")
     send_logs(current_time, 'info')
     
     processing_msg = await client.send_message(user_id, "Analyzing your content... Please wait.", parse_mode="Markdown")
-    content = f"Current time: {current_time}\n\n{event.text}"
     
-    # Call DeepSeek with live updates to the message
-    response = await query_deepseek(content, user_prefs, processing_msg, client, user_id)
+    if dispatcher is not None and dispatcher.has_workers():
+        await dispatcher.submit(user_id, processing_msg, {
+            "kind": "text", "text": event.text, "current_time": current_time,
+            "settings": user_prefs.to_bytes().hex()
+        })
+        return
+    
+    await analyze_text(user_id, event.text, current_time, user_prefs, processing_msg)
+
+async def analyze_text(user_id, text, current_time, user_prefs, processing_msg):
+    """LLM work for a text message: cache lookup, generation and the reply"""
+    # Questions about an earlier PDF get its best passages, not the whole text
+    passages = ""
+    if document_index is not None and refers_to_document(text):
+        found = await document_index.search(user_id, text, DOCUMENT_CONTEXT_TOKENS)
+        if found:
+            send_logs("Retrieved %s document passages for user %s", 'info', len(found), user_id)
+            passages = "\n\n".join(f"[{name}, part {position + 1}]\n{passage}" for name, position, passage in found)
+            passages = f"Passages from the user's documents:\n\n{passages}\n\n"
+    content = f"Current time: {current_time}\n\n{passages}{text}"
+    # Only follow-ups get the chat so far: standalone questions keep a key every user shares
+    history = []
+    if conversation_memory is not None and refers_to_conversation(text):
+        history = await conversation_memory.context(user_id)
+    history_key = content_hash(history) if history else ""
+    
+    # The answer may depend on today's date (deadlines), but not on the clock time
+    response_key = response_cache_key(f"{current_time[:10]}\n{history_key}{passages}{text}", user_prefs)
+    cached = await cached_answer(response_key)
+    reply = LiveReply(user_id, processing_msg)
+    signature = None
+    scope = (system_prompt_template.prompt_hash(user_prefs), current_time[:10], history_key)
+    if cached is None and near_duplicates is not None:
+        # Same assignment pasted with other whitespace, greetings or punctuation
+        signature = near_duplicates.signature(f"{passages}{text}")
+        cached = await near_duplicate_answer(signature, scope, user_id)
+        if cached is not None:
+            await cache_answer(response_key, *cached)
+    if cached is None:
+        # Call DeepSeek with live updates to the message
+        response = await generate(
+            user_id, reply,
+            lambda: query_deepseek(content, user_prefs, reply, user_id, history)
+        )
+        if response is None:
+            return
+        deadlines = reply.deadlines
+        if cacheable(response, reply):
+            await cache_answer(response_key, response, deadlines)
+            if signature is not None:
+                near_duplicates.add(signature, scope, response_key)
+    else:
+        response, deadlines = cached
+        send_logs("Response cache hit for user %s", 'info', user_id)
+    response += await save_deadlines(user_id, deadlines, user_prefs)
+    
+    # Whatever was not posted while streaming
+    await reply.finish(response)
+    if conversation_memory is not None and not response.startswith(DEEPSEEK_ERROR_PREFIX):
+        await conversation_memory.record(user_id, text, response)
+
+async def run_job(job):
+    """Worker side of receiver mode: run a text, PDF or /newchat job handed over by the receiver"""
+    user_id = job["user_id"]
+    if job["kind"] == "newchat":
+        if conversation_memory is not None:
+            await conversation_memory.clear(user_id)
+        return
+    # Settings travel with the job, so a worker never reads a stale copy
+    user_prefs = UserSettings.from_bytes(bytes.fromhex(job["settings"]))
+    processing_msg = RemoteMessage(job["chat_id"], job["message_id"])
+    if job["kind"] == "text":
+        await analyze_text(user_id, job["text"], job["current_time"], user_prefs, processing_msg)
+        return
+    
+    spool = SpooledDownload.from_file(job["path"]) if job["path"] else None
+    async def open_spool():
+        if spool is None:
+            # Evicted from the cache after the receiver checked it
+            raise RuntimeError("the PDF is no longer cached, please send it again")
+        return spool
+    try:
+        await analyze_pdf(user_id, user_prefs, job["document_id"], job["file_name"], job["caption"],
+                          processing_msg, open_spool)
+    finally:
+        if spool is not None:
+            spool.close()
+
+# /deadlines
+@on(events.NewMessage(pattern='(?i)/deadlines'))
+async def deadlines_command(event):
+    user_id = get_user_id(event)
+    today = datetime.datetime.now(moldova_tz).date()
+    upcoming = await deadline_store.upcoming(user_id, today)
+    
+    if not upcoming:
+        await client.send_message(user_id, "No upcoming deadlines. Send me an assignment or exam and I'll track it.")
+        return
     
-    # Send final response in chunks
-    await send_chunked_message(client, user_id, response, processing_msg)
+    lines = [f"• **{d['deadline']}** - {d['object_name']}" for d in upcoming]
+    await client.send_message(user_id, "**📅 Upcoming deadlines**\n\n" + "\n".join(lines), parse_mode="Markdown")
+
+# /newchat
+@on(events.NewMessage(pattern='(?i)/newchat'))
+async def newchat_command(event):
+    user_id = get_user_id(event)
+    if conversation_memory is not None:
+        await conversation_memory.clear(user_id)
+    message = await client.send_message(user_id, "🧹 Conversation cleared. The next message starts fresh.")
+    if conversation_memory is not None and dispatcher is not None and dispatcher.has_workers():
+        # The worker serving this user has the conversation cached, it must forget it too
+        await dispatcher.submit(user_id, message, {"kind": "newchat"})
 
-@client.on(events.NewMessage(pattern='(?i)/help'))
+@on(events.NewMessage(pattern='(?i)/help'))
 async def help_command(event):
     user_id = get_user_id(event)
     
@@ -303,6 +737,8 @@ async def help_command(event):
 **Commands:**
 • /start - Start the bot and get a welcome message
 • /settings - View current personality settings
+• /deadlines - List your upcoming deadlines
+• /newchat - Forget our conversation so far
 • /help - Show this help message
 
 **How to Use:**
@@ -328,160 +764,169 @@ The further a setting is from 0.5, the more dramatic the effect!"""
     await client.send_message(user_id, help_text, parse_mode="Markdown")
 
 # Function to call DeepSeek R1 API via OpenRouter
-async def query_deepseek(prompt, settings, message_to_update=None, client=None, user_id=None):
-    system_prompt = """
-You are Learnkey, an advanced AI designed to explain the **importance** (the 'why') of any given task, file, text, or theme. Your core function is to clearly articulate the necessity of engaging with the provided content.
-
-Your responses are precisely tailored by the following user-defined settings. Extreme values (0 or 1) are most effective; gradual changes (e.g., 0.2, 0.4) are harder to distinguish.
-
-PERSONALITY PROFILE (0=LOW, 0.5=MID, 1=HIGH):
-- **Calmness**: {calmness} (0=Agitated/Urgent, 0.5=Neutral, 1=Serene/Philosophical. At 1, your tone is profoundly wise and tranquil.)
-- **Rage**: {rage} (0=Gentle/Calm, 0.5=Neutral, 1=Furious/Aggressive. At 1, use intense, forceful language.)
-- **Funny**: {funny} (0=Strictly Serious, 0.5=Neutral, 1=Humorous/Joking. At 1, inject clear jokes, puns, or playful sarcasm.)
-- **Ironic**: {ironic} (0=Completely Literal, 0.5=Neutral, 1=Heavily Ironic/Sarcastic. At 1, your statements may imply the opposite of their literal meaning.)
-- **Brevity**: {brevity} (0=Verbose/Detailed, 0.5=Neutral, 1=Extremely Concise. At 1, be EXTREMELY short and direct.)
-- **Curse-Words**: {curse_words} (0=No Curses, 0.5=Rare Mild, 1=Frequent Strong Language. At 1, use explicit strong language naturally.)
-- **Age**: {age} (0=Childlike/Naive, 0.5=Neutral, 1=Elderly/Wise. At 1, speak with the wisdom and perspective of old age.)
-- **Rudeness**: {rudeness} (0=Polite/Respectful, 0.5=Neutral, 1=Dismissive/Contemptuous. At 1, be dismissive, scornful, or outright insulting.)
-- **Slay**: {slay} (0=No Slay, 0.5=Neutral, 1=Full Slay. At 1, you will absolutely SLAY with confidence, flair, and fierce attitude. Use empowering language like "queen," "iconic," "serving," etc.)
-
-TOGGLES:
-- **Caps-Lock**: {caps_lock} (IF ON, YOUR ENTIRE RESPONSE WILL BE IN ALL CAPS.)
-- **Emoji**: {emoji} (IF ON, YOU WILL USE RELEVANT EMOJIS IN YOUR RESPONSE. 😎)
-
-GUIDELINES:
-1.  Always explain **WHY** the topic is important, not just what it is.
-2.  Embody **all** active personality traits simultaneously in your tone and word choice.
-3.  Extreme values (0 or 1) will dramatically alter your response style as defined above.
-4.  Keep responses focused solely on explaining importance.
-5.  Strive for clear, direct answers.
-
----
-
-### **CRITICAL: JSON OUTPUT INSTRUCTIONS**
-
-**After your main textual response, you MUST produce a structured JSON object if the conversation involves ANY of these keywords:**
-**deadline, exam, test, course, lesson, homework, assignment, due date, study, prepare.**
-
-**FORMAT IT EXACTLY AS FOLLOWS, WITH THE TRIPLE BACKTICKS AND "json" LABEL:**
-
-###JSON###
-
-{{
-  "object_name": [name of the object],
-  "deadline": [date of the deadline in YYYY-MM-DD format],
-  "context": [full description of the object, including any relevant details],
-}}
-
-""".format(**settings)
-    
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "model": model_deepseek,
-        "messages": [
-            {
-                "role": "system",
-                "content": system_prompt
-            },
-            {
-                "role": "user", 
-                "content": prompt
-            }
-        ],
-        "stream": True  # Enable streaming for live updates
-    }
+async def query_deepseek(prompt, settings, reply=None, user_id=None, history=()):
+    """Stream an answer into ``reply`` (a LiveReply) and return its full text.
+
+    Deadlines from the ###JSON### block are left in ``reply.deadlines``.
+    """
+    if reply is None:
+        reply = LiveReply(user_id, None)
+    system_prompt, _ = system_prompt_template.render(settings)
+    
+    messages = [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        *history,
+        {
+            "role": "user", 
+            "content": prompt
+        }
+    ]
     
+    caps = settings["caps_lock"] == "ON"
+    preset = system_prompt_template.preset_name(settings)
+    route = {}
+    options = generation_options(settings, answer_max_tokens, reasoning_effort)
+    started = time.monotonic()
+    first_token_at = None
+    first_visible_at = None
+    tokens = 0
+    GENERATIONS_IN_FLIGHT.inc()
     try:
-        # Send streaming request to DeepSeek API
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, stream=True)
-        response.raise_for_status()
+        # Stream the response without blocking the event loop
+        last_submit_time = 0
         
-        if payload.get("stream", False):
-            # Handle streaming response
-            response_text = ""
-            last_update_time = 0
+        deadline_parser = DeadlineStreamParser()
+        
+        async for content in llm.stream_chat(messages, route=route, reasoning_deltas=True, **options):
+            tokens += 1
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            if isinstance(content, Reasoning):
+                # Still thinking: only the preview shows it, the answer never does
+                current_time = asyncio.get_event_loop().time()
+                if current_time - last_submit_time > PREVIEW_SUBMIT_INTERVAL:
+                    reply.thinking(time.monotonic() - started)
+                    last_submit_time = current_time
+                continue
+            # The ###JSON### deadline block is parsed, never shown to the user
+            content = deadline_parser.feed(content)
+            if not content:
+                continue
+            if first_visible_at is None:
+                first_visible_at = time.monotonic()
+            # Apply caps lock as we go, finished chunks are posted before the end
+            await reply.feed(content.upper() if caps else content)
             
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        data = line[6:]  # Remove 'data: ' prefix
-                        if data == '[DONE]':
-                            break
-                        try:
-                            json_data = json.loads(data)
-                            delta = json_data.get('choices', [{}])[0].get('delta', {})
-                            content = delta.get('content', '')
-                            if content:
-                                response_text += content
-                                
-                                # Update message periodically
-                                current_time = asyncio.get_event_loop().time()
-                                if (current_time - last_update_time > UPDATE_INTERVAL and 
-                                    message_to_update and client):
-                                    try:
-                                        preview_length = 1000
-                                        preview_text = (response_text[:preview_length] + "..." 
-                                                      if len(response_text) > preview_length 
-                                                      else response_text)
-                                        await client.edit_message(
-                                            message_to_update, 
-                                            f"🤖 Generating response...\n\n{preview_text}"
-                                        )
-                                        last_update_time = current_time
-                                    except Exception as e:
-                                        send_logs(f"Live update error: {str(e)}", 'warning')
-                        except json.JSONDecodeError:
-                            continue
-        else:
-            # Handle non-streaming response (fallback)
-            result = response.json()
-            response_text = result.get("choices", [{}])[0].get("message", {}).get("content", "Sorry, I couldn't generate a response.")
+            # Hand the latest preview to the edit coalescer, it decides when to send
+            current_time = asyncio.get_event_loop().time()
+            if current_time - last_submit_time > PREVIEW_SUBMIT_INTERVAL:
+                await reply.preview()
+                last_submit_time = current_time
+        
+        reply.model = route.get("model")
+        held = deadline_parser.flush()
+        response_text = (reply.text() + (held.upper() if caps else held)).rstrip()
         
-        # Apply caps lock if enabled
-        if settings["caps_lock"] == "ON":
-            response_text = response_text.upper()
+        finished = time.monotonic()
+        labels = (route.get("model", "none"), preset)
+        GENERATION_SECONDS.labels(*labels).observe(finished - started)
+        if first_token_at is not None:
+            GENERATION_TTFT.labels(*labels).observe(first_token_at - started)
+            if finished > first_token_at:
+                GENERATION_TOKEN_RATE.labels(*labels).observe(tokens / (finished - first_token_at))
+        effort = options["reasoning"].get("effort", "off")
+        if first_visible_at is not None:
+            GENERATION_TTFVT.labels(*labels).observe(first_visible_at - started)
+            GENERATION_REASONING_SECONDS.labels(*labels, effort).observe(first_visible_at - (first_token_at or started))
+        elif tokens and not held.strip() and not deadline_parser.in_block:
+            # Only reasoning came back: max_tokens ran out before the answer started
+            GENERATION_ERRORS.labels("budget").inc()
+            send_logs("%s: no answer within %s tokens (%s effort)", 'warning', DEEPSEEK_ERROR_PREFIX, options['max_tokens'], effort)
+            return f"{DEEPSEEK_ERROR_PREFIX}: the AI spent its whole length budget thinking. Please try again."
         
+        # Saved by the caller, so a cached copy of the answer can save them for its user too
+        reply.deadlines = deadline_parser.deadlines()
         return response_text
             
+    except StreamStalled as e:
+        GENERATION_ERRORS.labels("stalled").inc()
+        send_logs("%s: %s", 'error', DEEPSEEK_ERROR_PREFIX, e)
+        return partial_answer(reply, "The AI stopped responding") or \
+            f"{DEEPSEEK_ERROR_PREFIX}: the AI stopped responding. Please try again."
+    except CircuitOpenError as e:
+        # Also raised when resuming after a stall, once the stall itself opened the breaker
+        GENERATION_ERRORS.labels("circuit_open").inc()
+        send_logs("%s: %s", 'warning', DEEPSEEK_ERROR_PREFIX, e)
+        return partial_answer(reply, "The AI service became unavailable") or \
+            f"{DEEPSEEK_ERROR_PREFIX}: the AI service is temporarily unavailable. Please try again in a minute."
     except Exception as e:
-        send_logs(f"Error calling DeepSeek: {str(e)}", 'error')
-        return f"Error calling DeepSeek: {str(e)}"
+        GENERATION_ERRORS.labels(type(e).__name__).inc()
+        send_logs("%s: %s", 'error', DEEPSEEK_ERROR_PREFIX, e)
+        return partial_answer(reply, "The AI request failed") or f"{DEEPSEEK_ERROR_PREFIX}: {str(e)}"
+    finally:
+        GENERATIONS_IN_FLIGHT.dec()
     
-def init_deepseek():
-    send_logs("Initializing DeepSeek API connection...", 'info')
+def partial_answer(reply, reason):
+    """What already streamed into ``reply`` with a cut-off notice, None if nothing did"""
+    response_text = reply.text()
+    if not response_text.strip():
+        return None
+    # Keep what arrived, but make it clear the answer is incomplete (and never cache it)
+    reply.cut_off = True
+    return f"{response_text.rstrip()}\n\n⚠️ {reason}, this answer is cut off."
+
+async def generate(user_id, reply, factory):
+    """Queue a generation behind the scheduler, None if a newer message superseded it"""
     try:
-        # Test the API connection with a simple request
-        headers = {
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        test_payload = {
-            "model": model_deepseek,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": "Test connection"
-                }
-            ],
-            "max_tokens": 10
+        return await generation_scheduler.run(user_id, factory)
+    except Superseded:
+        # Chunks already posted are part of the answer the user has, leave them alone
+        if reply.buffer.consumed == 0:
+            text = "⏭️ Skipped, a newer message replaced this one."
+        else:
+            text = "⏭️ Stopped here, a newer message replaced this one."
+        try:
+            if reply.message is not None:
+                await edit_coalescer.edit_now(reply.message, text)
+        except Exception as e:
+            send_logs("Could not mark superseded message: %s", 'warning', e)
+        return None
+
+async def analyze_document(text, caption, user_prefs, reply, user_id):
+    """Condense long PDF text chunk by chunk, then run the personality pass on the result"""
+    def on_progress(done, total):
+        edit_coalescer.submit(reply.message, f"📚 Reading your PDF... {done}/{total} parts analyzed")
+    
+    text = await document_summarizer.condense(text, on_progress)
+    content = f"Caption: {caption}\n\nPDF Content:\n{text}" if caption else text
+    return await query_deepseek(content, user_prefs, reply, user_id)
+
+async def probe_backend(backend):
+    # Test the API connection with a simple request
+    test_messages = [
+        {
+            "role": "user",
+            "content": "Test connection"
         }
-        
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=test_payload, timeout=10)
+    ]
+    try:
+        response = await backend.complete(test_messages, timeout=10, max_tokens=10)
         if response.status_code == 200:
-            send_logs(f"DeepSeek API connection successful. Model: {model_deepseek}", 'info')
+            send_logs("%s API connection successful. Model: %s", 'info', backend.name, backend.model)
         else:
-            send_logs(f"DeepSeek API connection test failed: {response.status_code} - {response.text}", 'warning')
+            send_logs("%s API connection test failed: %s - %s", 'warning', backend.name, response.status_code, response.text)
     except Exception as e:
-        send_logs(f"Error testing DeepSeek API connection: {str(e)}", 'error')
+        send_logs("Error testing %s API connection: %s", 'error', backend.name, e)
+
+async def init_deepseek():
+    send_logs("Initializing LLM backend connections...", 'info')
+    await asyncio.gather(*(probe_backend(state.client) for state in llm.states))
 
 # /presets command
-@client.on(events.NewMessage(pattern='(?i)/presets'))
+@on(events.NewMessage(pattern='(?i)/presets'))
 async def presets_command(event):
     user_id = get_user_id(event)
     
@@ -513,10 +958,10 @@ async def presets_command(event):
     )
 
 # /presets handler
-@client.on(events.CallbackQuery(pattern=r"preset:(.+)"))
+@on(events.CallbackQuery(pattern=r"preset:(.+)"))
 async def on_preset_button(event):
     user_id = get_user_id(event)
-    user_prefs = get_user_settings(user_id)
+    user_prefs = await settings_store.get(user_id)
     
     preset_id = event.data.decode().split(":", 1)[1]
     
@@ -525,6 +970,7 @@ async def on_preset_button(event):
         
         # Apply the preset settings
         user_prefs.update(preset["settings"])
+        await settings_store.save(user_id, user_prefs)
         
         await event.edit(
             f"**{preset['name']} Applied!**\n\n{preset['description']}\n\nYour personality settings have been updated. Try sending me some content to see the new style!",
@@ -534,7 +980,7 @@ async def on_preset_button(event):
         await event.edit("Invalid preset selected.")
 
 # Back to presets button handler
-@client.on(events.CallbackQuery(pattern=r"back_to_presets"))
+@on(events.CallbackQuery(pattern=r"back_to_presets"))
 async def on_back_to_presets(event):
     # Create buttons for each preset (excluding default)
     buttons = []
@@ -558,30 +1004,135 @@ async def on_back_to_presets(event):
         buttons=buttons
     )
 
-async def send_chunked_message(client, user_id, response, processing_msg=None):
-    """Send a message in chunks if it's too long"""
-    if len(response) <= MAX_MESSAGE_LENGTH:
+async def send_timed(client, user_id, text):
+    """send_message with its latency recorded"""
+    started = time.monotonic()
+    try:
+        return await client.send_message(user_id, text, parse_mode="Markdown")
+    finally:
+        TELEGRAM_SECONDS.labels("send_message").observe(time.monotonic() - started)
+
+async def send_chunks(client, user_id, chunks, processing_msg=None):
+    """Post chunks in order, the first one into ``processing_msg`` if there is one"""
+    for chunk in chunks:
         if processing_msg:
-            await processing_msg.edit(response)
+            await edit_coalescer.edit_now(processing_msg, chunk)
+            processing_msg = None
         else:
-            await client.send_message(user_id, response, parse_mode="Markdown")
-    else:
-        # Edit the first message with the first chunk
-        first_chunk = response[:MAX_MESSAGE_LENGTH]
-        if processing_msg:
-            await processing_msg.edit(first_chunk)
+            await send_timed(client, user_id, chunk)
+
+class LiveReply:
+    """An answer being streamed to a user, posted chunk by chunk as each one fills.
+
+    Text goes through a ChunkedStreamBuffer: every finished chunk becomes the
+    final text of the message being edited, and the rest of the answer
+    continues in a new message, so long answers arrive progressively
+    instead of all at once at the end.
+    """
+
+    def __init__(self, user_id, message):
+        self.user_id = user_id
+        self.message = message  # None between a posted chunk and the next preview
+        self.buffer = ChunkedStreamBuffer(MAX_MESSAGE_LENGTH)
+        self._parts = []
+        self.live = message is not None
+        self.deadlines = []  # from the ###JSON### block, once the answer is complete
+        self.cut_off = False  # the stream failed after part of the answer arrived
+        self.model = None  # the model that answered, once the stream started
+
+    def text(self):
+        return "".join(self._parts)
+
+    async def feed(self, content):
+        self._parts.append(content)
+        if not self.live:
+            return
+        finished = self.buffer.feed(content)
+        if finished:
+            await send_chunks(client, self.user_id, finished, self.message)
+            self.message = None
+
+    def thinking(self, seconds):
+        """Progress preview while the model reasons, before any answer text"""
+        if not self.live or self.message is None or self.buffer.chunks or self.buffer.tail():
+            return
+        edit_coalescer.submit(self.message, f"🧠 Thinking... {seconds:.0f}s")
+
+    async def preview(self):
+        if not self.live:
+            return
+        tail = self.buffer.tail()
+        if not tail.strip():
+            return
+        text = f"🤖 Generating response...\n\n{tail}"
+        if self.message is None:
+            self.message = await send_timed(client, self.user_id, text)
         else:
-            await client.send_message(user_id, first_chunk, parse_mode="Markdown")
-        
-        # Send additional chunks as new messages
-        for i in range(MAX_MESSAGE_LENGTH, len(response), MAX_MESSAGE_LENGTH):
-            chunk = response[i:i + MAX_MESSAGE_LENGTH]
-            await client.send_message(user_id, chunk, parse_mode="Markdown")
+            edit_coalescer.submit(self.message, text)
+
+    async def finish(self, response):
+        """Post what is left of ``response``, the complete answer"""
+        consumed = self.buffer.consumed
+        if consumed and response.startswith(self.text()[:consumed].rstrip()):
+            self.buffer.replace_tail(response[consumed:])
+            chunks = self.buffer.flush()
+        else:
+            # Nothing posted yet, or the answer was replaced (an error): post all of it
+            chunks = split_message(response, MAX_MESSAGE_LENGTH)
+        await send_chunks(client, self.user_id, chunks, self.message)
 
 # MAIN
 if __name__ == '__main__':
+    started = time.monotonic()
+    create_app()
     send_logs("############################################", 'info')
     send_logs("Bot Started with DeepSeek R1 API!", 'info')
-    init_deepseek()
     loop = client.loop
-    client.run_until_disconnected()
\ No newline at end of file
+    # The provider probe only logs, it runs alongside the login instead of before it
+    probe_task = loop.create_task(init_deepseek())
+    client.start(bot_token=BOT_TOKEN)
+    queue_server = None
+    if dispatcher is not None:
+        # Serve the queue in-process unless a real Redis is configured
+        if config.getboolean('default', 'queue_serve', fallback=True):
+            queue_server = loop.run_until_complete(RespServer(dispatcher.host, dispatcher.port).start())
+        loop.run_until_complete(dispatcher.start())
+    send_logs("Bot ready in %.2fs", 'info', time.monotonic() - started)
+    reminder_scheduler.start()
+    if metrics_server is not None:
+        loop.run_until_complete(metrics_server.start())
+    loop_lag_monitor.start()
+    try:
+        client.run_until_disconnected()
+    finally:
+        probe_task.cancel()
+        if dispatcher is not None:
+            send_logs("Dispatcher stats: %s", 'info', dispatcher.stats())
+            loop.run_until_complete(dispatcher.close())
+        if queue_server is not None:
+            loop.run_until_complete(queue_server.stop())
+        send_logs("LLM routing stats: %s", 'info', llm.stats())
+        send_logs("OpenRouter resilience stats: %s", 'info', openrouter.stats())
+        loop.run_until_complete(llm.close())
+        send_logs("Edit stats: %s", 'info', edit_coalescer.stats())
+        loop.run_until_complete(edit_coalescer.close())
+        pdf_extractor.shutdown()
+        send_logs("Cache stats: %s", 'info', cache.stats())
+        send_logs("Scheduler stats: %s", 'info', generation_scheduler.stats())
+        send_logs("LLM stream limiter stats: %s", 'info', llm_streams.stats())
+        cache.close()
+        deadline_store.close()
+        if near_duplicates is not None:
+            send_logs("Near-duplicate stats: %s", 'info', near_duplicates.stats())
+        if document_index is not None:
+            send_logs("Document index stats: %s", 'info', document_index.stats())
+            document_index.close()
+        send_logs("Reminder stats: %s", 'info', reminder_scheduler.stats())
+        loop.run_until_complete(reminder_scheduler.close())
+        loop.run_until_complete(settings_store.close())
+        if conversation_memory is not None:
+            send_logs("Conversation stats: %s", 'info', conversation_memory.stats())
+            loop.run_until_complete(conversation_memory.close())
+        loop.run_until_complete(loop_lag_monitor.close())
+        if metrics_server is not None:
+            loop.run_until_complete(metrics_server.close())
\ No newline at end of file
@@ -0,0 +1,281 @@
+import asyncio
+import os
+import sqlite3
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from functions import send_logs, default_settings
+from resp import RespClient
+
+SETTING_NAMES = tuple(default_settings)
+NUMERIC_SETTINGS = tuple(name for name in SETTING_NAMES if not isinstance(default_settings[name], str))
+FLAG_SETTINGS = tuple(name for name in SETTING_NAMES if isinstance(default_settings[name], str))
+
+_NUMERIC_INDEX = {name: i for i, name in enumerate(NUMERIC_SETTINGS)}
+_FLAG_BIT = {name: 1 << i for i, name in enumerate(FLAG_SETTINGS)}
+_PACKED = struct.Struct(f"<{len(NUMERIC_SETTINGS)}dB")
+
+
+class UserSettings(MutableMapping):
+    """Fixed-schema personality settings: an array of floats plus a bitmask of ON/OFF flags.
+
+    Behaves like the old per-user settings dict (``prefs["rage"]``,
+    ``prefs.update(...)``, ``**prefs``) at a fraction of the memory.
+    """
+
+    __slots__ = ("_values", "_flags")
+
+    def __init__(self, values=None):
+        self._values = array('d', (default_settings[name] for name in NUMERIC_SETTINGS))
+        self._flags = 0
+        for name in FLAG_SETTINGS:
+            if default_settings[name] == "ON":
+                self._flags |= _FLAG_BIT[name]
+        if values:
+            self.update(values)
+
+    def __getitem__(self, name):
+        if name in _NUMERIC_INDEX:
+            return self._values[_NUMERIC_INDEX[name]]
+        if name in _FLAG_BIT:
+            return "ON" if self._flags & _FLAG_BIT[name] else "OFF"
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        if name in _NUMERIC_INDEX:
+            self._values[_NUMERIC_INDEX[name]] = float(value)
+        elif name in _FLAG_BIT:
+            if value == "ON":
+                self._flags |= _FLAG_BIT[name]
+            else:
+                self._flags &= ~_FLAG_BIT[name]
+        else:
+            raise KeyError(name)
+
+    def __delitem__(self, name):
+        raise TypeError("Settings have a fixed schema")
+
+    def __iter__(self):
+        return iter(SETTING_NAMES)
+
+    def __len__(self):
+        return len(SETTING_NAMES)
+
+    def __repr__(self):
+        return f"UserSettings({dict(self)})"
+
+    def copy(self):
+        settings = UserSettings.__new__(UserSettings)
+        settings._values = array('d', self._values)
+        settings._flags = self._flags
+        return settings
+
+    def to_bytes(self):
+        return _PACKED.pack(*self._values, self._flags)
+
+    @classmethod
+    def from_bytes(cls, data):
+        settings = cls.__new__(cls)
+        *values, flags = _PACKED.unpack(data)
+        settings._values = array('d', values)
+        settings._flags = flags
+        return settings
+
+
+class MemoryBackend:
+    """Process-local backend, settings are lost on restart"""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._data = {}  # user_id -> (data, expires_at or None)
+
+    async def load(self, user_id):
+        data, expires_at = self._data.get(user_id, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[user_id]
+            return None
+        return data
+
+    async def save(self, user_id, data):
+        self._data[user_id] = (data, time.time() + self.ttl if self.ttl else None)
+
+    async def delete(self, user_id):
+        self._data.pop(user_id, None)
+
+    async def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """SQLite file backend in WAL mode, safe to share between bot processes.
+
+    With a ``ttl`` (seconds) rows expire that long after their last save and
+    expired rows are purged every ``PURGE_EVERY`` saves.
+    """
+
+    PURGE_EVERY = 100
+
+    def __init__(self, path, table="user_settings", ttl=None):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self._saves = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        expires = ", expires_at REAL NOT NULL" if ttl else ""
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS {table} (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL{expires})")
+        self._db.commit()
+
+    def _load(self, user_id):
+        with self._lock:
+            if self.ttl:
+                row = self._db.execute(f"SELECT data FROM {self.table} WHERE user_id = ? AND expires_at > ?",
+                                       (user_id, time.time())).fetchone()
+            else:
+                row = self._db.execute(f"SELECT data FROM {self.table} WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def _save(self, user_id, data):
+        with self._lock:
+            if self.ttl:
+                now = time.time()
+                self._db.execute(f"INSERT OR REPLACE INTO {self.table} (user_id, data, expires_at) VALUES (?, ?, ?)",
+                                 (user_id, data, now + self.ttl))
+                self._saves += 1
+                if self._saves % self.PURGE_EVERY == 0:
+                    self._db.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+            else:
+                self._db.execute(f"INSERT OR REPLACE INTO {self.table} (user_id, data) VALUES (?, ?)", (user_id, data))
+            self._db.commit()
+
+    def _delete(self, user_id):
+        with self._lock:
+            self._db.execute(f"DELETE FROM {self.table} WHERE user_id = ?", (user_id,))
+            self._db.commit()
+
+    async def load(self, user_id):
+        return await asyncio.to_thread(self._load, user_id)
+
+    async def save(self, user_id, data):
+        await asyncio.to_thread(self._save, user_id, data)
+
+    async def delete(self, user_id):
+        await asyncio.to_thread(self._delete, user_id)
+
+    async def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RedisBackend:
+    """Redis-protocol backend (works with Redis, KeyDB or resp.RespServer)"""
+
+    def __init__(self, client, prefix="settings:", ttl=None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    async def load(self, user_id):
+        return await self.client.get(f"{self.prefix}{user_id}")
+
+    async def save(self, user_id, data):
+        await self.client.set(f"{self.prefix}{user_id}", data, ex=int(self.ttl) if self.ttl else None)
+
+    async def delete(self, user_id):
+        await self.client.delete(f"{self.prefix}{user_id}")
+
+    async def close(self):
+        await self.client.close()
+
+
+class SettingsStore:
+    """Per-user settings with a write-through in-process cache in front of a backend.
+
+    Cached entries are reloaded after ``cache_ttl`` seconds, so a change saved
+    by another bot process sharing the backend is picked up; None never reloads.
+    At most ``max_cached`` users are kept, least recently used first out.
+    Callers get their own copy: adjusting a setting never changes the one a
+    running generation was started with.
+    """
+
+    def __init__(self, backend, cache_ttl=30.0, max_cached=10000):
+        self.backend = backend
+        self.cache_ttl = cache_ttl
+        self.max_cached = max_cached
+        self._cache = OrderedDict()  # user_id -> (settings, time cached)
+
+    def _remember(self, user_id, settings):
+        self._cache[user_id] = (settings, time.monotonic())
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    async def get(self, user_id):
+        cached = self._cache.get(user_id)
+        if cached is not None and (self.cache_ttl is None or time.monotonic() - cached[1] < self.cache_ttl):
+            self._cache.move_to_end(user_id)
+            return cached[0].copy()
+        try:
+            data = await self.backend.load(user_id)
+        except Exception as e:
+            send_logs("Settings load error for user %s: %s", 'warning', user_id, e)
+            if cached is not None:
+                return cached[0].copy()
+            data = None
+        try:
+            settings = UserSettings.from_bytes(data) if data else UserSettings()
+        except struct.error:
+            send_logs("Corrupt settings for user %s, using defaults", 'warning', user_id)
+            settings = UserSettings()
+        # Another coroutine may have filled the cache while we were waiting
+        current = self._cache.get(user_id)
+        if current is not None and current is not cached:
+            return current[0].copy()
+        self._remember(user_id, settings)
+        return settings.copy()
+
+    async def save(self, user_id, settings):
+        self._remember(user_id, settings.copy())
+        try:
+            await self.backend.save(user_id, settings.to_bytes())
+        except Exception as e:
+            send_logs("Settings save error for user %s: %s", 'error', user_id, e)
+
+    async def close(self):
+        await self.backend.close()
+
+
+def create_backend(backend="sqlite", sqlite_path="sessions/settings.sqlite3", redis_host="127.0.0.1", redis_port=6379,
+                   name="settings", ttl=None):
+    """Per-user blob backend by configured name: memory, sqlite or redis.
+
+    ``name`` keeps different kinds of data apart in the same database (the
+    SQLite table or the Redis key prefix); ``ttl`` makes entries expire.
+    """
+    if backend == "memory":
+        return MemoryBackend(ttl)
+    if backend == "sqlite":
+        return SQLiteBackend(sqlite_path, "user_settings" if name == "settings" else name, ttl)
+    if backend == "redis":
+        return RedisBackend(RespClient(redis_host, redis_port), f"{name}:", ttl)
+    raise ValueError(f"Unknown settings backend: {backend}")
+
+
+def create_settings_store(backend="sqlite", sqlite_path="sessions/settings.sqlite3", redis_host="127.0.0.1", redis_port=6379,
+                          cache_ttl=30.0):
+    """Build a SettingsStore for the configured backend name: memory, sqlite or redis"""
+    # Nothing else can change an in-memory backend, its entries never go stale
+    store = SettingsStore(create_backend(backend, sqlite_path, redis_host, redis_port),
+                          cache_ttl=None if backend == "memory" else cache_ttl)
+    send_logs("Settings backend: %s", 'info', backend)
+    return store
@@ -0,0 +1,108 @@
+import asyncio
+
+from functions import send_logs, estimate_tokens, CHARS_PER_TOKEN
+from cache import content_hash
+from prompts import summary_options
+
+CHUNK_SUMMARY_PROMPT = (
+    "You are summarizing one part of a longer document for a later analysis step. "
+    "List the key topics, tasks, requirements and any deadlines or dates (keep them in YYYY-MM-DD format "
+    "when possible). Be factual and concise, no commentary, no personality."
+)
+
+
+def chunk_text(text, max_tokens):
+    """Split text into chunks of at most ``max_tokens`` on paragraph/page boundaries.
+
+    Pages and paragraphs are separated by blank lines; a single paragraph
+    larger than the budget is split on the character budget instead.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks = []
+    current = []
+    current_len = 0
+    for paragraph in text.split("\n\n"):
+        if not paragraph.strip():
+            continue
+        pieces = [paragraph[i:i + max_chars] for i in range(0, len(paragraph), max_chars)]
+        for piece in pieces:
+            if current and current_len + len(piece) + 2 > max_chars:
+                chunks.append("\n\n".join(current))
+                current = []
+                current_len = 0
+            current.append(piece)
+            current_len += len(piece) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class DocumentSummarizer:
+    """Map step for long documents: summarizes token-budgeted chunks concurrently.
+
+    Chunk summaries are cached by chunk hash, so re-uploads and documents
+    that share pages reuse earlier work. The personality-driven "why it
+    matters" pass stays with the caller.
+    """
+
+    def __init__(self, llm, cache, chunk_tokens=8000, max_concurrency=4, summary_tokens=600):
+        self.llm = llm
+        self.cache = cache
+        self.chunk_tokens = chunk_tokens
+        self.max_concurrency = max_concurrency
+        self.summary_tokens = summary_tokens
+
+    def _cache_key(self, chunk):
+        return "chunk:" + content_hash(CHUNK_SUMMARY_PROMPT, self.summary_tokens, chunk)
+
+    async def _summarize(self, chunk):
+        key = self._cache_key(chunk)
+        summary = await self.cache.get(key)
+        if summary is not None:
+            return summary
+
+        messages = [
+            {"role": "system", "content": CHUNK_SUMMARY_PROMPT},
+            {"role": "user", "content": chunk}
+        ]
+        parts = []
+        async for content in self.llm.stream_chat(messages, **summary_options(self.summary_tokens)):
+            parts.append(content)
+        summary = "".join(parts).strip()
+        if summary:
+            await self.cache.set(key, summary)
+        return summary
+
+    async def condense(self, text, on_progress=None):
+        """Return text short enough for one analysis call.
+
+        Text within one chunk is returned unchanged; longer text is replaced
+        by the ordered per-chunk summaries. ``on_progress(done, total)`` is
+        called as chunks finish.
+        """
+        if estimate_tokens(text) <= self.chunk_tokens:
+            return text
+
+        chunks = chunk_text(text, self.chunk_tokens)
+        send_logs("Summarizing document in %s chunks (max %s at once)", 'info', len(chunks), self.max_concurrency)
+        slots = asyncio.Semaphore(self.max_concurrency)
+        finished = 0
+
+        async def run(chunk):
+            nonlocal finished
+            async with slots:
+                try:
+                    return await self._summarize(chunk)
+                except Exception as e:
+                    send_logs("Chunk summary failed, skipping chunk: %s", 'warning', e)
+                    return ""
+                finally:
+                    finished += 1
+                    if on_progress is not None:
+                        on_progress(finished, len(chunks))
+
+        summaries = await asyncio.gather(*(run(chunk) for chunk in chunks))
+        parts = [f"[Part {i + 1}/{len(chunks)}]\n{summary}" for i, summary in enumerate(summaries) if summary]
+        if not parts:
+            raise RuntimeError("Could not summarize any part of the document")
+        return "\n\n".join(parts)
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+from cache import LRUCache, SQLiteCache, TieredCache
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(cache, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.path = os.path.join(workdir.name, "cache.sqlite3")
+
+
+class LRUCacheTest(CacheTestCase):
+    def test_evicts_least_recently_used_by_size(self):
+        memory = LRUCache(max_chars=10)
+        memory.set("a", "aaaa")
+        memory.set("b", "bbbb")
+        memory.get("a")
+        memory.set("c", "cccc")  # over 10 chars: b is the oldest unused entry
+        self.assertIsNone(memory.get("b"))
+        self.assertEqual(memory.get("a"), "aaaa")
+        self.assertEqual(memory.size, 8)
+
+    def test_values_larger_than_the_cache_are_not_kept(self):
+        memory = LRUCache(max_chars=3)
+        memory.set("a", "abcd")
+        self.assertIsNone(memory.get("a"))
+        self.assertEqual(memory.size, 0)
+
+    def test_ttl(self):
+        memory = LRUCache(ttl=60)
+        memory.set("a", "value")
+        self.clock.now += 59
+        self.assertEqual(memory.get("a"), "value")
+        self.clock.now += 1
+        self.assertIsNone(memory.get("a"))
+        self.assertEqual(memory.size, 0)
+
+
+class SQLiteCacheTest(CacheTestCase):
+    def test_ttl(self):
+        disk = SQLiteCache(self.path, ttl=60)
+        disk.set("a", "value")
+        self.clock.now += 59
+        self.assertEqual(disk.get("a"), "value")
+        self.clock.now += 1
+        self.assertIsNone(disk.get("a"))
+        disk.close()
+
+    def test_size_eviction_drops_least_recently_read(self):
+        disk = SQLiteCache(self.path, max_bytes=250)
+        for i in range(SQLiteCache.EVICT_EVERY - 1):
+            disk.set(f"k{i}", "x" * 10)
+            self.clock.now += 1
+        disk.get("k0")  # read last, so kept
+        disk.set("last", "x" * 10)  # the 50th write checks the size
+        kept = [f"k{i}" for i in range(SQLiteCache.EVICT_EVERY - 1) if disk.get(f"k{i}") is not None]
+        self.assertIn("k0", kept)
+        self.assertNotIn("k1", kept)
+        self.assertLessEqual((len(kept) + 1) * 10, 250)
+        disk.close()
+
+
+class TieredCacheTest(CacheTestCase):
+    def test_disk_hit_is_promoted_with_the_disk_expiry(self):
+        async def run():
+            disk = SQLiteCache(self.path, ttl=60)
+            tiered = TieredCache(LRUCache(ttl=3600), disk)
+            await tiered.set("resp:a", "answer")
+            tiered.memory = LRUCache(ttl=3600)  # a restart: only the disk tier survives
+
+            self.clock.now += 30
+            self.assertEqual(await tiered.get("resp:a"), "answer")
+            self.assertEqual(tiered.disk_hits["resp"], 1)
+            self.assertEqual(await tiered.get("resp:a"), "answer")
+            self.assertEqual(tiered.memory_hits["resp"], 1)
+
+            # The promoted copy expires with the disk entry, not an hour later
+            self.clock.now += 30
+            self.assertIsNone(await tiered.get("resp:a"))
+            self.assertEqual(tiered.misses["resp"], 1)
+            self.assertEqual(tiered.stats()["resp"]["hit_ratio"], round(2 / 3, 3))
+            tiered.close()
+
+        asyncio.run(run())
+
+    def test_memory_eviction_falls_back_to_disk(self):
+        async def run():
+            tiered = TieredCache(LRUCache(max_chars=10), SQLiteCache(self.path))
+            await tiered.set("pdf:a", "a" * 8)
+            await tiered.set("pdf:b", "b" * 8)  # pushes a out of memory
+            self.assertEqual(await tiered.get("pdf:a"), "a" * 8)
+            self.assertEqual(tiered.disk_hits["pdf"], 1)
+            tiered.close()
+
+        asyncio.run(run())
+
+
+class CacheableTest(unittest.TestCase):
+    """The rules for which answers may go into the shared response cache"""
+
+    def setUp(self):
+        import script
+        self.script = script
+
+    def reply(self, **overrides):
+        return SimpleNamespace(**dict({"cut_off": False, "model": self.script.model_deepseek}, **overrides))
+
+    def test_complete_primary_answer(self):
+        self.assertTrue(self.script.cacheable("An answer.", self.reply()))
+
+    def test_error_answer(self):
+        self.assertFalse(self.script.cacheable(f"{self.script.DEEPSEEK_ERROR_PREFIX}: timeout", self.reply()))
+
+    def test_cut_off_answer(self):
+        self.assertFalse(self.script.cacheable("Half an answer", self.reply(cut_off=True)))
+
+    def test_fallback_model(self):
+        self.assertFalse(self.script.cacheable("An answer.", self.reply(model="deepseek-r1:1.5b")))
+        self.assertFalse(self.script.cacheable("An answer.", self.reply(model=None)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import ChunkedStreamBuffer, split_message, utf16_len, _open_entities
+
+TELEGRAM_LIMIT = 4096
+
+
+def stream(text, limit, piece=37):
+    """Feed ``text`` in small pieces like a token stream, returns (chunks, buffer)"""
+    buffer = ChunkedStreamBuffer(limit)
+    chunks = []
+    for start in range(0, len(text), piece):
+        chunks.extend(buffer.feed(text[start:start + piece]))
+    chunks.extend(buffer.flush())
+    return chunks, buffer
+
+
+def sample_answer(words=3000, seed=7):
+    rng = random.Random(seed)
+    vocabulary = ["deadline", "exam", "😀", "🚀", "**bold words here**", "`code`", "рус", "ăîș", "\n\n", "\n"]
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+class ChunkLimitTest(unittest.TestCase):
+    def test_chunks_fit_in_a_telegram_message(self):
+        text = sample_answer()
+        for chunks in (stream(text, TELEGRAM_LIMIT)[0], split_message(text, TELEGRAM_LIMIT)):
+            self.assertGreater(len(chunks), 1)
+            for chunk in chunks:
+                self.assertLessEqual(utf16_len(chunk), TELEGRAM_LIMIT)
+
+    def test_astral_characters_count_twice(self):
+        # 3000 emoji are 3000 characters but 6000 UTF-16 units
+        chunks = split_message("😀" * 3000, TELEGRAM_LIMIT)
+        self.assertEqual(len(chunks), 2)
+        for chunk in chunks:
+            self.assertLessEqual(utf16_len(chunk), TELEGRAM_LIMIT)
+
+
+class SurrogatePairTest(unittest.TestCase):
+    def test_no_surrogate_pair_is_split(self):
+        # No spaces: every cut is a hard cut inside the emoji run
+        text = "a" + "🚀" * 5000
+        for limit in (TELEGRAM_LIMIT, 101, 100):
+            chunks, _ = stream(text, limit)
+            for chunk in chunks:
+                chunk.encode("utf-16-le", errors="strict")
+                self.assertLessEqual(utf16_len(chunk), limit)
+            self.assertEqual("".join(chunks), text)
+
+
+class MarkdownTest(unittest.TestCase):
+    def assertBalanced(self, chunks):
+        for chunk in chunks:
+            self.assertEqual(_open_entities(chunk), [], chunk[-40:])
+
+    def test_bold_and_code_are_closed_and_reopened(self):
+        text = "**" + "bold " * 2000 + "** and `" + "code " * 2000 + "` end"
+        chunks, _ = stream(text, TELEGRAM_LIMIT)
+        self.assertBalanced(chunks)
+        self.assertTrue(chunks[1].startswith("**"))
+        self.assertTrue(any(chunk.startswith("`") for chunk in chunks[2:]))
+
+    def test_delimiters_are_not_cut_in_half(self):
+        # One long word full of ** delimiters, so the cut has to land between them
+        text = "x**y**" * 3000
+        for limit in (TELEGRAM_LIMIT, 99, 100):
+            chunks, _ = stream(text, limit)
+            self.assertBalanced(chunks)
+            for chunk in chunks:
+                self.assertLessEqual(utf16_len(chunk), limit)
+
+    def test_sample_answer_stays_balanced(self):
+        chunks, _ = stream(sample_answer(), TELEGRAM_LIMIT)
+        self.assertBalanced(chunks)
+
+
+class ConsumedTest(unittest.TestCase):
+    def test_everything_is_consumed_after_flush(self):
+        for text in (sample_answer(), "**" + "bold " * 2000 + "**", "😀" * 5000, "short answer"):
+            chunks, buffer = stream(text, TELEGRAM_LIMIT)
+            self.assertEqual(buffer.consumed, len(text))
+            self.assertEqual(buffer.chunks, len(chunks))
+
+
+if __name__ == '__main__':
+    unittest.main()
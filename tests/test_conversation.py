@@ -0,0 +1,105 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from conversation import ConversationMemory, refers_to_conversation
+from settings_store import MemoryBackend
+
+
+class FollowUpTest(unittest.TestCase):
+    def test_follow_ups(self):
+        for text in ("make it shorter", "Why?", "example?", "you said the deadline was Friday, is that right?",
+                     "And what about the second part", "explain that answer again"):
+            self.assertTrue(refers_to_conversation(text), text)
+
+    def test_standalone_questions(self):
+        for text in ("Explain the causes of the French revolution for my history exam",
+                     "Homework: write an essay on photosynthesis, due 2026-11-02"):
+            self.assertFalse(refers_to_conversation(text), text)
+
+
+class BlockingLLM:
+    """Summaries that wait until released"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+
+    async def stream_chat(self, messages, **options):
+        await self.release.wait()
+        yield "summary"
+
+
+class SummaryTaskTest(unittest.TestCase):
+    def test_cancelled_summary_does_not_untrack_the_next_one(self):
+        async def run():
+            llm = BlockingLLM()
+            memory = ConversationMemory(MemoryBackend(), llm, token_budget=40, max_turns=1)
+            long_text = "word " * 50
+
+            await memory.record(1, long_text, long_text)
+            first = memory._summarizing[1]
+            await memory.clear(1)
+            await memory.record(1, long_text, long_text)
+            second = memory._summarizing[1]
+            self.assertIsNot(first, second)
+
+            await asyncio.gather(first, return_exceptions=True)  # runs its done callback
+            self.assertIs(memory._summarizing.get(1), second)
+
+            await memory.close()
+            self.assertTrue(second.cancelled())
+
+        asyncio.run(run())
+
+
+class SharedAnswerTest(unittest.TestCase):
+    """Runs the real text handler against the fake Telegram client and the fake LLM server"""
+
+    def setUp(self):
+        self.previous_dir = os.getcwd()
+        self.workdir = tempfile.TemporaryDirectory()
+        os.chdir(self.workdir.name)
+
+    def tearDown(self):
+        os.chdir(self.previous_dir)
+        self.workdir.cleanup()
+
+    def test_standalone_question_shares_the_cache_across_histories(self):
+        from bench import FakeTelegram, write_config, load_bot, close_bot
+        from fake_llm import FakeLLMServer
+
+        async def run():
+            server = await FakeLLMServer(first_token_delay=0, tokens_per_second=10000).start()
+            options = SimpleNamespace(log_level="WARNING", llm_concurrency=4, edits_per_second=1000)
+            write_config(self.workdir.name, server.url, options)
+            telegram = FakeTelegram(latency=0)
+            bot = load_bot(self.workdir.name, telegram)
+            try:
+                await bot.conversation_memory.record(1, "What is a derivative?", "The rate of change of a function.")
+                await bot.conversation_memory.record(2, "Who wrote Hamlet?", "William Shakespeare.")
+
+                question = "Explain the causes of the French revolution for my history exam"
+                answers = []
+                for user_id in (1, 2):
+                    settings = await bot.settings_store.get(user_id)
+                    message = await telegram.send_message(user_id, "Analyzing your content... Please wait.")
+                    await bot.analyze_text(user_id, question, "2026-10-18 12:00:00", settings, message)
+                    answers.append(message.message)
+
+                self.assertEqual(server.requests, 1)
+                self.assertEqual(answers[0], answers[1])
+            finally:
+                await close_bot(bot)
+                await server.stop()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deadlines import DeadlineStreamParser, DeadlineStore, parse_deadline_block
+
+ANSWER = "This essay matters because it is half your grade."
+BLOCK = '[{"object_name": "Essay", "deadline": "2026-11-02", "context": "History"}]'
+
+
+def run_stream(deltas):
+    """(visible text, deadlines) after feeding ``deltas`` like a token stream"""
+    parser = DeadlineStreamParser()
+    visible = "".join(parser.feed(delta) for delta in deltas) + parser.flush()
+    return visible, parser.deadlines()
+
+
+def split_every(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class StreamParserTest(unittest.TestCase):
+    def test_block_is_hidden_and_parsed(self):
+        visible, deadlines = run_stream([ANSWER, "\n###JSON###\n", BLOCK, "\n###END###"])
+        self.assertEqual(visible.strip(), ANSWER)
+        self.assertEqual(deadlines, [{"object_name": "Essay", "deadline": "2026-11-02", "context": "History"}])
+
+    def test_marker_split_across_deltas(self):
+        text = f"{ANSWER}\n###JSON###\n{BLOCK}\n###END###"
+        for size in (1, 2, 3, 5, 7):
+            visible, deadlines = run_stream(split_every(text, size))
+            self.assertEqual(visible.strip(), ANSWER, size)
+            self.assertEqual(len(deadlines), 1, size)
+
+    def test_partial_marker_that_is_not_the_marker_is_shown(self):
+        visible, deadlines = run_stream(["Use ###", "# headings", " and ###JSO", "N-like words"])
+        self.assertEqual(visible, "Use #### headings and ###JSON-like words")
+        self.assertEqual(deadlines, [])
+
+    def test_held_back_prefix_is_flushed_at_the_end(self):
+        visible, _ = run_stream([ANSWER, " ###JS"])
+        self.assertEqual(visible, ANSWER + " ###JS")
+
+    def test_missing_end_marker(self):
+        # The stop sequence never arrived: the block simply runs to the end of the stream
+        visible, deadlines = run_stream([ANSWER, "\n###JSON###\n", BLOCK])
+        self.assertEqual(visible.strip(), ANSWER)
+        self.assertEqual([d["object_name"] for d in deadlines], ["Essay"])
+
+    def test_block_cut_off_mid_list_keeps_complete_entries(self):
+        block = BLOCK[:-1] + ', {"object_name": "Exam", "deadl'
+        _, deadlines = run_stream([ANSWER, "###JSON###", block])
+        self.assertEqual([d["object_name"] for d in deadlines], ["Essay"])
+
+    def test_invalid_json(self):
+        visible, deadlines = run_stream([ANSWER, "###JSON###", "{not json at all", "###END###"])
+        self.assertEqual(visible, ANSWER)
+        self.assertEqual(deadlines, [])
+
+    def test_text_after_the_block_is_not_shown(self):
+        visible, deadlines = run_stream([ANSWER, "###JSON###", BLOCK, "###END###", "\nHope this helps!"])
+        self.assertEqual(visible, ANSWER)
+        self.assertEqual(len(deadlines), 1)
+
+    def test_no_block(self):
+        visible, deadlines = run_stream(split_every(ANSWER, 4))
+        self.assertEqual(visible, ANSWER)
+        self.assertEqual(deadlines, [])
+
+
+class BlockParserTest(unittest.TestCase):
+    def test_code_fences_and_trailing_commas(self):
+        block = '```json\n[{"object_name": "Lab", "deadline": "2026-12-01",},]\n```'
+        self.assertEqual([d["object_name"] for d in parse_deadline_block(block)], ["Lab"])
+
+    def test_consecutive_objects(self):
+        block = '{"object_name": "A", "deadline": "2026-12-01"}\n{"object_name": "B", "deadline": "2026-12-02"}'
+        self.assertEqual([d["object_name"] for d in parse_deadline_block(block)], ["A", "B"])
+
+    def test_invalid_entries_are_dropped(self):
+        block = ('[{"object_name": "A", "deadline": "next week"}, {"object_name": "", "deadline": "2026-12-01"},'
+                 ' {"object_name": ["B"], "deadline": "2026-12-02T10:00"}]')
+        self.assertEqual(parse_deadline_block(block),
+                         [{"object_name": "B", "deadline": "2026-12-02", "context": ""}])
+
+
+class DeadlineStoreTest(unittest.TestCase):
+    def test_add_and_upcoming(self):
+        async def run():
+            with tempfile.TemporaryDirectory() as workdir:
+                store = DeadlineStore(os.path.join(workdir, "deadlines.sqlite3"))
+                deadlines = [
+                    {"object_name": "Exam", "deadline": "2026-12-10", "context": ""},
+                    {"object_name": "Essay", "deadline": "2026-11-02", "context": "History"},
+                    {"object_name": "Old quiz", "deadline": "2026-01-05", "context": ""},
+                ]
+                self.assertEqual(await store.add(1, deadlines), 3)
+                self.assertEqual(await store.add(1, deadlines[:1]), 0)  # already stored
+                await store.add(2, [{"object_name": "Other", "deadline": "2026-11-01", "context": ""}])
+
+                upcoming = await store.upcoming(1, datetime.date(2026, 10, 18))
+                self.assertEqual([d["object_name"] for d in upcoming], ["Essay", "Exam"])
+                store.close()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+from telethon.errors import FloodWaitError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from edit_throttler import EditCoalescer
+
+
+class FakeMessage:
+    def __init__(self, chat_id, message_id=1):
+        self.chat_id = chat_id
+        self.id = message_id
+
+
+class FakeClient:
+    """Edits that take ``latency`` seconds; ``flood_waits`` FloodWait errors come first"""
+
+    def __init__(self, latency=0.0, flood_waits=0):
+        self.latency = latency
+        self.flood_waits = flood_waits
+        self.edits = []
+        self.active = 0
+        self.max_active = 0
+
+    async def edit_message(self, message, text):
+        if self.flood_waits:
+            self.flood_waits -= 1
+            raise FloodWaitError(request=None, capture=1)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+            self.edits.append((message.chat_id, text, time.monotonic()))
+        finally:
+            self.active -= 1
+
+
+async def wait_for_edits(client, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while len(client.edits) < count:
+        if time.monotonic() > deadline:
+            raise AssertionError(f"{len(client.edits)} of {count} edits sent")
+        await asyncio.sleep(0.01)
+
+
+class EditCoalescerTest(unittest.TestCase):
+    def test_only_the_latest_preview_is_sent(self):
+        async def run():
+            client = FakeClient()
+            coalescer = EditCoalescer(client, edits_per_second=100, min_interval=0.2)
+            message = FakeMessage(1)
+            for text in ("one", "one two", "one two three"):
+                coalescer.submit(message, text)
+            await wait_for_edits(client, 1)
+            coalescer.submit(message, "one two three")  # unchanged, never sent
+            await asyncio.sleep(0.3)
+            self.assertEqual([text for _, text, _ in client.edits], ["one two three"])
+            self.assertEqual(coalescer.coalesced, 2)
+            self.assertEqual(coalescer.skipped_unchanged, 1)
+            await coalescer.close()
+
+        asyncio.run(run())
+
+    def test_chats_are_edited_concurrently_up_to_the_limit(self):
+        async def run():
+            client = FakeClient(latency=0.2)
+            coalescer = EditCoalescer(client, edits_per_second=100, max_concurrent_edits=3)
+            started = time.monotonic()
+            for chat_id in range(6):
+                coalescer.submit(FakeMessage(chat_id), f"text {chat_id}")
+            await wait_for_edits(client, 6)
+            self.assertEqual(client.max_active, 3)
+            self.assertLess(time.monotonic() - started, 6 * 0.2)
+            await coalescer.close()
+
+        asyncio.run(run())
+
+    def test_final_edit_waits_for_the_preview_on_the_wire(self):
+        async def run():
+            client = FakeClient(latency=0.1)
+            coalescer = EditCoalescer(client, edits_per_second=100)
+            message = FakeMessage(1)
+            coalescer.submit(message, "preview")
+            while not coalescer._inflight:
+                await asyncio.sleep(0.001)
+            await coalescer.edit_now(message, "final")
+            self.assertEqual([text for _, text, _ in client.edits], ["preview", "final"])
+            await coalescer.close()
+
+        asyncio.run(run())
+
+    def test_flood_wait_pauses_edits_and_backs_off(self):
+        async def run():
+            client = FakeClient(flood_waits=1)
+            coalescer = EditCoalescer(client, edits_per_second=100, min_interval=0.1, max_interval=1.0)
+            started = time.monotonic()
+            coalescer.submit(FakeMessage(1), "first")
+            while not coalescer.flood_waits:
+                await asyncio.sleep(0.01)
+            coalescer.submit(FakeMessage(1), "newer")
+            coalescer.submit(FakeMessage(2), "other chat")
+            self.assertEqual(coalescer.stats()["backoff"], 2.0)
+
+            await wait_for_edits(client, 2)
+            self.assertGreaterEqual(min(at for _, _, at in client.edits) - started, 0.9)
+            self.assertEqual(sorted(text for _, text, _ in client.edits), ["newer", "other chat"])
+            self.assertEqual(coalescer.flood_wait_seconds, 1)
+            await coalescer.close()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
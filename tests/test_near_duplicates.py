@@ -0,0 +1,85 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from near_duplicates import NearDuplicateIndex
+
+ASSIGNMENT = (
+    "Write a two page essay about the causes of the French revolution, covering the financial crisis of "
+    "the monarchy, the influence of enlightenment ideas on the third estate, the role of bread prices and "
+    "the calling of the estates general in 1789. Submit it on the course page by 2026-11-02."
+)
+OTHER = (
+    "Prepare a lab report on photosynthesis in aquatic plants, measure oxygen production under three light "
+    "intensities, plot the results with error bars and discuss the sources of uncertainty in your method. "
+    "The report is due on 2026-11-02 and should not exceed five pages."
+)
+
+
+class NearDuplicateTest(unittest.TestCase):
+    def setUp(self):
+        self.index = NearDuplicateIndex(threshold=0.85)
+
+    def test_near_identical_text_matches(self):
+        self.index.add(self.index.signature(ASSIGNMENT), "scope", "resp:1")
+        variants = [
+            "Hi! " + ASSIGNMENT + " Thanks!",
+            "Current time: 2026-10-18 12:00:00\n\n" + ASSIGNMENT.upper(),
+            "  ".join(ASSIGNMENT.split()).replace(",", " ,"),
+        ]
+        for variant in variants:
+            signature = self.index.signature(variant)
+            self.assertGreaterEqual(self.index.similarity(signature, self.index.signature(ASSIGNMENT)), 0.85)
+            self.assertEqual(self.index.find(signature, "scope"), "resp:1", variant[:40])
+
+    def test_different_text_does_not_match(self):
+        self.index.add(self.index.signature(ASSIGNMENT), "scope", "resp:1")
+        signature = self.index.signature(OTHER)
+        self.assertLess(self.index.similarity(signature, self.index.signature(ASSIGNMENT)), 0.85)
+        self.assertIsNone(self.index.find(signature, "scope"))
+        self.assertEqual(self.index.misses, 1)
+
+    def test_a_small_edit_to_a_long_text_still_matches(self):
+        self.index.add(self.index.signature(ASSIGNMENT * 4), "scope", "resp:1")
+        edited = (ASSIGNMENT * 4).replace("bread prices", "grain prices", 1)
+        self.assertEqual(self.index.find(self.index.signature(edited), "scope"), "resp:1")
+
+    def test_numbers_must_match(self):
+        self.index.add(self.index.signature(ASSIGNMENT), "scope", "resp:1")
+        changed = ASSIGNMENT.replace("1789", "1799")
+        self.assertIsNone(self.index.find(self.index.signature(changed), "scope"))
+
+    def test_scope_isolates_entries(self):
+        self.index.add(self.index.signature(ASSIGNMENT), "calm", "resp:calm")
+        self.index.add(self.index.signature(ASSIGNMENT), "angry", "resp:angry")
+        signature = self.index.signature(ASSIGNMENT)
+        self.assertEqual(self.index.find(signature, "calm"), "resp:calm")
+        self.assertEqual(self.index.find(signature, "angry"), "resp:angry")
+        self.assertIsNone(self.index.find(signature, "funny"))
+
+    def test_short_prompts_are_not_indexed(self):
+        self.assertIsNone(self.index.signature("What is a derivative?"))
+        self.assertIsNone(self.index.find(None, "scope"))
+
+    def test_hits_are_counted_by_the_caller(self):
+        self.index.add(self.index.signature(ASSIGNMENT), "scope", "resp:1")
+        self.assertIsNotNone(self.index.find(self.index.signature(ASSIGNMENT), "scope"))
+        self.assertEqual(self.index.hits, 0)
+        self.index.stale()
+        self.assertEqual(self.index.stats()["misses"], 1)
+        self.index.hit()
+        self.assertEqual(self.index.stats()["hit_ratio"], 0.5)
+
+    def test_oldest_entries_are_evicted(self):
+        index = NearDuplicateIndex(max_entries=1)
+        index.add(index.signature(ASSIGNMENT), "scope", "resp:1")
+        index.add(index.signature(OTHER), "scope", "resp:2")
+        self.assertIsNone(index.find(index.signature(ASSIGNMENT), "scope"))
+        self.assertEqual(index.find(index.signature(OTHER), "scope"), "resp:2")
+        self.assertEqual(index.evictions, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
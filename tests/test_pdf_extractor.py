@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_extractor import SpooledDownload
+
+
+class SpooledDownloadTest(unittest.TestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.directory = workdir.name
+
+    def test_small_download_stays_in_memory_until_extracted(self):
+        spool = SpooledDownload(max_memory=1024, directory=self.directory)
+        spool.write(b"%PDF-1.4 ")
+        spool.write(b"small")
+        self.assertFalse(spool.on_disk)
+        self.assertEqual(os.listdir(self.directory), [])
+
+        path = spool.source()
+        self.assertEqual(spool.source(), path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b"%PDF-1.4 small")
+        spool.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_large_download_spills_to_disk(self):
+        spool = SpooledDownload(max_memory=8, directory=self.directory)
+        spool.write(b"%PDF-1.4 ")
+        spool.write(b"x" * 100)
+        self.assertTrue(spool.on_disk)
+        self.assertEqual(spool.size, 109)
+        with open(spool.source(), 'rb') as f:
+            self.assertEqual(f.read(), b"%PDF-1.4 " + b"x" * 100)
+        spool.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
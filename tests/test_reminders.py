@@ -0,0 +1,161 @@
+import asyncio
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reminders
+from reminders import ReminderScheduler, ReminderStore
+
+DAY = 24 * 3600
+START = datetime.datetime(2026, 10, 18, 9, 0, tzinfo=datetime.timezone.utc).timestamp()
+
+
+class FakeClock:
+    def __init__(self, now=START):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, user_id, text, **kwargs):
+        self.sent.append((user_id, text))
+
+
+class FailingStore(ReminderStore):
+    """Fails to record the send of the reminders in ``failing``"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.failing = set()
+
+    def mark_sent(self, ids):
+        if self.failing.intersection(ids):
+            raise sqlite3.OperationalError("database is locked")
+        super().mark_sent(ids)
+
+
+class ReminderSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(reminders, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.path = os.path.join(workdir.name, "reminders.sqlite3")
+        self.client = FakeClient()
+
+    def scheduler(self, store=None):
+        return ReminderScheduler(self.client, store or ReminderStore(self.path), pytz.utc, horizon=3600.0,
+                                 messages_per_second=1e6)
+
+    async def tick(self, scheduler):
+        """One pass of the scheduler loop at the fake time"""
+        now = self.clock.time()
+        if scheduler._loaded_until is None or now + scheduler.horizon / 2 > scheduler._loaded_until:
+            await scheduler._refill(now)
+        await scheduler._dispatch(now)
+
+    def pending(self):
+        with sqlite3.connect(self.path) as db:
+            return db.execute("SELECT label FROM reminders WHERE sent = 0 ORDER BY fire_at").fetchall()
+
+    def test_reminders_move_from_sqlite_to_the_heap_when_due(self):
+        async def run():
+            scheduler = self.scheduler()
+            await self.tick(scheduler)
+            await scheduler.schedule(1, [{"deadline": "2026-10-28", "object_name": "Essay", "context": ""}])
+            self.assertEqual(scheduler.stats()["loaded"], 0)  # a week away, only in SQLite
+            self.assertEqual(len(self.pending()), 3)
+
+            self.clock.now = START + 3 * DAY - 600  # ten minutes before "in 7 days"
+            await self.tick(scheduler)
+            self.assertEqual(scheduler.stats()["loaded"], 1)
+            self.assertEqual(self.client.sent, [])
+
+            self.clock.now += 600
+            await self.tick(scheduler)
+            self.assertEqual(len(self.client.sent), 1)
+            self.assertIn("Essay", self.client.sent[0][1])
+            self.assertIn("in 7 days", self.client.sent[0][1])
+            self.assertEqual(self.pending(), [("tomorrow",), ("in 1 hour",)])
+            await scheduler.close()
+
+        asyncio.run(run())
+
+    def test_reminder_inside_the_loaded_window_goes_straight_to_the_heap(self):
+        async def run():
+            self.clock.now = START + 30 * 60  # deadline is tomorrow at 09:00, "tomorrow" fires in 30 minutes
+            scheduler = self.scheduler()
+            await self.tick(scheduler)
+            await scheduler.schedule(1, [{"deadline": "2026-10-19", "object_name": "Quiz", "context": ""}])
+            self.assertEqual(scheduler.stats()["loaded"], 0)  # "tomorrow" fired 30 minutes ago, not scheduled
+
+            self.clock.now = START - 30 * 60
+            await scheduler.schedule(2, [{"deadline": "2026-10-19", "object_name": "Lab", "context": ""}])
+            self.assertEqual(scheduler.stats()["loaded"], 1)
+            await scheduler.close()
+
+        asyncio.run(run())
+
+    def test_unsent_reminders_are_reloaded_after_a_restart(self):
+        async def run():
+            scheduler = self.scheduler()
+            await scheduler.schedule(1, [{"deadline": "2026-10-28", "object_name": "Essay", "context": ""}])
+            await scheduler.close()
+
+            self.clock.now = START + 3 * DAY + 60  # the bot was down when "in 7 days" was due
+            scheduler = self.scheduler()
+            await self.tick(scheduler)
+            self.assertEqual(len(self.client.sent), 1)
+            await scheduler.close()
+
+        asyncio.run(run())
+
+    def test_batch_is_requeued_after_a_partial_send(self):
+        async def run():
+            store = FailingStore(self.path)
+            scheduler = self.scheduler(store)
+            deadlines = [{"deadline": "2026-10-19", "object_name": name, "context": ""} for name in ("A", "B", "C")]
+            self.clock.now = START - 2 * 3600
+            await scheduler.schedule(1, deadlines)
+            ids = sorted(entry[1] for entry in store.due_before(0, float("inf")) if entry[5] == "tomorrow")
+            store.failing = {ids[1]}
+
+            self.clock.now = START
+            with self.assertRaises(sqlite3.OperationalError):
+                await self.tick(scheduler)
+            self.assertEqual(len(self.client.sent), 2)
+            # B went out before its store write failed: only C, never sent, is back on the heap
+            self.assertEqual([entry[1] for entry in scheduler._heap], ids[2:])
+
+            store.failing = set()
+            await self.tick(scheduler)
+            names = [text.split("**")[1] for _, text in self.client.sent]
+            self.assertEqual(names, ["A", "B", "C"])
+            self.assertEqual(scheduler._heap, [])
+            # B stays unsent in SQLite, so a restart would deliver it again rather than lose it
+            self.assertEqual(self.pending(), [("tomorrow",)] + [("in 1 hour",)] * 3)
+            await scheduler.close()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
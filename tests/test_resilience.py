@@ -0,0 +1,143 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_router import LLMRouter
+from resilience import ResilientClient, CircuitBreaker
+
+
+class SlowClient:
+    """Streams one token after ``delay`` seconds"""
+
+    name = "slow"
+    model = "slow"
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def stream_chat(self, messages, **options):
+        await asyncio.sleep(self.delay)
+        yield "ok"
+
+
+class RejectingClient:
+    """Fails every request with HTTP ``status`` before the first token"""
+
+    name = "rejecting"
+    model = "rejecting"
+
+    def __init__(self, status):
+        self.status = status
+        self.requests = 0
+
+    async def stream_chat(self, messages, **options):
+        self.requests += 1
+        request = httpx.Request("POST", "http://llm.test/v1/chat/completions")
+        raise httpx.HTTPStatusError("rejected", request=request, response=httpx.Response(self.status, request=request))
+        yield  # an async generator, like the real clients
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout  # past the timeout: half-open
+
+
+async def consume(client):
+    return [content async for content in client.stream_chat([{"role": "user", "content": "hi"}])]
+
+
+class CancelledProbeTest(unittest.TestCase):
+    def test_cancelled_probe_lets_the_next_request_probe(self):
+        async def run():
+            breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30.0)
+            client = ResilientClient(SlowClient(10), breaker=breaker, first_token_timeout=20)
+            open_breaker(breaker)
+            self.assertEqual(breaker.state, "half_open")
+
+            task = asyncio.ensure_future(consume(client))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+            self.assertEqual(breaker.state, "half_open")
+            client.client.delay = 0
+            self.assertEqual(await consume(client), ["ok"])
+            self.assertEqual(breaker.state, "closed")
+
+        asyncio.run(run())
+
+    def test_cancelled_stream_after_first_token_releases_the_probe(self):
+        async def run():
+            breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30.0)
+            client = ResilientClient(SlowClient(0), breaker=breaker)
+            open_breaker(breaker)
+
+            stream = client.stream_chat([{"role": "user", "content": "hi"}])
+            self.assertEqual(await stream.__anext__(), "ok")
+            await stream.aclose()
+
+            self.assertTrue(breaker.allow())
+
+        asyncio.run(run())
+
+
+class ClientErrorTest(unittest.TestCase):
+    def test_client_errors_do_not_open_the_breaker(self):
+        async def run():
+            breaker = CircuitBreaker(failure_threshold=2)
+            client = ResilientClient(RejectingClient(400), breaker=breaker, backoff_base=0)
+            for _ in range(5):
+                with self.assertRaises(httpx.HTTPStatusError):
+                    await consume(client)
+            self.assertEqual(client.client.requests, 5)  # not retried either
+            self.assertEqual(breaker.failures, 0)
+            self.assertEqual(breaker.state, "closed")
+
+        asyncio.run(run())
+
+    def test_server_errors_open_the_breaker(self):
+        async def run():
+            breaker = CircuitBreaker(failure_threshold=2)
+            client = ResilientClient(RejectingClient(503), retries=1, backoff_base=0, breaker=breaker)
+            with self.assertRaises(httpx.HTTPStatusError):
+                await consume(client)
+            self.assertEqual(breaker.state, "open")
+
+        asyncio.run(run())
+
+
+class RouterFailoverTest(unittest.TestCase):
+    def test_client_errors_are_not_failed_over(self):
+        async def run():
+            fallback = RejectingClient(503)
+            router = LLMRouter([RejectingClient(400), fallback])
+            with self.assertRaises(httpx.HTTPStatusError) as raised:
+                await consume(router)
+            self.assertEqual(raised.exception.response.status_code, 400)
+            self.assertEqual(fallback.requests, 0)
+            self.assertEqual(router.states[0].errors, 0)
+            self.assertFalse(router.stats()["rejecting"]["cooling_down"])
+
+        asyncio.run(run())
+
+    def test_overloaded_backend_fails_over(self):
+        async def run():
+            for status in (429, 500, 503):
+                router = LLMRouter([RejectingClient(status), SlowClient(0)])
+                self.assertEqual(await consume(router), ["ok"])
+                self.assertEqual(router.states[0].errors, 1)
+                self.assertEqual(router.states[1].fallbacks, 1)
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
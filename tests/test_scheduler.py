@@ -0,0 +1,123 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import GenerationScheduler, Superseded
+
+
+class Recorder:
+    """Job factories that log when they start and run until released"""
+
+    def __init__(self):
+        self.started = []
+        self.cancelled = []
+        self.running = 0
+        self.peak = 0
+        self.release = asyncio.Event()
+
+    def job(self, name, wait=True):
+        async def run():
+            self.started.append(name)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            try:
+                if wait:
+                    await self.release.wait()
+                return name
+            except asyncio.CancelledError:
+                self.cancelled.append(name)
+                raise
+            finally:
+                self.running -= 1
+        return run
+
+
+async def submit(scheduler, user_id, factory, supersede=False):
+    task = asyncio.ensure_future(scheduler.run(user_id, factory, supersede=supersede))
+    await asyncio.sleep(0)  # let it reach the scheduler before the next one
+    return task
+
+
+class FairnessTest(unittest.TestCase):
+    def test_users_take_turns(self):
+        async def run():
+            scheduler = GenerationScheduler(max_concurrent=1, per_user_limit=1)
+            recorder = Recorder()
+            blocker = await submit(scheduler, "x", recorder.job("x1"))
+            tasks = [
+                await submit(scheduler, "a", recorder.job("a1", wait=False)),
+                await submit(scheduler, "a", recorder.job("a2", wait=False)),
+                await submit(scheduler, "a", recorder.job("a3", wait=False)),
+                await submit(scheduler, "b", recorder.job("b1", wait=False)),
+                await submit(scheduler, "c", recorder.job("c1", wait=False)),
+            ]
+            recorder.release.set()
+            await asyncio.gather(blocker, *tasks)
+            self.assertEqual(recorder.started, ["x1", "a1", "b1", "c1", "a2", "a3"])
+
+        asyncio.run(run())
+
+    def test_per_user_limit(self):
+        async def run():
+            scheduler = GenerationScheduler(max_concurrent=4, per_user_limit=2)
+            recorder = Recorder()
+            tasks = [await submit(scheduler, "a", recorder.job(f"a{i}")) for i in range(3)]
+            tasks.append(await submit(scheduler, "b", recorder.job("b1")))
+            await asyncio.sleep(0)
+            # a's third job waits for one of its own, b is not held up behind it
+            self.assertEqual(recorder.started, ["a0", "a1", "b1"])
+            self.assertEqual(scheduler.stats()["queue_depth"], 1)
+            recorder.release.set()
+            self.assertEqual(await asyncio.gather(*tasks), ["a0", "a1", "a2", "b1"])
+
+        asyncio.run(run())
+
+    def test_max_concurrent(self):
+        async def run():
+            scheduler = GenerationScheduler(max_concurrent=2, per_user_limit=1)
+            recorder = Recorder()
+            tasks = [await submit(scheduler, user_id, recorder.job(user_id)) for user_id in "abcde"]
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.stats()["running"], 2)
+            self.assertEqual(scheduler.stats()["queue_depth"], 3)
+            recorder.release.set()
+            self.assertEqual(await asyncio.gather(*tasks), list("abcde"))
+            self.assertEqual(recorder.peak, 2)
+
+        asyncio.run(run())
+
+
+class SupersedeTest(unittest.TestCase):
+    def test_newer_job_cancels_running_and_queued(self):
+        async def run():
+            scheduler = GenerationScheduler(max_concurrent=4, per_user_limit=1)
+            recorder = Recorder()
+            running = await submit(scheduler, "a", recorder.job("a1"))
+            queued = await submit(scheduler, "a", recorder.job("a2"))
+            other = await submit(scheduler, "b", recorder.job("b1"))
+            await asyncio.sleep(0)
+            self.assertEqual(recorder.started, ["a1", "b1"])
+
+            newest = await submit(scheduler, "a", recorder.job("a3", wait=False), supersede=True)
+            with self.assertRaises(Superseded):
+                await running
+            with self.assertRaises(Superseded):
+                await queued
+            self.assertEqual(await newest, "a3")
+            await asyncio.sleep(0)
+            self.assertEqual(recorder.cancelled, ["a1"])
+            self.assertNotIn("a2", recorder.started)
+            self.assertEqual(scheduler.superseded, 2)
+
+            # Other users are not affected
+            recorder.release.set()
+            self.assertEqual(await other, "b1")
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import settings_store
+from functions import default_settings
+from settings_store import FLAG_SETTINGS, MemoryBackend, SQLiteBackend, SettingsStore, UserSettings
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+class UserSettingsTest(unittest.TestCase):
+    def test_defaults(self):
+        self.assertEqual(dict(UserSettings()), dict(default_settings))
+
+    def test_bytes_round_trip_keeps_every_flag(self):
+        settings = UserSettings()
+        for i, name in enumerate(FLAG_SETTINGS):
+            settings[name] = "ON" if i % 2 else "OFF"
+        settings["rage"] = 0.25
+        restored = UserSettings.from_bytes(settings.to_bytes())
+        self.assertEqual(dict(restored), dict(settings))
+        for name in FLAG_SETTINGS:
+            restored[name] = "ON"
+        self.assertTrue(all(restored[name] == "ON" for name in FLAG_SETTINGS))
+
+    def test_fixed_schema(self):
+        settings = UserSettings()
+        with self.assertRaises(KeyError):
+            settings["unknown"] = 1
+        with self.assertRaises(TypeError):
+            del settings["rage"]
+
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(settings_store, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.path = os.path.join(workdir.name, "settings.sqlite3")
+
+    def backends(self):
+        return {"memory": lambda: MemoryBackend(), "sqlite": lambda: SQLiteBackend(self.path)}
+
+
+class SettingsStoreTest(StoreTestCase):
+    def test_copy_on_read(self):
+        async def run(backend):
+            store = SettingsStore(backend)
+            started_with = await store.get(1)
+            adjusted = await store.get(1)
+            adjusted["rage"] = 0.9
+            self.assertEqual(started_with["rage"], default_settings["rage"])
+            self.assertEqual((await store.get(1))["rage"], default_settings["rage"])
+
+            await store.save(1, adjusted)
+            adjusted["rage"] = 0.1  # the caller's object stays its own
+            self.assertEqual((await store.get(1))["rage"], 0.9)
+            self.assertEqual(started_with["rage"], default_settings["rage"])
+            await store.close()
+
+        for name, backend in self.backends().items():
+            with self.subTest(name):
+                asyncio.run(run(backend()))
+
+    def test_change_by_another_process_is_read_after_the_cache_ttl(self):
+        async def run(make_backend):
+            backend = make_backend()
+            store = SettingsStore(backend, cache_ttl=30)
+            other = SettingsStore(backend, cache_ttl=30)  # another bot process sharing the backend
+            self.assertEqual((await store.get(1))["rage"], default_settings["rage"])
+
+            changed = await other.get(1)
+            changed["rage"] = 0.75
+            changed[FLAG_SETTINGS[0]] = "ON"
+            await other.save(1, changed)
+
+            self.clock.now += 29
+            self.assertEqual((await store.get(1))["rage"], default_settings["rage"])
+            self.clock.now += 1
+            reloaded = await store.get(1)
+            self.assertEqual(reloaded["rage"], 0.75)
+            self.assertEqual(reloaded[FLAG_SETTINGS[0]], "ON")
+            await store.close()
+
+        for name, make_backend in self.backends().items():
+            with self.subTest(name):
+                asyncio.run(run(make_backend))
+
+    def test_least_recently_used_users_leave_the_cache(self):
+        async def run():
+            store = SettingsStore(MemoryBackend(), max_cached=2)
+            for user_id in (1, 2):
+                await store.get(user_id)
+            await store.get(1)
+            await store.get(3)
+            self.assertEqual(list(store._cache), [1, 3])
+
+        asyncio.run(run())
+
+
+class BackendTtlTest(StoreTestCase):
+    def test_entries_expire(self):
+        async def run(backend):
+            await backend.save(1, b"data")
+            self.clock.now += 59
+            self.assertEqual(await backend.load(1), b"data")
+            self.clock.now += 1
+            self.assertIsNone(await backend.load(1))
+            await backend.close()
+
+        for backend in (MemoryBackend(ttl=60), SQLiteBackend(self.path, ttl=60)):
+            with self.subTest(type(backend).__name__):
+                asyncio.run(run(backend))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resp import RespClient, RespServer
+from workqueue import JOBS_KEY, WORKERS_KEY, QueueWorker, WorkDispatcher, _weight
+
+
+class FakeMessage:
+    def __init__(self, chat_id, message_id):
+        self.chat_id = chat_id
+        self.id = message_id
+
+
+class RecordingCoalescer:
+    def __init__(self):
+        self.edits = []
+
+    def submit(self, message, text):
+        self.edits.append((message.id, text))
+
+    async def edit_now(self, message, text):
+        self.edits.append((message.id, text))
+
+
+class WorkQueueTestCase(unittest.TestCase):
+    def run_with_server(self, test):
+        async def run():
+            server = await RespServer().start()
+            client = RespClient(port=server.port)
+            try:
+                await test(server, client)
+            finally:
+                await client.close()
+                await server.stop()
+
+        asyncio.run(run())
+
+
+class WorkerLossTest(WorkQueueTestCase):
+    def test_jobs_of_a_lost_worker_move_or_fail(self):
+        async def test(server, client):
+            user_id = 7
+            first, second = sorted(("worker-a", "worker-b"), key=lambda worker_id: _weight(worker_id, user_id),
+                                   reverse=True)
+            await client.hset(WORKERS_KEY, first, time.time())
+            await client.hset(WORKERS_KEY, second, time.time())
+            coalescer = RecordingCoalescer()
+            dispatcher = WorkDispatcher(None, coalescer, None, port=server.port, heartbeat_timeout=10)
+            try:
+                await dispatcher._refresh_workers()
+                running, queued = FakeMessage(user_id, 1), FakeMessage(user_id, 2)
+                await dispatcher.submit(user_id, running, {"kind": "text", "text": "one"})
+                await dispatcher.submit(user_id, queued, {"kind": "text", "text": "two"})
+                self.assertEqual(await client.llen(JOBS_KEY.format(first)), 2)
+                await client.lpop(JOBS_KEY.format(first))  # the first worker took one job, then died
+
+                await client.hset(WORKERS_KEY, first, time.time() - 60)
+                await dispatcher._refresh_workers()
+
+                self.assertEqual(dispatcher.workers, [second])
+                self.assertEqual(await client.llen(JOBS_KEY.format(first)), 0)
+                moved = json.loads(await client.lpop(JOBS_KEY.format(second)))
+                self.assertEqual((moved["message_id"], moved["text"]), (2, "two"))
+                self.assertEqual(dispatcher.requeued, 1)
+                self.assertEqual(dispatcher._jobs[(user_id, 2)][0], second)
+                self.assertNotIn((user_id, 1), dispatcher._jobs)
+                self.assertEqual([message_id for message_id, _ in coalescer.edits], [1])
+                self.assertEqual(dispatcher._inflight[user_id], [second, 1])
+            finally:
+                await dispatcher.close()
+
+        self.run_with_server(test)
+
+    def test_queued_jobs_fail_when_no_worker_is_left(self):
+        async def test(server, client):
+            await client.hset(WORKERS_KEY, "worker-a", time.time())
+            coalescer = RecordingCoalescer()
+            dispatcher = WorkDispatcher(None, coalescer, None, port=server.port, heartbeat_timeout=10)
+            try:
+                await dispatcher._refresh_workers()
+                await dispatcher.submit(1, FakeMessage(1, 1), {"kind": "text", "text": "one"})
+                await client.hset(WORKERS_KEY, "worker-a", time.time() - 60)
+                await dispatcher._refresh_workers()
+                self.assertFalse(dispatcher.has_workers())
+                self.assertEqual(len(coalescer.edits), 1)
+                self.assertEqual(dispatcher._jobs, {})
+                self.assertEqual(dispatcher._inflight, {})
+            finally:
+                await dispatcher.close()
+
+        self.run_with_server(test)
+
+
+class QueueWorkerTest(WorkQueueTestCase):
+    def test_jobs_are_popped_only_when_a_slot_is_free(self):
+        async def test(server, client):
+            worker = QueueWorker("worker-a", port=server.port, concurrency=2)
+            release = asyncio.Event()
+            started = []
+
+            async def handler(job):
+                started.append(job["job_id"])
+                await release.wait()
+
+            for job_id in range(1, 6):
+                await client.rpush(JOBS_KEY.format("worker-a"), json.dumps(
+                    {"job_id": job_id, "user_id": 1, "chat_id": 1, "message_id": job_id}))
+            run = asyncio.ensure_future(worker.run(handler))
+            try:
+                while len(started) < 2:
+                    await asyncio.sleep(0.01)
+                await asyncio.sleep(0.05)
+                self.assertEqual(started, [1, 2])
+                self.assertEqual(await client.llen(JOBS_KEY.format("worker-a")), 3)
+
+                release.set()
+                while len(started) < 5:
+                    await asyncio.sleep(0.01)
+                self.assertEqual(await client.llen(JOBS_KEY.format("worker-a")), 0)
+            finally:
+                run.cancel()
+                await asyncio.gather(run, return_exceptions=True)
+                await worker.close()
+            self.assertEqual(worker.jobs_done, 5)
+            self.assertEqual(await client.hgetall(WORKERS_KEY), {})
+
+        self.run_with_server(test)
+
+
+if __name__ == '__main__':
+    unittest.main()
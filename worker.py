@@ -0,0 +1,69 @@
+"""Worker process for receiver mode.
+
+Set ``queue_enabled = true`` in config.ini and start the bot as usual; it
+becomes the receiver. Then start as many workers as you like, at any time:
+
+    python worker.py --id w1
+    python worker.py --id w2 --metrics-port 9465
+
+Workers share the receiver's config.ini, caches and stores, but never talk
+to Telegram themselves.
+"""
+import argparse
+import asyncio
+import configparser
+
+import metrics
+import script
+from functions import configure_logging, send_logs
+from workqueue import QueueWorker
+
+
+async def main(args):
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    worker = QueueWorker(
+        args.id,
+        host=config.get('default', 'queue_host', fallback='127.0.0.1'),
+        port=config.getint('default', 'queue_port', fallback=6379),
+        concurrency=args.concurrency
+    )
+    script.create_app(args.config, worker=worker)
+    # One log file per worker, rotation does not work across processes
+    configure_logging(
+        path=f"learnkeybot.{worker.worker_id}.log",
+        level=config.get('default', 'log_level', fallback='INFO'),
+        json_lines=config.getboolean('default', 'log_json', fallback=False)
+    )
+
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = await metrics.MetricsServer(port=args.metrics_port).start()
+    try:
+        await worker.run(script.run_job)
+    finally:
+        send_logs(f"Worker stats: {worker.stats()}", 'info')
+        await script.llm.close()
+        script.pdf_extractor.shutdown()
+        script.cache.close()
+        script.deadline_store.close()
+        if script.document_index is not None:
+            script.document_index.close()
+        await script.settings_store.close()
+        if script.conversation_memory is not None:
+            await script.conversation_memory.close()
+        await worker.close()
+        if metrics_server is not None:
+            await metrics_server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a bot worker that takes jobs from the receiver")
+    parser.add_argument("--id", default=None, help="worker id, defaults to host-pid")
+    parser.add_argument("--config", default="config.ini")
+    parser.add_argument("--concurrency", type=int, default=16, help="jobs run at once (different users)")
+    parser.add_argument("--metrics-port", type=int, default=0)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
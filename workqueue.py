@@ -0,0 +1,417 @@
+"""Receiver/worker split over a Redis-protocol queue.
+
+The receiver keeps the only Telegram session. It answers the cheap
+commands itself and pushes text and PDF jobs onto ``jobs:<worker_id>``
+lists; each worker pops its own list, runs the LLM and PDF work and sends
+every Telegram call back as an op on the shared ``outbox`` list, which the
+receiver applies through its edit coalescer (so the per-bot rate budget
+stays in one place).
+
+Workers announce themselves with heartbeats in the ``workers`` hash, so
+they can be started and stopped while the receiver runs. Users are pinned
+to a worker while they have jobs in flight and otherwise placed by
+rendezvous hashing, which keeps settings snapshots and reply order per user
+consistent and moves only ~1/N of users when a worker joins or leaves.
+Since a user's jobs run on one worker, a newer message supersedes the
+older generation there just as it does in a single process.
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import time
+
+from functions import send_logs
+from resp import RespClient
+
+JOBS_KEY = "jobs:{}"
+OUTBOX_KEY = "outbox"
+WORKERS_KEY = "workers"
+
+
+def _weight(worker_id, user_id):
+    digest = hashlib.blake2b(f"{worker_id}:{user_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class WorkDispatcher:
+    """Receiver side: routes jobs to live workers and applies their Telegram ops"""
+
+    def __init__(self, client, edit_coalescer, reminder_scheduler, host="127.0.0.1", port=6379,
+                 heartbeat_timeout=10.0, poll_interval=2.0):
+        self.client = client
+        self.edit_coalescer = edit_coalescer
+        self.reminder_scheduler = reminder_scheduler
+        self.host = host
+        self.port = port
+        self.heartbeat_timeout = heartbeat_timeout
+        self.poll_interval = poll_interval
+        self._queue = RespClient(host, port)
+        self._outbox = RespClient(host, port)  # dedicated connection for BLPOP
+        self._workers = []
+        self._inflight = {}    # user_id -> [worker_id, jobs in flight]
+        self._messages = {}    # (chat_id, message_id) -> Telegram message being edited
+        self._sent = {}        # user_id -> keys in _messages of messages sent for a worker
+        self._chains = {}      # user_id -> task applying that user's ops in order
+        self._jobs = {}        # (chat_id, message_id) -> (worker_id, user_id, spooled PDF path or None)
+        self._job_ids = itertools.count(1)
+        self._tasks = []
+
+        # Metrics
+        self.submitted = 0
+        self.completed = 0
+        self.requeued = 0
+        self.ops_applied = 0
+
+    @property
+    def workers(self):
+        return list(self._workers)
+
+    def has_workers(self):
+        return bool(self._workers)
+
+    async def start(self):
+        await self._refresh_workers()
+        self._tasks = [asyncio.ensure_future(self._watch_workers()), asyncio.ensure_future(self._apply_ops())]
+        send_logs("Work dispatcher started on %s:%s, %s workers", 'info', self.host, self.port, len(self._workers))
+
+    def _pick(self, user_id):
+        inflight = self._inflight.get(user_id)
+        if inflight is not None and inflight[0] in self._workers:
+            return inflight[0]
+        return max(self._workers, key=lambda worker_id: _weight(worker_id, user_id))
+
+    async def submit(self, user_id, message, job):
+        """Queue ``job`` (a JSON-able dict) for ``user_id``; ``message`` is the reply being edited"""
+        worker_id = self._pick(user_id)
+        job = dict(job, job_id=next(self._job_ids), user_id=user_id, chat_id=message.chat_id, message_id=message.id)
+        self._messages[(message.chat_id, message.id)] = message
+        self._jobs[(message.chat_id, message.id)] = (worker_id, user_id, job.get("path"))
+        inflight = self._inflight.setdefault(user_id, [worker_id, 0])
+        inflight[0] = worker_id
+        inflight[1] += 1
+        self.submitted += 1
+        await self._queue.rpush(JOBS_KEY.format(worker_id), json.dumps(job))
+
+    async def _refresh_workers(self):
+        now = time.time()
+        beats = await self._queue.hgetall(WORKERS_KEY)
+        alive = sorted(worker_id.decode() for worker_id, beat in beats.items() if now - float(beat) <= self.heartbeat_timeout)
+        gone = [worker_id for worker_id in self._workers if worker_id not in alive]
+        joined = [worker_id for worker_id in alive if worker_id not in self._workers]
+        self._workers = alive
+        if joined:
+            send_logs("Workers joined: %s (%s live)", 'info', ', '.join(joined), len(alive))
+        for worker_id in gone:
+            send_logs("Worker %s stopped sending heartbeats, moving its queued jobs", 'warning', worker_id)
+            await self._queue.hdel(WORKERS_KEY, worker_id)
+            await self._requeue(worker_id)
+            await self._drop_running(worker_id)
+
+    def _release(self, user_id):
+        inflight = self._inflight.get(user_id)
+        if inflight is not None:
+            inflight[1] -= 1
+            if inflight[1] <= 0:
+                del self._inflight[user_id]
+
+    @staticmethod
+    def _remove_spool(path):
+        # The worker deletes the file when it is done with it, this covers jobs it never ran
+        if path:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    async def _requeue(self, worker_id):
+        while True:
+            raw = await self._queue.lpop(JOBS_KEY.format(worker_id))
+            if raw is None:
+                return
+            job = json.loads(raw)
+            key = (job["chat_id"], job["message_id"])
+            message = self._messages.get(key)
+            self._release(job["user_id"])
+            if message is not None and self._workers:
+                self.requeued += 1
+                await self.submit(job["user_id"], message, {k: v for k, v in job.items()
+                                                           if k not in ("job_id", "user_id", "chat_id", "message_id")})
+                continue
+            self._jobs.pop(key, None)
+            self._remove_spool(job.get("path"))
+            if message is not None:
+                self._messages.pop(key, None)
+                await self.edit_coalescer.edit_now(message, "⚠️ No worker is available right now, please send it again.")
+
+    async def _drop_running(self, worker_id):
+        """Jobs a stopped worker had already taken: they will never finish"""
+        for key, (owner, user_id, path) in list(self._jobs.items()):
+            if owner != worker_id:
+                continue
+            del self._jobs[key]
+            self._remove_spool(path)
+            self._release(user_id)
+            message = self._messages.pop(key, None)
+            if message is None:
+                continue
+            await self.edit_coalescer.edit_now(message, "⚠️ The worker handling this stopped, please send it again.")
+
+    async def _watch_workers(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self._refresh_workers()
+            except Exception as e:
+                send_logs("Worker registry check failed: %s", 'warning', e)
+
+    def _chain(self, user_id, coroutine):
+        previous = self._chains.get(user_id)
+
+        async def run():
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            try:
+                await coroutine
+            except Exception as e:
+                send_logs("Worker op for user %s failed: %s", 'warning', user_id, e)
+
+        task = self._chains[user_id] = asyncio.ensure_future(run())
+        task.add_done_callback(lambda t: self._chains.pop(user_id, None) if self._chains.get(user_id) is t else None)
+
+    async def _finish(self, op):
+        self.completed += 1
+        key = (op["chat_id"], op["message_id"])
+        self._messages.pop(key, None)
+        _, _, path = self._jobs.pop(key, (None, None, None))
+        self._remove_spool(path)
+        self._release(op["user_id"])
+        if op["user_id"] not in self._inflight:
+            for key in self._sent.pop(op["user_id"], ()):
+                self._messages.pop(key, None)
+
+    async def _send(self, op):
+        message = await self.client.send_message(op["user_id"], op["text"], parse_mode="Markdown")
+        if op.get("ref"):
+            # The worker keeps editing this message by the reference it chose
+            key = (op["user_id"], op["ref"])
+            self._messages[key] = message
+            self._sent.setdefault(op["user_id"], []).append(key)
+
+    async def _edit(self, op):
+        message = self._messages.get((op["chat_id"], op["message_id"]))
+        if message is None:
+            return
+        if op["op"] == "preview":
+            self.edit_coalescer.submit(message, op["text"])
+        else:
+            await self.edit_coalescer.edit_now(message, op["text"])
+
+    def _apply(self, op):
+        kind = op["op"]
+        user_id = op.get("user_id")
+        if kind == "schedule":
+            self._chain(user_id, self.reminder_scheduler.schedule(user_id, op["deadlines"]))
+            return
+        if kind == "send":
+            self._chain(user_id, self._send(op))
+        elif kind == "done":
+            self._chain(user_id, self._finish(op))
+        elif kind in ("preview", "final"):
+            # Chained as well: the message may be one a queued "send" has not created yet
+            self._chain(user_id, self._edit(op))
+
+    async def _apply_ops(self):
+        while True:
+            try:
+                popped = await self._outbox.blpop([OUTBOX_KEY], timeout=1)
+            except Exception as e:
+                send_logs("Outbox read failed: %s", 'warning', e)
+                await asyncio.sleep(1)
+                continue
+            if popped is None:
+                continue
+            self.ops_applied += 1
+            self._apply(json.loads(popped[1]))
+
+    def stats(self):
+        return {
+            "workers": len(self._workers),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "requeued": self.requeued,
+            "ops_applied": self.ops_applied,
+            "users_in_flight": len(self._inflight),
+        }
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._queue.close()
+        await self._outbox.close()
+
+
+class QueueWorker:
+    """Worker side: pops jobs from its list, runs them and posts ops to the outbox.
+
+    Up to ``concurrency`` jobs run at once, and a job is only popped when a
+    slot is free, so the backlog stays in the shared list. Jobs of one user are not
+    serialized: like handlers in a single process, a newer message reaches
+    the generation scheduler and supersedes the older one.
+    """
+
+    def __init__(self, worker_id=None, host="127.0.0.1", port=6379, concurrency=16, heartbeat_interval=2.0):
+        self.worker_id = worker_id or f"{os.uname().nodename}-{os.getpid()}"
+        self.host = host
+        self.port = port
+        self.concurrency = concurrency
+        self.heartbeat_interval = heartbeat_interval
+        self._queue = RespClient(host, port)
+        self._jobs = RespClient(host, port)  # dedicated connection for BLPOP
+        self._slots = None
+        self._running = set()
+
+        # Metrics
+        self.jobs_done = 0
+        self.jobs_failed = 0
+
+    async def push_op(self, op):
+        await self._queue.rpush(OUTBOX_KEY, json.dumps(op))
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                await self._queue.hset(WORKERS_KEY, self.worker_id, time.time())
+            except Exception as e:
+                send_logs("Heartbeat failed: %s", 'warning', e)
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _run_job(self, handler, job):
+        try:
+            await handler(job)
+            self.jobs_done += 1
+        except Exception as e:
+            self.jobs_failed += 1
+            send_logs("Job %s for user %s failed: %s", 'error', job.get('job_id'), job['user_id'], e)
+        finally:
+            self._slots.release()
+            await self.push_op({"op": "done", "user_id": job["user_id"],
+                                "chat_id": job["chat_id"], "message_id": job["message_id"]})
+
+    async def run(self, handler):
+        """Process jobs with ``handler(job)`` until cancelled"""
+        self._slots = asyncio.Semaphore(self.concurrency)
+        heartbeat = asyncio.ensure_future(self._heartbeat())
+        send_logs("Worker %s waiting for jobs on %s:%s", 'info', self.worker_id, self.host, self.port)
+        try:
+            while True:
+                # Only pop what can start now: queued jobs stay in the list, where the
+                # receiver can move them to another worker if this one dies
+                await self._slots.acquire()
+                try:
+                    popped = await self._jobs.blpop([JOBS_KEY.format(self.worker_id)], timeout=1)
+                except (ConnectionError, OSError) as e:
+                    self._slots.release()
+                    send_logs("Queue connection lost: %s", 'warning', e)
+                    await asyncio.sleep(1)
+                    continue
+                except BaseException:
+                    self._slots.release()
+                    raise
+                if popped is None:
+                    self._slots.release()
+                    continue
+                task = asyncio.ensure_future(self._run_job(handler, json.loads(popped[1])))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+        finally:
+            heartbeat.cancel()
+            try:
+                await self._queue.hdel(WORKERS_KEY, self.worker_id)
+            except Exception:
+                pass
+
+    def stats(self):
+        return {"worker_id": self.worker_id, "jobs_done": self.jobs_done, "jobs_failed": self.jobs_failed,
+                "running_jobs": len(self._running)}
+
+    async def close(self):
+        await self._queue.close()
+        await self._jobs.close()
+
+
+class RemoteMessage:
+    """The receiver's message as seen by a worker: just its address"""
+
+    __slots__ = ("chat_id", "id")
+
+    def __init__(self, chat_id, message_id):
+        self.chat_id = chat_id
+        self.id = message_id
+
+
+class RemoteTelegram:
+    """Worker stand-in for TelegramClient: sends go to the receiver's outbox"""
+
+    def __init__(self, worker):
+        self.worker = worker
+        self._refs = itertools.count(1)
+
+    def add_event_handler(self, callback, event_builder):
+        pass  # workers never receive updates
+
+    async def send_message(self, entity, message, **kwargs):
+        sent = RemoteMessage(entity, f"{self.worker.worker_id}:{next(self._refs)}")
+        await self.worker.push_op({"op": "send", "user_id": entity, "text": message, "ref": sent.id})
+        return sent
+
+
+class RemoteEditCoalescer:
+    """Worker stand-in for EditCoalescer: previews and final edits go to the outbox"""
+
+    def __init__(self, worker):
+        self.worker = worker
+        self._pending = set()
+
+    def submit(self, message, text):
+        op = {"op": "preview", "chat_id": message.chat_id, "message_id": message.id, "text": text}
+        task = asyncio.ensure_future(self.worker.push_op(op))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def edit_now(self, message, text):
+        # Let queued previews reach the outbox first, the final text must be last
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        await self.worker.push_op({"op": "final", "chat_id": message.chat_id, "message_id": message.id, "text": text})
+
+    def forget(self, message):
+        pass
+
+    def stats(self):
+        return {"pending": len(self._pending)}
+
+    async def close(self):
+        pass
+
+
+class RemoteReminders:
+    """Worker stand-in for ReminderScheduler: the receiver stores and sends reminders"""
+
+    def __init__(self, worker):
+        self.worker = worker
+
+    def start(self):
+        pass
+
+    async def schedule(self, user_id, deadlines):
+        await self.worker.push_op({"op": "schedule", "user_id": user_id, "deadlines": deadlines})
+
+    def stats(self):
+        return {}
+
+    async def close(self):
+        pass